@@ -0,0 +1,275 @@
+"""
+asyncio based AC UDP Client module (python 3.5+ only, not importable on
+python 2)
+"""
+import asyncio
+import inspect
+import logging
+import struct
+import time
+
+from acudpclient import commands
+from acudpclient.client import ACUDPClientBase
+from acudpclient.correlation import ACUDPRequestTracker
+from acudpclient.exceptions import NotEnoughBytes
+
+LOG = logging.getLogger("ac_udp_client")
+
+
+class ACUDPProtocol(asyncio.DatagramProtocol):
+    """ Datagram protocol handing every received datagram to a client """
+
+    def __init__(self, client):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPAsyncClient instance
+        """
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.datagram_received(data)
+
+    def error_received(self, exc):
+        LOG.warning("UDP error received: %r", exc)
+
+
+class ACUDPAsyncClient(ACUDPClientBase):
+    """ This class represents the asyncio UDP Client. Each received datagram
+    is decoded on its own and queued as one event, which is consumed with
+    get_next_event() or by iterating the client with async for.
+    Subscriber handlers can be plain functions or coroutines. """
+
+    def __init__(self, port=10000, host='127.0.0.1', remote_port=10001,
+                 queue_size=0, rcvbuf=None):
+        """ Constructor.
+
+        Keyword arguments:
+        port -- bind udp port
+        host -- remote udp host (ac server)
+        remote_port -- remote udp port (ac server)
+        queue_size -- max number of decoded events waiting to be consumed.
+        Events received when the queue is full are dropped (default: 0 -
+        unbounded)
+        rcvbuf -- socket receive buffer size in bytes (SO_RCVBUF)
+        (default: None - system default)
+        """
+        super(ACUDPAsyncClient, self).__init__(port, host, remote_port,
+                                               rcvbuf)
+        self.queue_size = queue_size
+        self.transport = None
+        self._queue = None
+        self._lazy = False
+        self._timestamps = False
+        self.request_tracker = None
+
+    async def listen(self, lazy=False, timestamps=False, flat_vectors=False):
+        """ Setup the listening socket and start receiving datagrams.
+
+        Keyword arguments:
+        lazy -- when True, events decode each field on first access
+        (default: False)
+        timestamps -- when True, event.timestamp is set to the time the
+        datagram was handed to the protocol (default: False)
+        flat_vectors -- see ACUDPClient.listen() (default: False)
+        """
+        self._set_flat_vectors(flat_vectors)
+        self.sock.bind(self.server_address)
+        self.sock.setblocking(False)
+        self._lazy = lazy
+        self._timestamps = timestamps
+        self._queue = asyncio.Queue(self.queue_size)
+        loop = asyncio.get_event_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: ACUDPProtocol(self), sock=self.sock)
+
+    def close(self):
+        """ Close the transport (and socket) """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def datagram_received(self, data):
+        """ Decode a datagram and queue the resulting event, decoding only
+        the fields declared by the subscribers (see subscribe()). Datagrams
+        that cannot be decoded are logged and skipped. """
+        try:
+            event, _ = self._decode(data, lazy=self._lazy, fields=self._fields,
+                                    classes=self._classes)
+        except (NotEnoughBytes, NotImplementedError,
+                UnicodeDecodeError, struct.error) as err:
+            LOG.warning("Skipping bad datagram (%d bytes): %r",
+                        len(data), err)
+            return
+        if self._timestamps:
+            event.timestamp = time.time()
+        if self.request_tracker is not None:
+            self.request_tracker.resolve(event)
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            LOG.warning("Event queue full, dropping %s", event.packet_name())
+
+    def _timed_handler(self, handler, type_, name):
+        """ Return handler wrapped to record its time in the metrics.
+        Coroutine handlers are timed until they complete, not just until
+        they return their coroutine. """
+        if not inspect.iscoroutinefunction(handler):
+            return super(ACUDPAsyncClient, self)._timed_handler(
+                handler, type_, name)
+        from acudpclient.metrics import perf_counter_ns
+        by_handler, by_type = self.metrics.handler_histograms(name, type_)
+
+        async def timed(event):
+            start = perf_counter_ns()
+            try:
+                return await handler(event)
+            finally:
+                elapsed = perf_counter_ns() - start
+                by_handler.record(elapsed)
+                by_type.record(elapsed)
+        timed.__qualname__ = name
+        return timed
+
+    async def get_next_event(self, call_subscribers=True):
+        """ Wait for the next event and notify the subscribers. Coroutine
+        handlers are awaited, in subscription order.
+
+        Keyword arguments:
+        call_subscribers -- when True, subscribers get notified
+
+        Return the event object (subclass of ACUDPPacket). """
+        event = await self._queue.get()
+        if call_subscribers:
+            for handler in self._handlers[event._type]:
+                result = handler(event)
+                if inspect.isawaitable(result):
+                    await result
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get_next_event()
+
+    def send(self, data):
+        """ Send an encoded command (see acudpclient.commands) to the AC
+        server. Datagram transports never block, so this is not a coroutine
+        (and can be used by acudpclient.sender.ACUDPCommandQueue).
+
+        Keyword arguments:
+        data -- the datagram (bytes) """
+        self.transport.sendto(data, (self.host, self.remote_port))
+
+    async def _send(self, data):
+        """ Send a datagram to the AC server. """
+        self.send(data)
+
+    async def broadcast_message(self, message):
+        """ Broadcast a message to server.
+
+        Keyword arguments:
+        message -- the message to send (limited to 255 characters) """
+        await self._send(commands.broadcast_message(message))
+
+    async def send_message(self, car_id, message):
+        """ Send a message to a specific driver.
+
+        Keyword arguments:
+        car_id -- driver id that will receive the message
+        message -- the message to send (limited to 255 characters) """
+        await self._send(commands.send_message(car_id, message))
+
+    async def get_car_info(self, car_id):
+        """ Request CAR_INFO packet.
+
+        Keyword arguments:
+        car_id -- the driver id we want """
+        await self._send(commands.get_car_info(car_id))
+
+    async def get_session_info(self, session_index=-1):
+        """ Request SESSION_INFO packet.
+
+        Keyword arguments:
+        session_index -- the session we want (default: -1 - current session)"""
+        await self._send(commands.get_session_info(session_index))
+
+    def _request_tracker(self):
+        """ Return self.request_tracker, creating a default
+        ACUDPRequestTracker bound to the running loop the first time. """
+        if self.request_tracker is None:
+            loop = asyncio.get_event_loop()
+            address = (self.host, self.remote_port)
+            self.request_tracker = ACUDPRequestTracker(
+                lambda data: self.transport.sendto(data, address),
+                future_factory=loop.create_future,
+                schedule=loop.call_later)
+        return self.request_tracker
+
+    async def request_car_info(self, car_id):
+        """ Request CAR_INFO packet and wait for its response. Concurrent
+        requests for the same car_id send a single datagram, requests are
+        retried on timeout and recent responses are served from cache.
+
+        Keyword arguments:
+        car_id -- the driver id we want
+
+        Return the CarInfo event. Raise RequestTimeout if there's no
+        response. """
+        return await self._request_tracker().car_info(car_id)
+
+    async def request_session_info(self, session_index=-1):
+        """ Request SESSION_INFO packet and wait for its response, see
+        request_car_info().
+
+        Keyword arguments:
+        session_index -- the session we want (default: -1 - current session)
+
+        Return the SessionInfo event. Raise RequestTimeout if there's no
+        response. """
+        return await self._request_tracker().session_info(session_index)
+
+    async def enable_realtime_report(self, hz_ms=1000):
+        """ Enable real time telemetry report.
+
+        Keyword arguments:
+        hz_ms -- the frequency we want to get reports, in milliseconds. Use 0
+        to disable real time reporting (default: 1000) """
+        await self._send(commands.enable_realtime_report(hz_ms))
+
+    async def kick_user(self, car_id):
+        """ Kick a driver.
+
+        Keyword arguments:
+        car_id -- driver id to kick """
+        await self._send(commands.kick_user(car_id))
+
+    async def next_session(self):
+        """ Move the server to the next session. """
+        await self._send(commands.next_session())
+
+    async def restart_session(self):
+        """ Restart the current session. """
+        await self._send(commands.restart_session())
+
+    async def admin_command(self, command):
+        """ Run an admin command (e.g. "/ballast 0 50").
+
+        Keyword arguments:
+        command -- the command (limited to 255 characters) """
+        await self._send(commands.admin_command(command))
+
+    async def set_session_info(self, session_index, name, session_type, laps,
+                               time_s, wait_time_s):
+        """ Change a session.
+
+        Keyword arguments:
+        session_index -- the session to change
+        name -- session name (limited to 255 characters)
+        session_type -- session type (as in SessionInfo.session_type)
+        laps -- number of laps
+        time_s -- session duration, in seconds
+        wait_time_s -- wait time before the session starts, in seconds """
+        await self._send(commands.set_session_info(
+            session_index, name, session_type, laps, time_s, wait_time_s))
@@ -0,0 +1,281 @@
+"""
+Lap and leaderboard analytics over LapCompleted and CarUpdate events,
+backed by NumPy arrays. Requires numpy.
+"""
+from acudpclient.batch import _require_numpy, numpy
+
+LAP_DTYPE = [
+    ('car_id', '<u1'),
+    ('lap', '<u2'),
+    ('lap_time', '<u4'),
+    ('cuts', '<u1'),
+    ('timestamp', '<f8'),
+]
+"""Row of the lap table. lap is the car's lap number (1 based), as counted
+by the server's leaderboard."""
+
+STATS_DTYPE = [
+    ('car_id', '<u1'),
+    ('laps', '<u4'),
+    ('valid_laps', '<u4'),
+    ('best', '<f8'),
+    ('mean', '<f8'),
+    ('std', '<f8'),
+    ('last', '<f8'),
+]
+"""Row of session_stats(). Times are in milliseconds, NaN when unknown."""
+
+
+class ACUDPLapAnalytics(object):
+    """ Subscriber keeping a lap table (one row per LapCompleted, in arrays
+    grown by doubling) and live per-car statistics, updated in O(1) per lap:
+    last lap, best, mean and standard deviation of valid laps (laps without
+    cuts), computed with Welford's algorithm.
+
+    CarUpdate events track each car's race progress (laps + normalized
+    spline position), which orders the standings, estimates gaps to the
+    leader and reports position changes. Whole session queries
+    (session_stats(), laps()) are vectorized over the lap table. """
+
+    def __init__(self, client=None, capacity=1024):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPClient to subscribe to (default: None - events are
+        fed by the caller)
+        capacity -- initial number of rows of the lap table (default: 1024)
+        """
+        _require_numpy()
+        self._capacity = capacity
+        self._watchers = []
+        self.reset()
+        if client is not None:
+            client.subscribe(self)
+
+    def reset(self):
+        """ Forget every lap and car (done on every new session). """
+        self._table = numpy.zeros(self._capacity, dtype=LAP_DTYPE)
+        self._size = 0
+        self.lap_count = numpy.zeros(256, dtype=numpy.uint32)
+        self._lap = numpy.zeros(256, dtype=numpy.uint32)
+        self.valid_count = numpy.zeros(256, dtype=numpy.uint32)
+        self.last = numpy.full(256, numpy.nan)
+        self.best = numpy.full(256, numpy.nan)
+        self.mean = numpy.full(256, numpy.nan)
+        self._m2 = numpy.zeros(256)
+        self.progress = numpy.full(256, numpy.nan)
+        self._crossings = numpy.zeros(256, dtype=numpy.int64)
+        self._spline = numpy.full(256, numpy.nan)
+        self._order = []
+        self._position = {}
+
+    def watch_positions(self, callback):
+        """ Register a position change callback, called as
+        callback(car_id, old_position, new_position), positions being 1
+        based (old_position is None for a car entering the standings,
+        new_position is None for a car leaving them). """
+        self._watchers.append(callback)
+
+    def _append(self, row):
+        if self._size == len(self._table):
+            table = numpy.zeros(2 * len(self._table), dtype=LAP_DTYPE)
+            table[:self._size] = self._table
+            self._table = table
+        self._table[self._size] = row
+        self._size += 1
+
+    def remove(self, car_id):
+        """ Forget the live statistics and the standing of car_id, whose
+        slot is free for the next driver (its laps stay in the lap table).
+        The cars behind it move up a position. """
+        for values in (self.lap_count, self._lap, self.valid_count,
+                       self._m2, self._crossings):
+            values[car_id] = 0
+        for values in (self.last, self.best, self.mean, self.progress,
+                       self._spline):
+            values[car_id] = numpy.nan
+        index = self._position.pop(car_id, None)
+        if index is None:
+            return
+        del self._order[index]
+        changes = [(car_id, index + 1, None)]
+        for position in range(index, len(self._order)):
+            other = self._order[position]
+            self._position[other] = position
+            changes.append((other, position + 2, position + 1))
+        for callback in self._watchers:
+            for other, before, after in changes:
+                callback(other, before, after)
+
+    def on_ACSP_NEW_SESSION(self, _event):
+        self.reset()
+
+    def on_ACSP_CONNECTION_CLOSED(self, event):
+        self.remove(event.car_id)
+
+    def on_ACSP_LAP_COMPLETED(self, event):
+        car_id = event.car_id
+        self.lap_count[car_id] += 1
+        lap = self._lap[car_id] + 1
+        for entry in event.cars:
+            if entry.rcar_id == car_id:
+                # the server's count is right even when subscribed late
+                lap = entry.rlaps
+        self._lap[car_id] = lap
+        self._append((car_id, lap, event.lap_time, event.cuts,
+                      event.timestamp or numpy.nan))
+        lap_time = float(event.lap_time)
+        self.last[car_id] = lap_time
+        if event.cuts == 0 and lap_time > 0:
+            self.valid_count[car_id] += 1
+            count = self.valid_count[car_id]
+            if count == 1:
+                self.best[car_id] = self.mean[car_id] = lap_time
+                self._m2[car_id] = 0.0
+            else:
+                self.best[car_id] = min(self.best[car_id], lap_time)
+                delta = lap_time - self.mean[car_id]
+                self.mean[car_id] += delta / count
+                self._m2[car_id] += delta * (lap_time - self.mean[car_id])
+        # the server's lap counts are authoritative for the progress
+        for entry in event.cars:
+            if entry.rcar_id == car_id or \
+                    numpy.isnan(self._spline[entry.rcar_id]):
+                spline = self._spline[entry.rcar_id]
+                # the line may not be crossed yet, as seen from CarUpdate
+                self._crossings[entry.rcar_id] = entry.rlaps - (
+                    1 if entry.rcar_id == car_id and spline > 0.5 else 0)
+
+    def on_ACSP_CAR_UPDATE(self, event):
+        car_id = event.car_id
+        spline = event.normalized_spline_pos
+        previous = self._spline[car_id]
+        if previous - spline > 0.5:
+            self._crossings[car_id] += 1
+        elif spline - previous > 0.5:
+            self._crossings[car_id] -= 1
+        self._spline[car_id] = spline
+        progress = self._crossings[car_id] + spline
+        self.progress[car_id] = progress
+        self._reorder(car_id, progress)
+
+    def _reorder(self, car_id, progress):
+        """ Move car_id to its place in the standings, swapping it with the
+        cars it passed (or that passed it): O(1) when positions don't
+        change. """
+        order = self._order
+        old = self._position.get(car_id)
+        if old is None:
+            old_position = None
+            index = len(order)
+            order.append(car_id)
+        else:
+            old_position = index = old
+        moved = [car_id]
+        values = self.progress
+        while index > 0 and values[order[index - 1]] < progress:
+            order[index] = order[index - 1]
+            moved.append(order[index])
+            index -= 1
+        while index < len(order) - 1 and values[order[index + 1]] > progress:
+            order[index] = order[index + 1]
+            moved.append(order[index])
+            index += 1
+        order[index] = car_id
+        if index == old_position:
+            return
+        changes = []
+        for other in moved:
+            before = self._position.get(other)
+            after = order.index(other) if other != car_id else index
+            self._position[other] = after
+            changes.append((other, before, after))
+        for callback in self._watchers:
+            for other, before, after in changes:
+                callback(other, None if before is None else before + 1,
+                         after + 1)
+
+    def standings(self):
+        """ Return list of car_ids, from the leader down. """
+        return list(self._order)
+
+    def position(self, car_id):
+        """ Return the 1 based position of car_id, or None. """
+        index = self._position.get(car_id)
+        return None if index is None else index + 1
+
+    def gaps_to_leader(self):
+        """ Estimate the gap of every car to the leader, in milliseconds,
+        from the progress difference and the leader's mean lap time (or the
+        mean of every car when the leader has none).
+
+        Return dict of gaps indexed by car_id. """
+        if not self._order:
+            return {}
+        cars = numpy.array(self._order)
+        leader = cars[0]
+        lap_time = self.mean[leader]
+        if numpy.isnan(lap_time):
+            lap_time = numpy.nanmean(self.mean) if \
+                not numpy.all(numpy.isnan(self.mean)) else numpy.nan
+        gaps = (self.progress[leader] - self.progress[cars]) * lap_time
+        return dict(zip(cars.tolist(), gaps.tolist()))
+
+    def car_stats(self, car_id):
+        """ Return dict with the live statistics of car_id: laps,
+        valid_laps, last, best, mean and std (milliseconds, NaN when
+        unknown). """
+        count = int(self.valid_count[car_id])
+        return {
+            'laps': int(self.lap_count[car_id]),
+            'valid_laps': count,
+            'last': float(self.last[car_id]),
+            'best': float(self.best[car_id]),
+            'mean': float(self.mean[car_id]),
+            'std': float(numpy.sqrt(self._m2[car_id] / (count - 1)))
+            if count > 1 else numpy.nan,
+        }
+
+    def laps(self, car_id=None):
+        """ Return the lap table (a copy), or the laps of car_id only, as a
+        numpy structured array (see LAP_DTYPE). """
+        table = self._table[:self._size]
+        if car_id is not None:
+            table = table[table['car_id'] == car_id]
+        return table.copy()
+
+    def session_stats(self):
+        """ Compute the statistics of every car with laps, from the whole
+        lap table in one vectorized pass.
+
+        Return numpy structured array (see STATS_DTYPE), ordered by car_id.
+        """
+        table = self._table[:self._size]
+        car_ids, counts = numpy.unique(table['car_id'], return_counts=True)
+        stats = numpy.zeros(len(car_ids), dtype=STATS_DTYPE)
+        if not len(car_ids):
+            return stats
+        order = numpy.argsort(table['car_id'], kind='stable')
+        sorted_ = table[order]
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        times = sorted_['lap_time'].astype(numpy.float64)
+        valid = (sorted_['cuts'] == 0) & (times > 0)
+        valid_times = numpy.where(valid, times, numpy.nan)
+        valid_counts = numpy.add.reduceat(valid.astype(numpy.uint32), starts)
+        sums = numpy.add.reduceat(numpy.where(valid, times, 0.0), starts)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = sums / valid_counts
+            deviations = numpy.where(
+                valid, times - numpy.repeat(means, counts), 0.0)
+            stds = numpy.sqrt(numpy.add.reduceat(deviations ** 2, starts) /
+                              (valid_counts - 1.0))
+        stds[valid_counts < 2] = numpy.nan
+        bests = numpy.fmin.reduceat(valid_times, starts)
+        stats['car_id'] = car_ids
+        stats['laps'] = counts
+        stats['valid_laps'] = valid_counts
+        stats['best'] = bests
+        stats['mean'] = means
+        stats['std'] = stds
+        stats['last'] = times[starts + counts - 1]
+        return stats
@@ -0,0 +1,140 @@
+"""
+Columnar batch decoding of fixed size packets (e.g. CarUpdate) into NumPy
+structured arrays. Requires numpy.
+"""
+import logging
+import struct
+
+from acudpclient.packet_base import ACUDPPacket, CarUpdate
+from acudpclient.exceptions import NotEnoughBytes
+from acudpclient.types import UINT8, ACUDPStruct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = logging.getLogger("ac_udp_batch")
+
+# struct format char -> little-endian numpy type
+_NUMPY_TYPES = {
+    'B': '<u1',
+    'b': '<i1',
+    'H': '<u2',
+    'h': '<i2',
+    'I': '<u4',
+    'i': '<i4',
+    'f': '<f4',
+    'd': '<f8',
+}
+
+
+def _require_numpy():
+    """ Raise ImportError if numpy is not available. """
+    if numpy is None:
+        raise ImportError("numpy is required for batch decoding")
+
+
+def record_dtype(packet_class=CarUpdate):
+    """ Build the NumPy structured dtype matching the bytes of a fixed size
+    packet class (without its type byte). Formatters (e.g. BOOL) are not
+    applied, the raw values are kept.
+
+    Keyword arguments:
+    packet_class -- ACUDPPacket subclass with only fixed width fields
+    (default: CarUpdate)
+
+    Return numpy.dtype instance.
+    """
+    _require_numpy()
+    if packet_class._static_size is None:
+        raise ValueError("%s is not a fixed size packet" % (
+            packet_class.__name__,))
+    fields = []
+    for name, data_type in packet_class._bytes:
+        types = set(data_type.fmt)
+        if not isinstance(data_type, ACUDPStruct) or len(types) != 1:
+            raise ValueError("Field %s cannot be mapped to numpy" % (name,))
+        type_ = _NUMPY_TYPES[data_type.fmt[0]]
+        if data_type.count == 1:
+            fields.append((name, type_))
+        else:
+            fields.append((name, type_, (data_type.count,)))
+    return numpy.dtype(fields)
+
+
+def decode_records(buffer_, packet_class=CarUpdate, offset=0):
+    """ Decode every packet_class packet found in a buffer of concatenated
+    packets (a capture file or a batch of datagrams joined together) in a
+    single vectorized pass. Other packets are decoded with
+    ACUDPPacket.factory_from_buffer() and returned apart; those that cannot
+    be decoded (e.g. a bad string) are skipped and counted, as the client
+    does. Decoding stops at the first incomplete packet, or at a packet of
+    unknown type, whose size is unknown.
+
+    Keyword arguments:
+    buffer_ -- buffer object with concatenated packets
+    packet_class -- fixed size ACUDPPacket subclass (default: CarUpdate)
+    offset -- position in buffer_ to start reading from (default: 0)
+
+    Return tuple (numpy structured array of packet_class records, list of
+    other events, offset after the last decoded packet, number of skipped
+    packets).
+    """
+    dtype = record_dtype(packet_class)
+    type_ = packet_class._type
+    size = packet_class._static_size + 1
+    length = len(buffer_)
+    starts = []
+    others = []
+    skipped = 0
+    while offset < length:
+        packet_type, _ = UINT8.unpack_from(buffer_, offset)
+        if packet_type == type_:
+            if offset + size > length:
+                break
+            starts.append(offset + 1)
+            offset += size
+            continue
+        try:
+            event, offset = ACUDPPacket.factory_from_buffer(buffer_, offset)
+        except NotEnoughBytes:
+            break
+        except NotImplementedError as err:
+            LOG.warning("Stopping at offset %d: %r", offset, err)
+            break
+        except (UnicodeDecodeError, struct.error) as err:
+            # the fields' sizes are known without decoding them
+            try:
+                _, end = ACUDPPacket._registry[packet_type].from_buffer(
+                    buffer_, offset + 1, lazy=True)
+            except NotEnoughBytes:
+                break
+            LOG.warning("Skipping bad packet (%d bytes): %r",
+                        end - offset, err)
+            skipped += 1
+            offset = end
+            continue
+        others.append(event)
+    data = numpy.frombuffer(buffer_, dtype=numpy.uint8)
+    index = (numpy.asarray(starts, dtype=numpy.intp)[:, None] +
+             numpy.arange(dtype.itemsize, dtype=numpy.intp))
+    records = numpy.ascontiguousarray(data[index]).view(dtype).reshape(-1)
+    return records, others, offset, skipped
+
+
+def group_by_car(records):
+    """ Split records (as returned by decode_records()) by car_id, keeping
+    their original order.
+
+    Keyword arguments:
+    records -- numpy structured array with a car_id field
+
+    Return dict of numpy structured arrays indexed by car_id.
+    """
+    _require_numpy()
+    order = numpy.argsort(records['car_id'], kind='stable')
+    sorted_ = records[order]
+    car_ids, starts = numpy.unique(sorted_['car_id'], return_index=True)
+    return dict((int(car_id), group) for car_id, group in
+                zip(car_ids, numpy.split(sorted_, starts[1:])))
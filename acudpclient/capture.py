@@ -0,0 +1,463 @@
+"""
+Capture files: datagrams recorded by ACUDPClient, with their receive time,
+and side indexes (by packet type, car_id and session) for random access
+"""
+import array
+import bisect
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+
+from acudpclient.packet_base import ACUDPPacket, car_id_of
+from acudpclient.protocol import ACUDPConst
+from acudpclient.types import UINT8
+from acudpclient.exceptions import NotEnoughBytes
+
+MAGIC = b'ACUDPCAP'
+INDEX_MAGIC = b'ACUDPIDX'
+SORTED_MAGIC = b'ACUDPSRT'
+VERSION = 1
+
+HEADER = struct.Struct('<8sH')
+"""File header: magic, version."""
+RECORD = struct.Struct('<dH')
+"""Record header: receive timestamp, datagram size. The datagram follows."""
+INDEX_ENTRY = struct.Struct('<QHBh')
+"""Index entry: record offset, session, packet type, car_id (-1 if none)."""
+SORTED_HEADER = struct.Struct('<8sHQ')
+"""Sorted index header: magic, version, number of index entries covered.
+The last covered index entry follows, then TYPE_STARTS, CAR_STARTS and the
+entry numbers (NUMBER) sorted by packet type, then sorted by car_id."""
+TYPE_STARTS = struct.Struct('<257Q')
+"""Position of the first entry number of each packet type, and the end."""
+CAR_STARTS = struct.Struct('<258Q')
+"""Position of the first entry number of each car_id + 1 (0: no car_id),
+and the end."""
+NUMBER = struct.Struct('<I')
+"""Entry number, in capture order."""
+
+_replace = getattr(os, 'replace', os.rename)  # python 2
+
+
+def index_path(path):
+    """ Return the path of the index of capture file path. """
+    return path + '.idx'
+
+
+def sorted_index_path(path):
+    """ Return the path of the sorted index of capture file path. """
+    return path + '.sidx'
+
+
+class ACUDPCaptureWriter(object):
+    """ Writes datagrams to a capture file and its index. Sessions are
+    numbered from 0 and incremented on every ACSP_NEW_SESSION packet.
+
+    Record an ACUDPClient (datagram mode) by setting its recorder:
+
+        client.recorder = ACUDPCaptureWriter('/tmp/race.cap')
+    """
+
+    def __init__(self, path):
+        """ Constructor.
+
+        Keyword arguments:
+        path -- capture file path (overwritten). The index is written to
+        index_path(path)
+        """
+        self.path = path
+        self.session = 0
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._index = open(index_path(path), 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+        self._index.write(HEADER.pack(INDEX_MAGIC, VERSION))
+        self._offset = HEADER.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, datagram, timestamp=None):
+        """ Append a datagram.
+
+        Keyword arguments:
+        datagram -- buffer object holding one packet
+        timestamp -- receive time, in seconds since the epoch
+        (default: None - now)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.session, entry = _index_entry(self._offset, self.session,
+                                           datagram)
+        self._file.write(RECORD.pack(timestamp, len(datagram)))
+        self._file.write(datagram)
+        self._index.write(INDEX_ENTRY.pack(*entry))
+        self._offset += RECORD.size + len(datagram)
+        self.count += 1
+
+    def flush(self):
+        """ Flush the capture file and its index. """
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        """ Close the capture file and its index. """
+        if not self._file.closed:
+            self._file.close()
+            self._index.close()
+
+
+def _index_entry(offset, session, datagram):
+    """ Return (session, index entry tuple) tuple of the datagram recorded
+    at offset, session being incremented on ACSP_NEW_SESSION. """
+    type_ = UINT8.unpack_from(datagram)[0] if len(datagram) else 0
+    if type_ == ACUDPConst.ACSP_NEW_SESSION:
+        session += 1
+    car_id = car_id_of(datagram)
+    return session, (offset, session, type_, -1 if car_id is None else car_id)
+
+
+def _scan_records(data, offset=HEADER.size, session=0):
+    """ Return generator of the index entries of the records of a capture
+    file from offset on, by scanning them (not decoding them). A truncated
+    last record (still being written) is left out.
+
+    Keyword arguments:
+    data -- capture file contents
+    offset -- offset of the first record to index
+    session -- session of the record preceding offset
+    """
+    while offset + RECORD.size <= len(data):
+        size = RECORD.unpack_from(data, offset)[1]
+        start = offset + RECORD.size
+        if start + size > len(data):
+            break
+        session, entry = _index_entry(offset, session,
+                                      data[start:start + size])
+        yield entry
+        offset = start + size
+
+
+def _bucket_starts(keys, buckets):
+    """ Return list of the position of the first key of each bucket in
+    keys sorted, followed by len(keys). """
+    counts = [0] * buckets
+    for key in keys:
+        counts[key] += 1
+    starts = [0]
+    for count in counts:
+        starts.append(starts[-1] + count)
+    return starts
+
+
+def _write_sorted_index(path, index, count):
+    """ Write the sorted index of the first count entries of an index.
+
+    Keyword arguments:
+    path -- sorted index file path (replaced once written)
+    index -- index file contents
+    count -- number of index entries to cover
+    """
+    types = array.array('B')
+    car_ids = array.array('h')
+    for number in range(count):
+        _, _, type_, car_id = INDEX_ENTRY.unpack_from(
+            index, HEADER.size + number * INDEX_ENTRY.size)
+        types.append(type_)
+        car_ids.append(car_id + 1)
+    last = HEADER.size + (count - 1) * INDEX_ENTRY.size
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as sorted_index:
+        sorted_index.write(SORTED_HEADER.pack(SORTED_MAGIC, VERSION, count))
+        sorted_index.write(index[last:last + INDEX_ENTRY.size] if count else
+                           b'\0' * INDEX_ENTRY.size)
+        columns = []
+        for keys, starts, buckets in ((types, TYPE_STARTS, 256),
+                                      (car_ids, CAR_STARTS, 257)):
+            positions = _bucket_starts(keys, buckets)
+            sorted_index.write(starts.pack(*positions))
+            numbers = array.array('I', [0]) * count
+            for number, key in enumerate(keys):
+                numbers[positions[key]] = number
+                positions[key] += 1
+            columns.append(numbers)
+        for numbers in columns:
+            if sys.byteorder == 'big':
+                numbers.byteswap()
+            numbers.tofile(sorted_index)
+    _replace(temporary, path)
+
+
+def _read_numbers(data, offset, start, end):
+    """ Return generator of the entry numbers start to end of the sorted
+    list at offset in data, read by chunks. """
+    while start < end:
+        count = min(end - start, 1024)
+        for number in struct.unpack_from(
+                '<%dI' % (count,), data, offset + start * NUMBER.size):
+            yield number
+        start += count
+
+
+def _map(path):
+    """ Return (file, mmap) tuple of path, or None if it's missing or
+    empty. """
+    if not os.path.exists(path):
+        return None
+    file_obj = open(path, 'rb')
+    if not os.fstat(file_obj.fileno()).st_size:
+        file_obj.close()
+        return None
+    return file_obj, mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _unmap(mapped):
+    """ Close a (file, mmap) tuple returned by _map(). """
+    if mapped is not None and not mapped[0].closed:
+        mapped[1].close()
+        mapped[0].close()
+
+
+class _EntryField(object):
+    """ Sequence of one field of the entries of an ACUDPCaptureReader,
+    read on access (e.g. for bisect). """
+
+    def __init__(self, reader, field):
+        self.reader = reader
+        self.field = field
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, number):
+        return self.reader._entry(number)[self.field]
+
+
+class ACUDPCaptureReader(object):
+    """ Memory-mapped capture file reader. The index file is memory-mapped
+    too, and read on access: sessions are found by bisection (they only
+    grow) and packet types and car_ids through a sorted index file (see
+    sorted_index_path()), which lists the entries of each packet type and
+    of each car_id. Queries (e.g. the LapCompleted events of one car) only
+    visit the matching entries and records, and opening a capture doesn't
+    load its index.
+
+    A missing or stale index file is rebuilt, and the sorted index is
+    rebuilt when it doesn't cover the whole index file. The records an
+    index doesn't cover yet (capture still being written) are indexed in
+    memory only, leaving the file to its writer. """
+
+    def __init__(self, path):
+        """ Constructor.
+
+        Keyword arguments:
+        path -- capture file path
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        self._index = None
+        self._sorted = None
+        magic, version = HEADER.unpack_from(self._data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a capture file' % (path,))
+        # number of entries of the index file
+        self._indexed = 0
+        # entries of the records the index file doesn't cover yet, and
+        # their entry numbers by packet type and by car_id + 1
+        self._tail = []
+        self._tail_numbers = ({}, {})
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._indexed + len(self._tail)
+
+    def __iter__(self):
+        return self.records()
+
+    def _map_index(self):
+        """ Map the index file. Return (offset, session) of the first
+        record it doesn't cover, or None if it's missing or stale. """
+        self._index = _map(index_path(self.path))
+        if self._index is None:
+            return None
+        index = self._index[1]
+        if len(index) < HEADER.size or \
+                HEADER.unpack_from(index) != (INDEX_MAGIC, VERSION):
+            return None
+        # a partly written last entry is left out
+        self._indexed = (len(index) - HEADER.size) // INDEX_ENTRY.size
+        if not self._indexed:
+            return HEADER.size, 0
+        offset, session = self._entry(self._indexed - 1)[:2]
+        if self._entry(0)[0] != HEADER.size or \
+                offset + RECORD.size > len(self._data):
+            return None
+        offset += RECORD.size + RECORD.unpack_from(self._data, offset)[1]
+        if offset > len(self._data):
+            return None
+        return offset, session
+
+    def _map_sorted_index(self):
+        """ Map the sorted index. Return True if it covers the index file. """
+        self._sorted = _map(sorted_index_path(self.path))
+        if self._sorted is None:
+            return False
+        data = self._sorted[1]
+        if len(data) < SORTED_HEADER.size + INDEX_ENTRY.size or \
+                SORTED_HEADER.unpack_from(data) != (
+                    SORTED_MAGIC, VERSION, self._indexed):
+            return False
+        last = HEADER.size + (self._indexed - 1) * INDEX_ENTRY.size
+        return not self._indexed or \
+            data[SORTED_HEADER.size:SORTED_HEADER.size + INDEX_ENTRY.size] \
+            == self._index[1][last:last + INDEX_ENTRY.size]
+
+    def _load_index(self):
+        """ Map the index files, rebuilding them if they're missing or
+        stale, and index the records they don't cover in memory. """
+        uncovered = self._map_index()
+        if uncovered is None:
+            _unmap(self._index)
+            with open(index_path(self.path), 'wb') as index:
+                index.write(HEADER.pack(INDEX_MAGIC, VERSION))
+                for entry in _scan_records(self._data):
+                    index.write(INDEX_ENTRY.pack(*entry))
+            uncovered = self._map_index()
+        if not self._map_sorted_index():
+            _unmap(self._sorted)
+            _write_sorted_index(sorted_index_path(self.path),
+                                self._index[1], self._indexed)
+            self._map_sorted_index()
+        offset = SORTED_HEADER.size + INDEX_ENTRY.size
+        type_starts = TYPE_STARTS.unpack_from(self._sorted[1], offset)
+        offset += TYPE_STARTS.size
+        car_starts = CAR_STARTS.unpack_from(self._sorted[1], offset)
+        offset += CAR_STARTS.size
+        # (starts, offset of the entry numbers) by packet type, by car_id
+        self._columns = (
+            (type_starts, offset),
+            (car_starts, offset + self._indexed * NUMBER.size))
+        for entry in _scan_records(self._data, *uncovered):
+            number = len(self)
+            self._tail.append(entry)
+            for numbers, key in zip(self._tail_numbers,
+                                    (entry[2], entry[3] + 1)):
+                numbers.setdefault(key, []).append(number)
+
+    def _entry(self, number):
+        """ Return (record offset, session, type, car_id) entry number. """
+        if number < self._indexed:
+            return INDEX_ENTRY.unpack_from(
+                self._index[1], HEADER.size + number * INDEX_ENTRY.size)
+        return self._tail[number - self._indexed]
+
+    def _numbers(self, column, key):
+        """ Return (count, iterable) tuple of the entry numbers of a packet
+        type (column 0) or car_id + 1 (column 1), in capture order. """
+        starts, offset = self._columns[column]
+        if not 0 <= key < len(starts) - 1:
+            return 0, ()
+        start, end = starts[key], starts[key + 1]
+        tail = self._tail_numbers[column].get(key, ())
+        return end - start + len(tail), itertools.chain(
+            _read_numbers(self._sorted[1], offset, start, end), tail)
+
+    def close(self):
+        """ Unmap and close the capture file and its indexes. """
+        _unmap(self._sorted)
+        _unmap(self._index)
+        if not self._file.closed:
+            self._data.close()
+            self._file.close()
+
+    def find(self, types=None, car_id=None, session=None):
+        """ Find records in the index.
+
+        Keyword arguments:
+        types -- optional collection of packet type ids
+        car_id -- optional car_id
+        session -- optional session number (0 before the first
+        ACSP_NEW_SESSION)
+
+        Return generator of record offsets, in capture order. """
+        candidates = []
+        if session is not None:
+            sessions = _EntryField(self, 1)
+            start = bisect.bisect_left(sessions, session)
+            end = bisect.bisect_right(sessions, session, start)
+            candidates.append((end - start, itertools.islice(
+                itertools.count(start), end - start)))
+        if car_id is not None:
+            candidates.append(self._numbers(1, car_id + 1))
+        if types is not None:
+            types = frozenset(types)
+            by_type = [self._numbers(0, type_) for type_ in types]
+            candidates.append((
+                sum([count for count, _ in by_type]),
+                heapq.merge(*[numbers for _, numbers in by_type])))
+        if not candidates:
+            candidates.append((len(self), itertools.islice(
+                itertools.count(), len(self))))
+        for number in min(candidates, key=lambda candidate: candidate[0])[1]:
+            offset, session_, type_, car_id_ = self._entry(number)
+            if (types is None or type_ in types) and \
+                    (car_id is None or car_id_ == car_id) and \
+                    (session is None or session_ == session):
+                yield offset
+
+    def record(self, offset):
+        """ Read the record at offset.
+
+        Return (timestamp, datagram bytes) tuple. """
+        timestamp, size = RECORD.unpack_from(self._data, offset)
+        start = offset + RECORD.size
+        return timestamp, self._data[start:start + size]
+
+    def records(self, types=None, car_id=None, session=None):
+        """ Return generator of (timestamp, datagram bytes) tuples of the
+        records matching the query, see find(). """
+        for offset in self.find(types, car_id, session):
+            yield self.record(offset)
+
+    def events(self, types=None, car_id=None, session=None, lazy=False):
+        """ Return generator of decoded events matching the query (see
+        find()), with event.timestamp set to their receive time. Records
+        that cannot be decoded are skipped. """
+        for timestamp, datagram in self.records(types, car_id, session):
+            try:
+                event, _ = ACUDPPacket.factory_from_buffer(datagram,
+                                                           lazy=lazy)
+            except (NotEnoughBytes, NotImplementedError,
+                    UnicodeDecodeError, struct.error):
+                continue
+            event.timestamp = timestamp
+            yield event
+
+    def replay(self, client, types=None, car_id=None, session=None):
+        """ Notify the subscribers of client of the events matching the
+        query, see find().
+
+        Return number of events replayed. """
+        count = 0
+        handlers = client._handlers
+        for event in self.events(types, car_id, session):
+            for handler in handlers[event._type]:
+                handler(event)
+            count += 1
+        return count
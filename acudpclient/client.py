@@ -1,53 +1,180 @@
 """
 AC UDP Client module
 """
+import collections
+import errno
 import struct
 import socket
 import logging
 import io
+import select
+import sys
+import time
 
-from acudpclient.protocol import ACUDPConst
-from acudpclient.packet_base import ACUDPPacket
+from acudpclient import commands
+from acudpclient.packet_base import ACUDPPacket, flat_registry
+from acudpclient.types import UINT8
+from acudpclient.exceptions import NotEnoughBytes
 
 logging.basicConfig(level=logging.ERROR)
 LOG = logging.getLogger("ac_udp_client")
 
+# linux socket options, not exposed by the socket module
+if sys.platform.startswith('linux'):
+    SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+    SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+else:
+    SO_TIMESTAMPNS = None
+    SO_RXQ_OVFL = None
+# ancillary data (recvmsg) is not available on python 2
+_RECVMSG = hasattr(socket.socket, 'recvmsg_into')
 
-class ACUDPClient(object):
-    """ This class represents the UDP Client """
 
-    def __init__(self, port=10000, host='127.0.0.1', remote_port=10001):
+class ACUDPClientBase(object):
+    """ Base class of UDP clients, holding the socket and the subscribers """
+
+    def __init__(self, port=10000, host='127.0.0.1', remote_port=10001,
+                 rcvbuf=None):
         """ Constructor.
 
         Keyword arguments:
         port -- bind udp port
         host -- remote udp host (ac server)
         remote_port -- remote udp port (ac server)
+        rcvbuf -- socket receive buffer size in bytes (SO_RCVBUF), to absorb
+        bursts (default: None - system default)
         """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if rcvbuf is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            actual = self.sock.getsockopt(socket.SOL_SOCKET,
+                                          socket.SO_RCVBUF)
+            if actual < rcvbuf:
+                LOG.warning("SO_RCVBUF capped by the system to %d bytes",
+                            actual)
         self.server_address = ('0.0.0.0', port)
         self.remote_port = remote_port
         self.host = host
         self._subscribers = {}
-        self.file = None
+        self._subscriber_types = {}
+        self._subscriber_fields = {}
+        self._subscriber_names = {}
+        self._handlers = [()] * 256
+        self._fields = {}
+        self.metrics = None
+        self._classes = None
+        self._decode = ACUDPPacket.factory_from_buffer
+        self._decode_file = ACUDPPacket.factory
 
-    def listen(self):
-        """ Setup the listening socket """
-        self.sock.bind(self.server_address)
-        self.sock.setblocking(0)
-        self.file = io.open(self.sock.fileno(), mode='rb', buffering=4096)
+    def _build_handlers(self):
+        """ Resolve the on_<event_type> methods of every subscriber, once,
+        into a table of bound handlers indexed by packet type. """
+        handlers = [[] for _ in range(256)]
+        fields = {}
+        packets = ACUDPPacket.packets()
+        for key, subscriber in self._subscribers.items():
+            types = self._subscriber_types[key]
+            subscriber_fields = self._subscriber_fields[key]
+            for type_, class_ in packets.items():
+                if types is not None and type_ not in types:
+                    continue
+                method = getattr(subscriber, 'on_%s' % (class_._name,), None)
+                if method and callable(method):
+                    if self.metrics is not None:
+                        method = self._timed_handler(
+                            method, type_, '%s.on_%s' % (
+                                self._subscriber_names[key], class_._name))
+                    handlers[type_].append(method)
+                    names = subscriber_fields.get(type_)
+                    if names is None or fields.get(type_, ()) is None:
+                        fields[type_] = None
+                    else:
+                        fields[type_] = fields.get(type_, frozenset()) | names
+        self._handlers = [tuple(methods) for methods in handlers]
+        self._fields = dict((type_, names) for type_, names in fields.items()
+                            if names is not None)
 
-    def subscribe(self, subscriber):
-        """ Register an event subscriber.
+    def _timed_handler(self, handler, type_, name):
+        """ Return handler wrapped to record its time in the metrics. """
+        return self.metrics.timed_handler(handler, type_, name)
+
+    def enable_metrics(self, metrics=None):
+        """ Start recording packet counts, decode times and handler times.
+        Disabled metrics cost nothing: the instrumented decoder and handlers
+        are only swapped in here.
+
+        Keyword arguments:
+        metrics -- acudpclient.metrics.ACUDPMetrics instance to record to
+        (default: None - a new one)
+
+        Return the ACUDPMetrics instance. """
+        if metrics is None:
+            from acudpclient.metrics import ACUDPMetrics
+            metrics = ACUDPMetrics()
+        self.metrics = metrics
+        self._decode = metrics.factory_from_buffer
+        self._decode_file = metrics.factory
+        self._build_handlers()
+        return metrics
+
+    def disable_metrics(self):
+        """ Stop recording metrics, see enable_metrics(). """
+        self.metrics = None
+        self._decode = ACUDPPacket.factory_from_buffer
+        self._decode_file = ACUDPPacket.factory
+        self._build_handlers()
+
+    def _set_flat_vectors(self, flat_vectors):
+        """ Decode vectors as flat fields (see
+        acudpclient.packet_base.flat_vectors()), or not. """
+        self._classes = flat_registry() if flat_vectors else None
+
+    def subscribe(self, subscriber, types=None, fields=None, name=None):
+        """ Register an event subscriber. Its on_<event_type> methods are
+        looked up once, here, for every registered packet type.
 
         Keyword arguments:
         subscriber -- subscriber instance
+        types -- optional collection of packet type ids (ACUDPConst) the
+        subscriber is notified of (default: None - every type it handles)
+        fields -- optional dict of field names the subscriber reads, indexed
+        by packet type id. In datagram mode, when every subscriber of a type
+        declares its fields, the other fields of that type are not decoded
+        (default: None - all fields)
+        name -- name of the subscriber in the handler metrics (default:
+        None - its class name, numbered from the second subscribed instance
+        of a class: Class, Class#2...)
 
         Return True if the subscriber is successfuly registered,
-        False if it's already registered. """
-        if id(subscriber) in list(self._subscribers.keys()):
+        False if it's already registered. Raise ValueError if fields names
+        an unknown packet type or field. """
+        if id(subscriber) in self._subscribers:
             return False
+        fields = dict((type_, frozenset(names))
+                      for type_, names in (fields or {}).items())
+        packets = ACUDPPacket.packets()
+        for type_, names in fields.items():
+            class_ = packets.get(type_)
+            if class_ is None:
+                raise ValueError("Unknown packet type %s" % (type_,))
+            unknown = names.difference(class_._field_index)
+            if unknown:
+                raise ValueError("Unknown %s fields: %s" % (
+                    class_._name, ', '.join(sorted(unknown))))
         self._subscribers[id(subscriber)] = subscriber
+        self._subscriber_types[id(subscriber)] = (
+            None if types is None else frozenset(types))
+        self._subscriber_fields[id(subscriber)] = fields
+        if name is None:
+            class_ = type(subscriber)
+            name = base = getattr(class_, '__qualname__', class_.__name__)
+            names = set(self._subscriber_names.values())
+            number = 1
+            while name in names:
+                number += 1
+                name = '%s#%d' % (base, number)
+        self._subscriber_names[id(subscriber)] = name
+        self._build_handlers()
         return True
 
     def unsubscribe(self, subscriber):
@@ -58,86 +185,316 @@ class ACUDPClient(object):
 
         Return True if the subscriber is successfuly removed,
         False if the subscriber is found. """
-        if id(subscriber) not in list(self._subscribers.keys()):
+        if id(subscriber) not in self._subscribers:
             return False
         del self._subscribers[id(subscriber)]
+        del self._subscriber_types[id(subscriber)]
+        del self._subscriber_fields[id(subscriber)]
+        del self._subscriber_names[id(subscriber)]
+        self._build_handlers()
         return True
 
-    def get_next_event(self, call_subscribers=True):
-        """ Consume an event from self.file and notify the subscribers.
+
+class ACUDPClient(ACUDPClientBase):
+    """ This class represents the UDP Client """
+
+    def __init__(self, port=10000, host='127.0.0.1', remote_port=10001,
+                 rcvbuf=None):
+        """ Constructor.
+
+        Keyword arguments:
+        port -- bind udp port
+        host -- remote udp host (ac server)
+        remote_port -- remote udp port (ac server)
+        rcvbuf -- socket receive buffer size in bytes (SO_RCVBUF)
+        (default: None - system default)
+        """
+        super(ACUDPClient, self).__init__(port, host, remote_port, rcvbuf)
+        self._lazy = False
+        self.file = None
+        self._views = None
+        self._datagrams = collections.deque()
+        self._timestamps = False
+        self._count_drops = False
+        self._ancbufsize = 0
+        self._kernel_drops = None
+        self.request_tracker = None
+        self.recorder = None
+
+    def listen(self, datagram=False, pool_size=32, datagram_size=4096,
+               lazy=False, timestamps=False, count_drops=False, rcvbuf=None,
+               flat_vectors=False):
+        """ Setup the listening socket
+
+        Keyword arguments:
+        datagram -- when True, events are decoded one datagram at a time from
+        a preallocated buffer pool instead of from a buffered byte stream. A
+        malformed datagram is then skipped on its own (default: False)
+        pool_size -- max number of datagrams received in one batch
+        datagram_size -- size in bytes of each buffer in the pool
+        lazy -- datagram mode only: when True, events keep a copy of their
+        datagram and decode each field on first access (default: False)
+        timestamps -- datagram mode only: when True, event.timestamp is set to
+        the datagram receive time (seconds since the epoch), taken by the
+        kernel (SO_TIMESTAMPNS) on linux (default: False)
+        count_drops -- datagram mode only, linux: when True, datagrams dropped
+        by the kernel are counted (SO_RXQ_OVFL), see kernel_drops()
+        (default: False)
+        rcvbuf -- socket receive buffer size in bytes (SO_RCVBUF)
+        (default: None - unchanged)
+        flat_vectors -- when True, this client's events have one float field
+        per vector value (pos_x, pos_y, pos_z), pos and the other vectors
+        being computed on access (default: False)
+        """
+        self._set_flat_vectors(flat_vectors)
+        if rcvbuf is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind(self.server_address)
+        self.sock.setblocking(0)
+        self._lazy = lazy
+        self._timestamps = timestamps
+        self._count_drops = (count_drops and SO_RXQ_OVFL is not None and
+                             _RECVMSG)
+        if timestamps and SO_TIMESTAMPNS is not None and _RECVMSG:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            self._ancbufsize += socket.CMSG_SPACE(struct.calcsize('@ll'))
+        if self._count_drops:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self._ancbufsize += socket.CMSG_SPACE(struct.calcsize('@I'))
+            self._kernel_drops = 0
+        if datagram:
+            self._views = [memoryview(bytearray(datagram_size))
+                           for _ in range(pool_size)]
+        else:
+            self.file = io.open(self.sock.fileno(), mode='rb', buffering=4096)
+
+    def kernel_drops(self):
+        """ Return the number of datagrams dropped by the kernel (receive
+        buffer overflow) since listen(), as of the last received datagram,
+        or None when not counted (see listen(count_drops)). """
+        return self._kernel_drops
+
+    def _receive_datagrams(self):
+        """ Drain up to pool_size ready datagrams from the socket into the
+        buffer pool. Datagrams are also written to self.recorder when set
+        (e.g. an acudpclient.capture.ACUDPCaptureWriter).
+
+        Return deque of (memoryview, receive timestamp or None) tuples, one
+        per datagram. """
+        datagrams = collections.deque()
+        for view in self._views:
+            timestamp = None
+            try:
+                if self._ancbufsize:
+                    nbytes, ancdata, _, _ = self.sock.recvmsg_into(
+                        [view], self._ancbufsize)
+                    timestamp = self._parse_ancdata(ancdata)
+                else:
+                    nbytes = self.sock.recv_into(view)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if self._timestamps and timestamp is None:
+                timestamp = time.time()
+            if self.recorder is not None:
+                self.recorder.write(view[:nbytes], timestamp)
+            datagrams.append((view[:nbytes], timestamp))
+        return datagrams
+
+    def _parse_ancdata(self, ancdata):
+        """ Read the kernel timestamp and drop counter from a datagram's
+        ancillary data.
+
+        Return timestamp, or None if there's none. """
+        timestamp = None
+        for level, type_, data in ancdata:
+            if level != socket.SOL_SOCKET:
+                continue
+            if type_ == SO_TIMESTAMPNS:
+                seconds, nanoseconds = struct.unpack_from('@ll', data)
+                timestamp = seconds + nanoseconds / 1e9
+            elif type_ == SO_RXQ_OVFL:
+                self._kernel_drops = struct.unpack_from('@I', data)[0]
+        return timestamp
+
+    def _next_datagram_event(self, handled_only=False, fields=None):
+        """ Decode the next received datagram, receiving a new batch when
+        needed. Datagrams that cannot be decoded are logged and skipped.
+
+        Keyword arguments:
+        handled_only -- when True, datagrams of a type no subscriber handles
+        are skipped without being decoded
+        fields -- optional dict of field names to decode, indexed by type
+
+        Return the event object or None if there's no datagram ready. """
+        while True:
+            if not self._datagrams:
+                self._datagrams = self._receive_datagrams()
+                if not self._datagrams:
+                    return None
+            datagram, timestamp = self._datagrams.popleft()
+            try:
+                if handled_only:
+                    type_, _ = UINT8.unpack_from(datagram)
+                    if not self._handlers[type_]:
+                        continue
+                if self._lazy:
+                    datagram = bytes(datagram)
+                event, _ = self._decode(datagram, lazy=self._lazy,
+                                        fields=fields, classes=self._classes)
+                if timestamp is not None:
+                    event.timestamp = timestamp
+                return event
+            except (NotEnoughBytes, NotImplementedError,
+                    UnicodeDecodeError, struct.error) as err:
+                LOG.warning("Skipping bad datagram (%d bytes): %r",
+                            len(datagram), err)
+
+    def get_next_event(self, call_subscribers=True, handled_only=False):
+        """ Consume an event from self.file (or the next datagram, when
+        listening in datagram mode) and notify the subscribers.
 
         Keyword arguments:
         call_subscribers -- when True, subscribers get notified if there's
         an event
+        handled_only -- datagram mode only: when True, packets no subscriber
+        handles are skipped without being decoded (default: False)
 
         Return the event object (subclass of ACUDPPacket) or None if there's
         no event ready. """
-        event = ACUDPPacket.factory(self.file)
+        if self._views is not None:
+            event = self._next_datagram_event(
+                handled_only, self._fields if call_subscribers else None)
+        else:
+            event = self._decode_file(self.file, self._classes)
         if event and call_subscribers:
-            for subs in self._subscribers.values():
-                method_name = 'on_%s' % (event.packet_name(),)
-                method = getattr(subs, method_name, None)
-                if method and callable(method):
-                    method(event)
+            for handler in self._handlers[event._type]:
+                handler(event)
+        if self.request_tracker is not None and self.request_tracker.pending():
+            self.request_tracker.expire()
         return event
 
-    def broadcast_message(self, message):
-        """ Broadcast a message to server.
+    def get_next_events(self, max_events=64, timeout=None,
+                        call_subscribers=True, handled_only=False):
+        """ Wait until datagrams are available (or timeout), then consume
+        every ready event, up to max_events, and notify the subscribers once
+        the socket is drained. Only available in datagram mode.
 
         Keyword arguments:
-        message -- the message to send (limited to 255 characters) """
-        size = len(message)
-        if size > 255:
-            raise ValueError('Message is too large')
-        data = struct.pack("BB%ds" % (size*4,),
-                           ACUDPConst.ACSP_BROADCAST_CHAT,
-                           size,
-                           message.encode('utf32'))
+        max_events -- max number of events returned (default: 64)
+        timeout -- max seconds to wait when no event is ready. None waits
+        forever, 0 never waits (default: None)
+        call_subscribers -- when True, subscribers get notified of every
+        event, in order
+        handled_only -- when True, packets no subscriber handles are skipped
+        without being decoded (default: False)
+
+        Return list of event objects, empty if no event was ready in time.
+        """
+        if self._views is None:
+            raise ValueError('get_next_events() requires datagram mode')
+        fields = self._fields if call_subscribers else None
+        events = self._next_datagram_events(max_events, handled_only, fields)
+        if not events and timeout != 0:
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if readable:
+                events = self._next_datagram_events(
+                    max_events, handled_only, fields)
+        if call_subscribers:
+            handlers = self._handlers
+            for event in events:
+                for handler in handlers[event._type]:
+                    handler(event)
+        if self.request_tracker is not None and self.request_tracker.pending():
+            self.request_tracker.expire()
+        return events
+
+    def _next_datagram_events(self, max_events, handled_only, fields):
+        """ Return list of up to max_events decoded datagram events. """
+        events = []
+        while len(events) < max_events:
+            event = self._next_datagram_event(handled_only, fields)
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+    def send(self, data):
+        """ Send an encoded command (see acudpclient.commands) to the AC
+        server.
+
+        Keyword arguments:
+        data -- the datagram (bytes) """
         sent = self.sock.sendto(data, (self.host, self.remote_port))
         if sent != len(data):
             raise ValueError('Not all bytes were sent.')
 
+    _send = send
+
+    def broadcast_message(self, message):
+        """ Broadcast a message to server.
+
+        Keyword arguments:
+        message -- the message to send (limited to 255 characters) """
+        self._send(commands.broadcast_message(message))
+
     def send_message(self, car_id, message):
         """ Send a message to a specific driver.
 
         Keyword arguments:
         car_id -- driver id that will receive the message
         message -- the message to send (limited to 255 characters) """
-        size = len(message)
-        if size > 255:
-            raise ValueError('Message is too large')
-        data = struct.pack("BBB%ds" % (size*4,),
-                           ACUDPConst.ACSP_SEND_CHAT,
-                           car_id,
-                           size,
-                           message.encode('utf32'))
-        sent = self.sock.sendto(data, (self.host, self.remote_port))
-        if sent != len(data):
-            raise ValueError('Not all bytes were sent.')
+        self._send(commands.send_message(car_id, message))
 
     def get_car_info(self, car_id):
         """ Request CAR_INFO packet.
 
         Keyword arguments:
         car_id -- the driver id we want """
-        data = struct.pack("BB",
-                           ACUDPConst.ACSP_GET_CAR_INFO,
-                           car_id)
-        sent = self.sock.sendto(data, (self.host, self.remote_port))
-        if sent != len(data):
-            raise ValueError('Not all bytes were sent.')
+        self._send(commands.get_car_info(car_id))
 
     def get_session_info(self, session_index=-1):
         """ Request SESSION_INFO packet.
 
         Keyword arguments:
         session_index -- the session we want (default: -1 - current session)"""
-        data = struct.pack("<Bh",
-                           ACUDPConst.ACSP_GET_SESSION_INFO,
-                           session_index)
-        sent = self.sock.sendto(data, (self.host, self.remote_port))
-        if sent != len(data):
-            raise ValueError('Not all bytes were sent.')
+        self._send(commands.get_session_info(session_index))
+
+    def _request_tracker(self):
+        """ Return self.request_tracker, creating and subscribing a default
+        ACUDPRequestTracker the first time. """
+        if self.request_tracker is None:
+            from acudpclient.correlation import ACUDPRequestTracker
+            self.request_tracker = ACUDPRequestTracker(self._send)
+        if id(self.request_tracker) not in self._subscribers:
+            self.subscribe(self.request_tracker)
+        return self.request_tracker
+
+    def request_car_info(self, car_id):
+        """ Request CAR_INFO packet and track its response. Concurrent
+        requests for the same car_id send a single datagram and recent
+        responses are served from cache. The future is resolved while
+        events are consumed with get_next_event(s)(), which also retry
+        requests that timed out.
+
+        Keyword arguments:
+        car_id -- the driver id we want
+
+        Return concurrent.futures.Future resolved with the CarInfo event, or
+        failed with RequestTimeout. """
+        return self._request_tracker().car_info(car_id)
+
+    def request_session_info(self, session_index=-1):
+        """ Request SESSION_INFO packet and track its response, see
+        request_car_info().
+
+        Keyword arguments:
+        session_index -- the session we want (default: -1 - current session)
+
+        Return concurrent.futures.Future resolved with the SessionInfo event,
+        or failed with RequestTimeout. """
+        return self._request_tracker().session_info(session_index)
 
     def enable_realtime_report(self, hz_ms=1000):
         """ Enable real time telemetry report.
@@ -145,9 +502,40 @@ class ACUDPClient(object):
         Keyword arguments:
         hz_ms -- the frequency we want to get reports, in milliseconds. Use 0
         to disable real time reporting (default: 1000) """
-        data = struct.pack("<BH",
-                           ACUDPConst.ACSP_REALTIMEPOS_INTERVAL,
-                           hz_ms)
-        sent = self.sock.sendto(data, (self.host, self.remote_port))
-        if sent != len(data):
-            raise ValueError('Not all bytes were sent.')
+        self._send(commands.enable_realtime_report(hz_ms))
+
+    def kick_user(self, car_id):
+        """ Kick a driver.
+
+        Keyword arguments:
+        car_id -- driver id to kick """
+        self._send(commands.kick_user(car_id))
+
+    def next_session(self):
+        """ Move the server to the next session. """
+        self._send(commands.next_session())
+
+    def restart_session(self):
+        """ Restart the current session. """
+        self._send(commands.restart_session())
+
+    def admin_command(self, command):
+        """ Run an admin command (e.g. "/ballast 0 50").
+
+        Keyword arguments:
+        command -- the command (limited to 255 characters) """
+        self._send(commands.admin_command(command))
+
+    def set_session_info(self, session_index, name, session_type, laps,
+                         time_s, wait_time_s):
+        """ Change a session.
+
+        Keyword arguments:
+        session_index -- the session to change
+        name -- session name (limited to 255 characters)
+        session_type -- session type (as in SessionInfo.session_type)
+        laps -- number of laps
+        time_s -- session duration, in seconds
+        wait_time_s -- wait time before the session starts, in seconds """
+        self._send(commands.set_session_info(
+            session_index, name, session_type, laps, time_s, wait_time_s))
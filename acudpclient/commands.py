@@ -0,0 +1,130 @@
+"""
+Encoders for the commands (requests) sent to the AC server. Each function
+returns the datagram bytes, ready to be sent.
+"""
+import struct
+
+from acudpclient.protocol import ACUDPConst
+
+# encoded strings cache, see encode_string()
+_STRINGS = {}
+_STRINGS_MAX_SIZE = 1024
+
+
+def encode_string(value):
+    """ Encode an AC UDP UTF-32 string: a length byte followed by the
+    little-endian UTF-32 characters (no BOM). Encoded values are cached, so
+    repeated messages are encoded only once.
+
+    Keyword arguments:
+    value -- the string to encode (limited to 255 characters)
+
+    Return bytes.
+    """
+    data = _STRINGS.get(value)
+    if data is None:
+        size = len(value)
+        if size > 255:
+            raise ValueError('Message is too large')
+        data = struct.pack("B", size) + value.encode('utf-32-le')
+        if len(_STRINGS) >= _STRINGS_MAX_SIZE:
+            _STRINGS.clear()
+        _STRINGS[value] = data
+    return data
+
+
+def broadcast_message(message):
+    """ Encode a message broadcast.
+
+    Keyword arguments:
+    message -- the message to send (limited to 255 characters) """
+    return struct.pack("B", ACUDPConst.ACSP_BROADCAST_CHAT) + \
+        encode_string(message)
+
+
+def send_message(car_id, message):
+    """ Encode a message to a specific driver.
+
+    Keyword arguments:
+    car_id -- driver id that will receive the message
+    message -- the message to send (limited to 255 characters) """
+    return struct.pack("BB", ACUDPConst.ACSP_SEND_CHAT, car_id) + \
+        encode_string(message)
+
+
+def get_car_info(car_id):
+    """ Encode a CAR_INFO request.
+
+    Keyword arguments:
+    car_id -- the driver id we want """
+    return struct.pack("BB",
+                       ACUDPConst.ACSP_GET_CAR_INFO,
+                       car_id)
+
+
+def get_session_info(session_index=-1):
+    """ Encode a SESSION_INFO request.
+
+    Keyword arguments:
+    session_index -- the session we want (default: -1 - current session)"""
+    return struct.pack("<Bh",
+                       ACUDPConst.ACSP_GET_SESSION_INFO,
+                       session_index)
+
+
+def enable_realtime_report(hz_ms=1000):
+    """ Encode a real time telemetry report interval request.
+
+    Keyword arguments:
+    hz_ms -- the frequency we want to get reports, in milliseconds. Use 0
+    to disable real time reporting (default: 1000) """
+    return struct.pack("<BH",
+                       ACUDPConst.ACSP_REALTIMEPOS_INTERVAL,
+                       hz_ms)
+
+
+def kick_user(car_id):
+    """ Encode a kick request.
+
+    Keyword arguments:
+    car_id -- driver id to kick """
+    return struct.pack("BB",
+                       ACUDPConst.ACSP_KICK_USER,
+                       car_id)
+
+
+def next_session():
+    """ Encode a request to move to the next session. """
+    return struct.pack("B", ACUDPConst.ACSP_NEXT_SESSION)
+
+
+def restart_session():
+    """ Encode a request to restart the current session. """
+    return struct.pack("B", ACUDPConst.ACSP_RESTART_SESSION)
+
+
+def admin_command(command):
+    """ Encode an admin command, as typed in the chat by an admin
+    (e.g. "/ballast 0 50").
+
+    Keyword arguments:
+    command -- the command (limited to 255 characters) """
+    return struct.pack("B", ACUDPConst.ACSP_ADMIN_COMMAND) + \
+        encode_string(command)
+
+
+def set_session_info(session_index, name, session_type, laps, time_s,
+                     wait_time_s):
+    """ Encode a request changing a session.
+
+    Keyword arguments:
+    session_index -- the session to change
+    name -- session name (limited to 255 characters)
+    session_type -- session type (as in SessionInfo.session_type)
+    laps -- number of laps
+    time_s -- session duration, in seconds
+    wait_time_s -- wait time before the session starts, in seconds """
+    return (struct.pack("BB", ACUDPConst.ACSP_SET_SESSION_INFO,
+                        session_index) +
+            encode_string(name) +
+            struct.pack("<BIII", session_type, laps, time_s, wait_time_s))
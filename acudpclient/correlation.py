@@ -0,0 +1,152 @@
+"""
+Correlation of get_car_info/get_session_info requests with their CarInfo and
+SessionInfo responses
+"""
+import time
+
+try:
+    from concurrent.futures import Future
+except ImportError:  # python 2 without the futures backport
+    Future = None
+
+from acudpclient import commands
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.exceptions import RequestTimeout
+
+
+class ACUDPRequestTracker(object):
+    """ Subscriber matching CarInfo/SessionInfo responses to the requests
+    made through it, by car_id/session_index. Requests return futures.
+    Concurrent requests for the same key share one datagram (and future),
+    unanswered requests are retried and then failed with RequestTimeout, and
+    responses are cached for ttl seconds. The cached CarInfo of a car is
+    dropped when a driver connects to or leaves its slot, cached SessionInfo
+    on every new session. """
+
+    def __init__(self, send, timeout=1.0, retries=2, ttl=5.0,
+                 future_factory=Future, schedule=None, clock=time.time):
+        """ Constructor.
+
+        Keyword arguments:
+        send -- callable sending a datagram (bytes) to the AC server
+        timeout -- seconds to wait for a response before retrying
+        (default: 1.0)
+        retries -- number of retries before failing (default: 2)
+        ttl -- seconds a response is served from cache, 0 disables caching
+        (default: 5.0)
+        future_factory -- callable creating futures
+        (default: concurrent.futures.Future, which requires the futures
+        package on python 2)
+        schedule -- optional callable(delay, function) used to run expire()
+        when a request times out (e.g. loop.call_later). Without it,
+        expire() must be called periodically.
+        clock -- callable returning the current time in seconds
+        """
+        if future_factory is None:
+            raise ImportError("concurrent.futures is required, install the "
+                              "futures package")
+        self.send = send
+        self.timeout = timeout
+        self.retries = retries
+        self.ttl = ttl
+        self.future_factory = future_factory
+        self.schedule = schedule
+        self.clock = clock
+        self._pending = {}
+        self._cache = {}
+        # on_<event_type> methods by packet type, looked up once
+        self._handlers = {}
+        for type_, class_ in ACUDPPacket.packets().items():
+            method = getattr(self, 'on_%s' % (class_._name,), None)
+            if method is not None:
+                self._handlers[type_] = method
+
+    def _request(self, key, data):
+        """ Return the future of key, sending data unless the response is
+        cached or the same request is already pending. """
+        cached = self._cache.get(key)
+        if cached is not None and self.clock() - cached[1] < self.ttl:
+            future = self.future_factory()
+            future.set_result(cached[0])
+            return future
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending[0]
+        future = self.future_factory()
+        self._pending[key] = [future, data, self.retries,
+                              self.clock() + self.timeout]
+        self._send(data)
+        return future
+
+    def _send(self, data):
+        self.send(data)
+        if self.schedule is not None:
+            self.schedule(self.timeout, self.expire)
+
+    def car_info(self, car_id):
+        """ Request the CarInfo of car_id.
+
+        Return future resolved with the CarInfo event. """
+        return self._request(('car', car_id), commands.get_car_info(car_id))
+
+    def session_info(self, session_index=-1):
+        """ Request the SessionInfo of session_index (-1: current session).
+
+        Return future resolved with the SessionInfo event. """
+        return self._request(('session', session_index),
+                             commands.get_session_info(session_index))
+
+    def pending(self):
+        """ Return the number of requests waiting for a response. """
+        return len(self._pending)
+
+    def expire(self):
+        """ Retry the requests that timed out and fail the ones without
+        retries left. """
+        now = self.clock()
+        for key, pending in list(self._pending.items()):
+            future, data, retries, deadline = pending
+            if deadline > now:
+                continue
+            if future.done():
+                del self._pending[key]
+            elif retries > 0:
+                pending[2] = retries - 1
+                pending[3] = now + self.timeout
+                self._send(data)
+            else:
+                del self._pending[key]
+                future.set_exception(RequestTimeout(
+                    "No response to %s %s" % key))
+
+    def _resolve(self, key, event):
+        if self.ttl > 0:
+            self._cache[key] = (event, self.clock())
+        pending = self._pending.pop(key, None)
+        if pending is not None and not pending[0].done():
+            pending[0].set_result(event)
+
+    def resolve(self, event):
+        """ Resolve the requests answered by event, if any, and drop the
+        cached responses it makes stale. """
+        handler = self._handlers.get(event._type)
+        if handler is not None:
+            handler(event)
+
+    def on_ACSP_CAR_INFO(self, event):
+        self._resolve(('car', event.car_id), event)
+
+    def on_ACSP_SESSION_INFO(self, event):
+        self._resolve(('session', event.session_index), event)
+        if event.session_index == event.current_sess_index:
+            self._resolve(('session', -1), event)
+
+    def on_ACSP_NEW_CONNECTION(self, event):
+        self._cache.pop(('car', event.car_id), None)
+
+    def on_ACSP_CONNECTION_CLOSED(self, event):
+        self._cache.pop(('car', event.car_id), None)
+
+    def on_ACSP_NEW_SESSION(self, _event):
+        for key in [key for key in self._cache if key[0] == 'session']:
+            del self._cache[key]
@@ -0,0 +1,209 @@
+"""
+Bounded event queue decoupling receiving/decoding from subscriber dispatch
+"""
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from acudpclient.protocol import ACUDPConst
+
+LOG = logging.getLogger("ac_udp_event_queue")
+
+# overflow policies
+DROP_OLDEST = 'drop_oldest'
+"""When full, drop the oldest droppable queued event to make room."""
+DROP_NEWEST = 'drop_newest'
+"""When full, drop the incoming event."""
+NEVER_DROP = 'never_drop'
+"""When full, drop the oldest droppable queued event or, if every queued
+event is NEVER_DROP, block the producer until there is room."""
+
+DEFAULT_POLICIES = {
+    ACUDPConst.ACSP_CAR_UPDATE: DROP_OLDEST,
+}
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def _wait(condition, predicate, timeout):
+    """ Wait on condition (whose lock is held) until predicate() is true,
+    or timeout seconds. threading.Condition.wait_for() is python 3 only.
+
+    Return the last result of predicate(). """
+    result = predicate()
+    if timeout is None:
+        while not result:
+            condition.wait()
+            result = predicate()
+        return result
+    deadline = _clock() + timeout
+    while not result:
+        remaining = deadline - _clock()
+        if remaining <= 0:
+            break
+        condition.wait(remaining)
+        result = predicate()
+    return result
+
+
+class ACUDPEventQueue(object):
+    """ Fixed capacity, thread safe, FIFO of events with a configurable
+    overflow policy per packet type and drop accounting.
+
+    NEVER_DROP events and the others are kept in two FIFOs of (sequence
+    number, event) tuples, merged in order by get(), so dropping the oldest
+    droppable event is O(1). """
+
+    def __init__(self, capacity=4096, policies=None, default=NEVER_DROP):
+        """ Constructor.
+
+        Keyword arguments:
+        capacity -- max number of queued events (default: 4096)
+        policies -- dict of overflow policies indexed by packet type
+        (default: DEFAULT_POLICIES - CarUpdate events are DROP_OLDEST)
+        default -- policy of types not found in policies (default: NEVER_DROP)
+        """
+        if capacity < 1:
+            raise ValueError('Invalid capacity %s' % (capacity,))
+        self.capacity = capacity
+        self._policies = [default] * 256
+        for type_, policy in (DEFAULT_POLICIES if policies is None
+                              else policies).items():
+            self._policies[type_] = policy
+        self._events = collections.deque()
+        self._droppable = collections.deque()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.dropped = collections.Counter()
+        self.enqueued = 0
+        self.high_water_mark = 0
+
+    def __len__(self):
+        return len(self._events) + len(self._droppable)
+
+    def _drop_oldest(self):
+        """ Drop the oldest queued event that is not NEVER_DROP.
+
+        Return True if an event was dropped. """
+        if not self._droppable:
+            return False
+        _, event = self._droppable.popleft()
+        self.dropped[event._type] += 1
+        return True
+
+    def put(self, event, timeout=None):
+        """ Queue an event, applying its type's overflow policy when the
+        queue is full.
+
+        Keyword arguments:
+        event -- event object (subclass of ACUDPPacket)
+        timeout -- max seconds a NEVER_DROP event blocks waiting for room.
+        None waits forever (default: None)
+
+        Return True if the event was queued, False if it was dropped. """
+        policy = self._policies[event._type]
+        with self._lock:
+            if len(self) >= self.capacity:
+                if policy == DROP_NEWEST or (
+                        not self._drop_oldest() and policy != NEVER_DROP):
+                    self.dropped[event._type] += 1
+                    return False
+                if not _wait(self._not_full,
+                             lambda: len(self) < self.capacity, timeout):
+                    LOG.warning("Event queue full, dropping %s",
+                                event.packet_name())
+                    self.dropped[event._type] += 1
+                    return False
+            queue = self._events if policy == NEVER_DROP else self._droppable
+            queue.append((next(self._sequence), event))
+            self.enqueued += 1
+            self.high_water_mark = max(self.high_water_mark, len(self))
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout=None):
+        """ Remove and return the oldest event.
+
+        Keyword arguments:
+        timeout -- max seconds to wait for an event. None waits forever
+        (default: None)
+
+        Return event object or None on timeout. """
+        with self._lock:
+            if not _wait(self._not_empty, self.__len__, timeout):
+                return None
+            events, droppable = self._events, self._droppable
+            if not events or (droppable and droppable[0][0] < events[0][0]):
+                _, event = droppable.popleft()
+            else:
+                _, event = events.popleft()
+            self._not_full.notify()
+            return event
+
+    def stats(self):
+        """ Return dict with the queue counters: queued (current size),
+        enqueued (total), high_water_mark and dropped (total and per type
+        name). """
+        with self._lock:
+            return {
+                'queued': len(self),
+                'enqueued': self.enqueued,
+                'high_water_mark': self.high_water_mark,
+                'dropped': sum(self.dropped.values()),
+                'dropped_by_type': dict(
+                    (ACUDPConst.id_to_name(type_), count)
+                    for type_, count in self.dropped.items()),
+            }
+
+
+class ACUDPQueueDispatcher(threading.Thread):
+    """ Thread notifying a client's subscribers of the events found in an
+    ACUDPEventQueue, so slow handlers never delay socket draining. """
+
+    def __init__(self, client, queue):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPClient (datagram mode) whose subscribers are notified
+        queue -- ACUDPEventQueue instance
+        """
+        super(ACUDPQueueDispatcher, self).__init__()
+        self.daemon = True
+        self.client = client
+        self.queue = queue
+        self._stopped = threading.Event()
+
+    def receive(self, max_events=64, timeout=None):
+        """ Receive ready events from the client and queue them. Meant to be
+        called from the application's main loop.
+
+        Keyword arguments:
+        max_events -- max number of events received (default: 64)
+        timeout -- max seconds to wait for events (default: None)
+
+        Return number of events queued. """
+        queued = 0
+        for event in self.client.get_next_events(
+                max_events, timeout, call_subscribers=False):
+            queued += self.queue.put(event)
+        return queued
+
+    def run(self):
+        while not self._stopped.is_set():
+            event = self.queue.get(timeout=0.1)
+            if event is None:
+                continue
+            for handler in self.client._handlers[event._type]:
+                try:
+                    handler(event)
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception("Handler %r failed", handler)
+
+    def stop(self):
+        """ Stop the thread once the current event is handled. """
+        self._stopped.set()
+        self.join()
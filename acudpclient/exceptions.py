@@ -9,3 +9,9 @@ class ACUDPClientException(Exception):
 class NotEnoughBytes(ACUDPClientException):
     """ NotEnoughBytes exception. """
     pass
+
+
+class RequestTimeout(ACUDPClientException):
+    """ RequestTimeout exception, raised when the AC server does not answer
+    a request (after retries). """
+    pass
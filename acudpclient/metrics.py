@@ -0,0 +1,318 @@
+"""
+Client instrumentation: packet counters, decode and handler time
+histograms, with Prometheus text and statsd exporters
+"""
+import collections
+import socket
+import struct
+import time
+
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.exceptions import NotEnoughBytes
+
+_SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+perf_counter_ns = getattr(time, 'perf_counter_ns', None)
+if perf_counter_ns is None:  # python < 3.7
+    _perf_counter = getattr(time, 'perf_counter', time.time)  # python 2
+
+    def perf_counter_ns():
+        """ Return the performance counter, in integer nanoseconds. """
+        return int(_perf_counter() * 1e9)
+
+
+class ACUDPHistogram(object):
+    """ Log-linear (HDR style) histogram of integer values, with 16 buckets
+    per power of two: constant memory and ~6% worst case precision. """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+        if shift < 0:
+            return value
+        return (shift + 1) * _SUB_BUCKETS + (value >> shift) - _SUB_BUCKETS
+
+    @staticmethod
+    def _value(index):
+        """ Return the lowest value of bucket index. """
+        if index < _SUB_BUCKETS:
+            return index
+        shift = index // _SUB_BUCKETS - 1
+        return (_SUB_BUCKETS + index % _SUB_BUCKETS) << shift
+
+    def record(self, value):
+        """ Add a value (non negative integer). """
+        index = self._index(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, quantile):
+        """ Return the value below which quantile (0-1) of the values fall,
+        or 0 if there are none. """
+        if not self.count:
+            return 0
+        rank = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if seen == self.count:
+                    return self.max
+                return self._value(index)
+        return self.max
+
+
+def _quantile_name(quantile):
+    return 'p%g' % (quantile * 100,)
+
+
+def _handler_name(handler):
+    return getattr(handler, '__qualname__', None) or \
+        getattr(handler, '__name__', None) or repr(handler)
+
+
+class ACUDPMetrics(object):
+    """ Counters and timings of a client, see
+    ACUDPClientBase.enable_metrics(). Times are in nanoseconds.
+
+    Attributes:
+    packets -- list of decoded packet counts, indexed by type
+    decode -- list of decode time histograms (or None), indexed by type
+    dispatch -- list of handler time histograms (or None), indexed by type
+    handlers -- dict of handler time histograms, by handler name
+    (<subscriber name>.<method name>, see ACUDPClientBase.subscribe())
+    unknown -- Counter of packets of unknown types, by type id (None in
+    stream mode, where the type is not known)
+    truncated -- number of packets shorter than their declared fields
+    """
+
+    def __init__(self):
+        self.packets = [0] * 256
+        self.decode = [None] * 256
+        self.dispatch = [None] * 256
+        self.handlers = {}
+        self.unknown = collections.Counter()
+        self.truncated = 0
+
+    def factory_from_buffer(self, buffer_, offset=0, lazy=False,
+                            fields=None, classes=None):
+        """ ACUDPPacket.factory_from_buffer() recording the decode. """
+        start = perf_counter_ns()
+        try:
+            event, end = ACUDPPacket.factory_from_buffer(
+                buffer_, offset, lazy, fields, classes)
+        except NotImplementedError:
+            self.unknown[struct.unpack_from('B', buffer_, offset)[0]] += 1
+            raise
+        except NotEnoughBytes:
+            self.truncated += 1
+            raise
+        self._record(event._type, perf_counter_ns() - start)
+        return event, end
+
+    def factory(self, file_obj, classes=None):
+        """ ACUDPPacket.factory() recording the decode. """
+        start = perf_counter_ns()
+        try:
+            event = ACUDPPacket.factory(file_obj, classes)
+        except NotImplementedError:
+            self.unknown[None] += 1
+            raise
+        if event is not None:
+            self._record(event._type, perf_counter_ns() - start)
+        return event
+
+    def _record(self, type_, elapsed):
+        self.packets[type_] += 1
+        histogram = self.decode[type_]
+        if histogram is None:
+            histogram = self.decode[type_] = ACUDPHistogram()
+        histogram.record(elapsed)
+
+    def handler_histograms(self, name, type_):
+        """ Return (handler histogram, packet type histogram) tuple the
+        time of handler name, handling packets of type_, is recorded to. """
+        by_handler = self.handlers.setdefault(name, ACUDPHistogram())
+        by_type = self.dispatch[type_]
+        if by_type is None:
+            by_type = self.dispatch[type_] = ACUDPHistogram()
+        return by_handler, by_type
+
+    def timed_handler(self, handler, type_, name=None):
+        """ Return handler wrapped to record its time.
+
+        Keyword arguments:
+        handler -- callable handling events of type_
+        type_ -- packet type id
+        name -- handler name in the metrics (default: None - the qualified
+        name of handler)
+        """
+        name = name or _handler_name(handler)
+        by_handler, by_type = self.handler_histograms(name, type_)
+        clock = perf_counter_ns
+
+        def timed(event):
+            start = clock()
+            try:
+                return handler(event)
+            finally:
+                elapsed = clock() - start
+                by_handler.record(elapsed)
+                by_type.record(elapsed)
+        timed.__qualname__ = name
+        return timed
+
+    def snapshot(self):
+        """ Return dict of the current counters and percentiles (pull API).
+        """
+        def summary(histogram):
+            values = dict((_quantile_name(quantile),
+                           histogram.percentile(quantile))
+                          for quantile in QUANTILES)
+            values.update(count=histogram.count, sum=histogram.total,
+                          max=histogram.max)
+            return values
+
+        return {
+            'packets': dict((ACUDPConst.id_to_name(type_), count)
+                            for type_, count in enumerate(self.packets)
+                            if count),
+            'decode_ns': dict((ACUDPConst.id_to_name(type_), summary(hist))
+                              for type_, hist in enumerate(self.decode)
+                              if hist is not None),
+            'dispatch_ns': dict((ACUDPConst.id_to_name(type_), summary(hist))
+                                for type_, hist in enumerate(self.dispatch)
+                                if hist is not None),
+            'handlers_ns': dict((name, summary(hist))
+                                for name, hist in self.handlers.items()),
+            'unknown': dict(self.unknown),
+            'truncated': self.truncated,
+        }
+
+    def to_prometheus(self, prefix='acudp'):
+        """ Return the metrics in Prometheus text exposition format. """
+        lines = []
+
+        def summaries(name, label, histograms):
+            lines.append('# TYPE %s_%s_seconds summary' % (prefix, name))
+            for key, hist in histograms:
+                for quantile in QUANTILES:
+                    lines.append(
+                        '%s_%s_seconds{%s="%s",quantile="%s"} %.9f' % (
+                            prefix, name, label, key, quantile,
+                            hist.percentile(quantile) / 1e9))
+                lines.append('%s_%s_seconds_sum{%s="%s"} %.9f' % (
+                    prefix, name, label, key, hist.total / 1e9))
+                lines.append('%s_%s_seconds_count{%s="%s"} %d' % (
+                    prefix, name, label, key, hist.count))
+
+        lines.append('# TYPE %s_packets_total counter' % (prefix,))
+        for type_, count in enumerate(self.packets):
+            if count:
+                lines.append('%s_packets_total{type="%s"} %d' % (
+                    prefix, ACUDPConst.id_to_name(type_), count))
+        lines.append('# TYPE %s_unknown_packets_total counter' % (prefix,))
+        for type_, count in sorted(self.unknown.items(), key=str):
+            lines.append('%s_unknown_packets_total{type="%s"} %d' % (
+                prefix, type_, count))
+        lines.append('# TYPE %s_truncated_packets_total counter' % (prefix,))
+        lines.append('%s_truncated_packets_total %d' % (prefix,
+                                                        self.truncated))
+        summaries('decode', 'type',
+                  [(ACUDPConst.id_to_name(type_), hist)
+                   for type_, hist in enumerate(self.decode)
+                   if hist is not None])
+        summaries('dispatch', 'type',
+                  [(ACUDPConst.id_to_name(type_), hist)
+                   for type_, hist in enumerate(self.dispatch)
+                   if hist is not None])
+        summaries('handler', 'handler', sorted(self.handlers.items()))
+        return '\n'.join(lines) + '\n'
+
+
+class ACUDPStatsdExporter(object):
+    """ Pushes ACUDPMetrics to a statsd server over UDP: packet counts as
+    counters (deltas since the last flush) and percentiles as gauges. """
+
+    def __init__(self, metrics, host='127.0.0.1', port=8125, prefix='acudp',
+                 max_datagram_size=1432):
+        """ Constructor.
+
+        Keyword arguments:
+        metrics -- ACUDPMetrics instance
+        host -- statsd host
+        port -- statsd udp port
+        prefix -- metric name prefix
+        max_datagram_size -- metric lines are packed into datagrams of up
+        to this size
+        """
+        self.metrics = metrics
+        self.address = (host, port)
+        self.prefix = prefix
+        self.max_datagram_size = max_datagram_size
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sent = {}
+
+    def _lines(self):
+        metrics = self.metrics
+        counters = [('packets.%s' % (ACUDPConst.id_to_name(type_),), count)
+                    for type_, count in enumerate(metrics.packets) if count]
+        counters += [('unknown.%s' % (type_,), count)
+                     for type_, count in metrics.unknown.items()]
+        counters.append(('truncated', metrics.truncated))
+        for name, count in counters:
+            delta = count - self._sent.get(name, 0)
+            if delta:
+                self._sent[name] = count
+                yield '%s.%s:%d|c' % (self.prefix, name, delta)
+        histograms = [('decode.%s' % (ACUDPConst.id_to_name(type_),), hist)
+                      for type_, hist in enumerate(metrics.decode)
+                      if hist is not None]
+        histograms += [('handler.%s' % (name,), hist)
+                       for name, hist in metrics.handlers.items()]
+        for name, hist in histograms:
+            for quantile in QUANTILES:
+                yield '%s.%s.%s:%d|g' % (
+                    self.prefix, name,
+                    _quantile_name(quantile).replace('.', '_'),
+                    hist.percentile(quantile))
+
+    def flush(self):
+        """ Send the metrics.
+
+        Return number of datagrams sent. """
+        datagrams = 0
+        payload = b''
+        for line in self._lines():
+            line = line.encode('ascii', 'replace')
+            if payload and \
+                    len(payload) + 1 + len(line) > self.max_datagram_size:
+                self.sock.sendto(payload, self.address)
+                datagrams += 1
+                payload = b''
+            payload = payload + b'\n' + line if payload else line
+        if payload:
+            self.sock.sendto(payload, self.address)
+            datagrams += 1
+        return datagrams
+
+    def close(self):
+        """ Close the socket """
+        self.sock.close()
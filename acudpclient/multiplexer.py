@@ -0,0 +1,144 @@
+"""
+Multiplexer of many AC UDP Clients (one per AC server) over a single
+selectors loop
+"""
+import collections
+import select
+
+from acudpclient.client import ACUDPClient
+
+try:
+    import selectors
+except ImportError:  # python 2
+    selectors = None
+
+_SelectorKey = collections.namedtuple('_SelectorKey', 'fileobj data')
+
+
+class _SelectSelector(object):
+    """ Minimal select() based stand-in for selectors.DefaultSelector
+    (read events only), used where the selectors module is missing. """
+
+    def __init__(self):
+        self._keys = {}
+
+    def register(self, fileobj, _events, data=None):
+        self._keys[fileobj] = _SelectorKey(fileobj, data)
+
+    def unregister(self, fileobj):
+        del self._keys[fileobj]
+
+    def select(self, timeout=None):
+        if not self._keys:
+            return []
+        readable, _, _ = select.select(list(self._keys), [], [], timeout)
+        return [(self._keys[fileobj], 1) for fileobj in readable]
+
+    def close(self):
+        self._keys.clear()
+
+
+class ACUDPMultiplexer(object):
+    """ Manages many ACUDPClient endpoints (bind port <-> remote host/port
+    pairs) from one selector. Each server has its own client, and thus its
+    own subscribers, and every event is returned tagged with the name of the
+    server it came from. Ready servers are served round-robin, at most
+    quantum events at a time, so one server's realtime flood cannot starve
+    the others. """
+
+    def __init__(self, quantum=16, selector=None):
+        """ Constructor.
+
+        Keyword arguments:
+        quantum -- max events consumed from one server before moving on to
+        the next ready one (default: 16)
+        selector -- selectors.BaseSelector instance
+        (default: selectors.DefaultSelector(), or a select() based one on
+        python 2)
+        """
+        self.quantum = quantum
+        self.clients = {}
+        self._pending = []
+        if selector is None:
+            selector = (_SelectSelector() if selectors is None
+                        else selectors.DefaultSelector())
+        self._selector = selector
+
+    def add_server(self, name, port=10000, host='127.0.0.1',
+                   remote_port=10001, rcvbuf=None, **listen_kwargs):
+        """ Create, bind and register a client for an AC server. Clients
+        always listen in datagram mode.
+
+        Keyword arguments:
+        name -- server name used to tag its events
+        port -- bind udp port
+        host -- remote udp host (ac server)
+        remote_port -- remote udp port (ac server)
+        rcvbuf -- socket receive buffer size in bytes (default: None)
+        listen_kwargs -- extra ACUDPClient.listen() arguments
+
+        Return the ACUDPClient instance, used to subscribe to its events and
+        to send commands to its server.
+        """
+        if name in self.clients:
+            raise ValueError("Server %s already added" % (name,))
+        client = ACUDPClient(port=port, host=host, remote_port=remote_port,
+                             rcvbuf=rcvbuf)
+        client.listen(datagram=True, **listen_kwargs)
+        self._selector.register(client.sock, 1, name)  # EVENT_READ
+        self.clients[name] = client
+        return client
+
+    def remove_server(self, name):
+        """ Unregister and close the client of a server.
+
+        Keyword arguments:
+        name -- server name
+        """
+        client = self.clients.pop(name)
+        if name in self._pending:
+            self._pending.remove(name)
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def close(self):
+        """ Close every client and the selector. """
+        for name in list(self.clients):
+            self.remove_server(name)
+        self._selector.close()
+
+    def poll(self, timeout=None, max_events=1024, call_subscribers=True):
+        """ Wait until at least one server has data (or timeout), then
+        consume the ready events round-robin between servers, notifying the
+        subscribers of each server.
+
+        Keyword arguments:
+        timeout -- max seconds to wait for data, None to wait forever
+        (default: None)
+        max_events -- max number of events consumed in this call
+        call_subscribers -- when True, subscribers get notified
+
+        Return list of (server name, event) tuples, in processing order.
+        """
+        ready = self._pending
+        if ready:
+            # servers left with events by the previous call go first
+            timeout = 0
+        for key, _ in self._selector.select(timeout):
+            if key.data not in ready:
+                ready.append(key.data)
+        events = []
+        while ready and len(events) < max_events:
+            pending = []
+            for name in ready:
+                client = self.clients[name]
+                for _ in range(min(self.quantum, max_events - len(events))):
+                    event = client.get_next_event(call_subscribers)
+                    if event is None:
+                        break
+                    events.append((name, event))
+                else:
+                    pending.append(name)
+            ready = pending
+        self._pending = ready
+        return events
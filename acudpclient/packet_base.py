@@ -1,8 +1,11 @@
 """
 Collection of base classes to be used by packet related classes.
 """
+import json
 import logging
+import operator
 import struct
+import sys
 
 from acudpclient.protocol import ACUDPConst
 from acudpclient.types import *
@@ -11,21 +14,118 @@ from acudpclient.exceptions import NotEnoughBytes
 
 LOG = logging.getLogger("ac_udp_packets")
 
-class ACUDPPacket(object):
+
+class ACUDPFieldsMeta(type):
+    """ Metaclass that compiles the _bytes declaration of a packet (or packet
+    data) class into decoding steps, once, at class definition time.
+    Packet classes defining _type are also added to the packet registry.
+
+    __slots__ are generated from _bytes, unless the class declares its own.
+    Setting _flat_vectors = True on a class replaces its multi value fields
+    (e.g. pos) by one float field per value (pos_x, pos_y, pos_z), the
+    original names becoming read only properties returning tuples. Such
+    classes are not registered (see flat_vectors()).
+
+    Serialization methods are generated as well: to_dict() and to_tuple()
+    (arrays of packet data as lists of dicts / tuples of tuples) and
+    to_bytes(), the inverse of from_file() (including the packet type), and
+    the from_tuple() class method, the inverse of to_tuple(). """
+    def __new__(mcs, name, bases, dct):
+        if '_bytes' in dct or '_flat_vectors' in dct:
+            dct = dict(dct)
+            fields = dct.get('_bytes') or getattr(bases[0], '_bytes', ())
+            if dct.get('_flat_vectors',
+                       getattr(bases[0], '_flat_vectors', False)):
+                fields = flatten_fields(fields)
+                for vector, names in flattened_vectors(
+                        dct.get('_bytes') or bases[0]._bytes).items():
+                    dct.setdefault(vector, property(
+                        operator.attrgetter(*names),
+                        doc="Tuple of %s." % (', '.join(names),)))
+            dct['_bytes'] = fields
+            if '__slots__' not in dct:
+                inherited = set()
+                for base in bases:
+                    for class_ in base.__mro__:
+                        inherited.update(class_.__dict__.get('__slots__', ()))
+                dct['__slots__'] = tuple(
+                    field for field, _ in fields if field not in inherited)
+        return super(ACUDPFieldsMeta, mcs).__new__(mcs, name, bases, dct)
+
+    def __init__(cls, name, bases, dct):
+        super(ACUDPFieldsMeta, cls).__init__(name, bases, dct)
+        if '_bytes' in cls.__dict__:
+            fields = cls._bytes
+            cls._steps = compile_fields(fields)
+            cls._field_index = dict(
+                (name, index) for index, (name, _) in enumerate(fields))
+            cls._static_offsets = static_offsets(fields)
+            cls._static_size = None
+            if len(cls._static_offsets) > len(fields):
+                cls._static_size = cls._static_offsets[-1]
+        if '_bytes' in cls.__dict__ or dct.get('_type') is not None:
+            type_ = getattr(cls, '_type', None)
+            cls.to_dict, cls.to_tuple, cls.to_bytes, from_tuple = \
+                compile_serializers(
+                    cls._bytes, cls._steps,
+                    b'' if type_ is None else struct.pack('B', type_))
+            cls.from_tuple = classmethod(from_tuple)
+        if dct.get('_type') is not None and hasattr(cls, '_registry') and \
+                not cls.__dict__.get('_flat_vectors'):
+            cls.register(cls)
+
+
+def _to_json(self, **kwargs):
+    """ Return the fields as a JSON string, json.dumps(self.to_dict()).
+
+    Keyword arguments:
+    kwargs -- json.dumps() keyword arguments
+    """
+    return json.dumps(self.to_dict(), **kwargs)
+
+
+# python 2 and 3 compatible way of declaring a metaclass
+_ACUDPBase = ACUDPFieldsMeta('_ACUDPBase', (object,), {
+    '__slots__': (), 'to_json': _to_json})
+
+
+class ACUDPPacket(_ACUDPBase):
     """ This is the base class for AC UDP events, having a message type
     and byte data. Type and bytes should be defined at class level by each
     packet. """
+    __slots__ = ('_buffer', '_offsets', '_timestamp')
+
+    # packet class indexed by type id
+    _registry = [None] * 256
+
+    @classmethod
+    def register(cls, packet_class, name=None):
+        """ Register a packet class, making factory() decode its _type with
+        it. Subclasses defining _type are registered automatically; this can
+        be used to replace a registered class by a custom one.
+
+        Keyword arguments:
+        packet_class -- ACUDPPacket subclass defining _type and _bytes
+        name -- packet type name (default: ACUDPConst name of _type)
+
+        Return packet_class.
+        """
+        type_ = packet_class._type
+        if not 0 <= type_ < len(ACUDPPacket._registry):
+            raise ValueError("Invalid packet type %s" % (type_,))
+        packet_class._name = name or ACUDPConst.id_to_name(type_)
+        ACUDPPacket._registry[type_] = packet_class
+        return packet_class
 
     @classmethod
     def packets(cls):
-        """ Return a dict of packet classes indexed by type """
-        pkts = {}
-        for subclass in cls.__subclasses__():
-            pkts[getattr(subclass, '_type')] = subclass
-        return pkts
+        """ Return a dict of registered packet classes indexed by type """
+        return dict((type_, class_)
+                    for type_, class_ in enumerate(ACUDPPacket._registry)
+                    if class_ is not None)
 
     @classmethod
-    def factory(cls, file_obj):
+    def factory(cls, file_obj, classes=None):
         """ Read an event from a file-like object.
         It first reads the packet type, as defined in AC UDP proto, then looks
         for it in the registered type classes. If type cannot be found, the
@@ -35,16 +135,47 @@ class ACUDPPacket(object):
 
         Keyword arguments:
         file_obj -- file-like object to read the event from.
+        classes -- optional sequence of packet classes indexed by type, used
+        instead of the registered ones (e.g. flat_registry())
 
         Return event object (subclass of ACUDPPacket).
         """
         try:
             type_ = UINT8.get(file_obj)
-            if type_ in ACUDPPacket.packets():
-                class_ = ACUDPPacket.packets()[type_]
-                return class_.from_file(file_obj)
-            else:
+            class_ = (classes or ACUDPPacket._registry)[type_]
+            if class_ is None:
                 raise NotImplementedError("Type not implemented %s" % (type_,))
+            return class_.from_file(file_obj)
+        except struct.error:
+            raise NotEnoughBytes
+
+    @classmethod
+    def factory_from_buffer(cls, buffer_, offset=0, lazy=False, fields=None,
+                            classes=None):
+        """ Same as factory() but decodes the event straight from a buffer
+        (bytes, bytearray or memoryview), e.g. a single received datagram,
+        without copying it.
+
+        Keyword arguments:
+        buffer_ -- buffer object to read the event from
+        offset -- position in buffer_ where the event starts (default: 0)
+        lazy -- see from_buffer() (default: False)
+        fields -- optional dict of field names to decode, indexed by packet
+        type. Types not found in it are fully decoded. See from_buffer().
+        classes -- see factory()
+
+        Return tuple (event object, offset after the event).
+        """
+        try:
+            type_, offset = UINT8.unpack_from(buffer_, offset)
+            class_ = (classes or ACUDPPacket._registry)[type_]
+            if class_ is None:
+                raise NotImplementedError("Type not implemented %s" % (type_,))
+            if lazy or fields:
+                return class_.from_buffer(
+                    buffer_, offset, lazy,
+                    fields.get(type_) if fields else None)
+            return class_.from_buffer(buffer_, offset)
         except struct.error:
             raise NotEnoughBytes
 
@@ -61,27 +192,160 @@ class ACUDPPacket(object):
         Return new packet instance.
         """
         instance = cls()
-        for name, data_type in cls._bytes:
-            val = data_type.get(file_obj, instance)
-            setattr(instance, name, val)
+        for step in cls._steps:
+            step.read(file_obj, instance)
         return instance
 
+    @classmethod
+    def from_buffer(cls, buffer_, offset=0, lazy=False, fields=None):
+        """ Create an instance from a buffer, starting at offset.
+
+        In lazy mode the instance keeps a reference to buffer_ and decodes
+        (and caches) each field the first time it is accessed, so buffer_
+        must not be modified afterwards. When fields is given, only those
+        fields are decoded; unless lazy is also True, the other fields are
+        then not available at all.
+
+        Keyword arguments:
+        buffer_ -- buffer object (bytes, bytearray or memoryview)
+        offset -- position in buffer_ to start reading from (default: 0)
+        lazy -- when True, defer decoding to attribute access (default: False)
+        fields -- optional collection of field names to decode right away
+
+        Return tuple (new instance, offset after the read bytes).
+        """
+        instance = cls()
+        if not lazy and fields is None:
+            for step in cls._steps:
+                offset = step.read_from(buffer_, offset, instance)
+            return instance, offset
+        instance._buffer = buffer_
+        instance._offsets = [offset + static for static in cls._static_offsets]
+        for name in fields or ():
+            getattr(instance, name)
+        end = instance._field_offset(len(cls._bytes))
+        if end > len(buffer_):
+            raise NotEnoughBytes
+        if not lazy:
+            del instance._buffer, instance._offsets
+        return instance, end
+
+    def _field_offset(self, index):
+        """ Return the offset of field number index in a lazy instance,
+        skipping over the preceding variable width fields when needed. """
+        offsets = self._offsets
+        while len(offsets) <= index:
+            last = len(offsets) - 1
+            offsets.append(
+                self._bytes[last][1].skip(self._buffer, offsets[last], self))
+        return offsets[index]
+
+    def __getattr__(self, name):
+        """ Decode and cache a field of a lazy instance on first access. """
+        if name.startswith('_') or getattr(self, '_buffer', None) is None:
+            raise AttributeError(name)
+        index = self._field_index.get(name)
+        if index is None:
+            raise AttributeError(name)
+        try:
+            val, _ = self._bytes[index][1].unpack_from(
+                self._buffer, self._field_offset(index), self)
+        except struct.error:
+            raise NotEnoughBytes
+        setattr(self, name, val)
+        return val
+
     def packet_name(self):
         """ Return the packet's type name. """
-        return ACUDPConst.id_to_name(self._type)
+        return self._name
+
+    @property
+    def timestamp(self):
+        """ Receive time of the packet (seconds since the epoch), or None if
+        it was not recorded. """
+        return getattr(self, '_timestamp', None)
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
 
     def __repr__(self):
         output = "<Packet(%s) %s>" % (
-            ACUDPConst.id_to_name(self._type),
+            self._name,
             ' '.join(["%s='%s'" % (name, repr(getattr(self, name, '')))
                       for name, _ in self._bytes])
             )
-        return output.encode('utf-8')
-
-
-class ACUDPPacketData(object):
+        if sys.version_info[0] < 3:
+            return output.encode('utf-8')
+        return output
+
+
+_FLAT_CLASSES = {}
+
+
+def flat_vectors(packet_class):
+    """ Return the flat vectors version of a packet class: a class decoding
+    the same packet, with one float field per vector value (e.g. pos_x,
+    pos_y, pos_z instead of pos) and no slot for the vectors themselves,
+    which remain readable as tuples (event.pos). Packet classes without
+    vectors are returned as they are.
+
+    The class is not registered: pass flat_registry() to the factories, or
+    listen(flat_vectors=True), to decode with it.
+
+    Keyword arguments:
+    packet_class -- ACUDPPacket subclass
+    """
+    if not flattened_vectors(packet_class._bytes):
+        return packet_class
+    flat = _FLAT_CLASSES.get(packet_class)
+    if flat is None:
+        flat = _FLAT_CLASSES[packet_class] = ACUDPFieldsMeta(
+            'Flat%s' % (packet_class.__name__,), packet_class.__bases__, {
+                '__doc__': packet_class.__doc__,
+                '__module__': packet_class.__module__,
+                '_type': packet_class._type,
+                '_name': packet_class._name,
+                '_bytes': packet_class._bytes,
+                '_flat_vectors': True})
+    return flat
+
+
+def flat_registry():
+    """ Return list of the registered packet classes indexed by type, with
+    their flat_vectors() version. """
+    return [None if class_ is None else flat_vectors(class_)
+            for class_ in ACUDPPacket._registry]
+
+
+def car_id_of(datagram):
+    """ Read the car_id of a raw datagram, decoding as little as possible.
+
+    Keyword arguments:
+    datagram -- buffer object holding one packet
+
+    Return car_id or None if the packet has none (or cannot be decoded).
+    """
+    try:
+        type_, offset = UINT8.unpack_from(datagram)
+        class_ = ACUDPPacket._registry[type_]
+        index = class_._field_index.get('car_id')
+        if index is None:
+            return None
+        if index < len(class_._static_offsets):
+            return UINT8.unpack_from(
+                datagram, offset + class_._static_offsets[index])[0]
+        event, _ = class_.from_buffer(datagram, offset, lazy=True)
+        return event.car_id
+    except (NotEnoughBytes, AttributeError, UnicodeDecodeError,
+            struct.error):
+        return None
+
+
+class ACUDPPacketData(_ACUDPBase):
     """ This class represents part of an AC UDP message (ACUDPPacket). It's
     specially useful to define a block of data that repeats. """
+    __slots__ = ()
 
     @classmethod
     def from_file(cls, file_obj):
@@ -95,16 +359,40 @@ class ACUDPPacketData(object):
         Return new packet data instance.
         """
         instance = cls()
-        for name, data_type in cls._bytes:
-            val = data_type.get(file_obj)
-            setattr(instance, name, val)
+        for step in cls._steps:
+            step.read(file_obj, instance)
         return instance
 
+    @classmethod
+    def from_buffer(cls, buffer_, offset=0):
+        """ Create an instance from a buffer, starting at offset.
+
+        Keyword arguments:
+        buffer_ -- buffer object (bytes, bytearray or memoryview)
+        offset -- position in buffer_ to start reading from (default: 0)
+
+        Return tuple (new instance, offset after the read bytes).
+        """
+        instance = cls()
+        for step in cls._steps:
+            offset = step.read_from(buffer_, offset, instance)
+        return instance, offset
+
+    @classmethod
+    def skip(cls, buffer_, offset=0):
+        """ Return the offset after the packet data starting at offset,
+        without decoding it. """
+        if cls._static_size is not None:
+            return offset + cls._static_size
+        return cls.from_buffer(buffer_, offset)[1]
+
     def __repr__(self):
         output = "<%s>" % (
             ' '.join(["%s='%s'" % (name, repr(getattr(self, name, '')))
                       for name, _ in self._bytes]))
-        return output.encode('utf-8')
+        if sys.version_info[0] < 3:
+            return output.encode('utf-8')
+        return output
 
 
 # Types
@@ -0,0 +1,284 @@
+"""
+Multi-process decoding pipeline for ACUDPClient
+"""
+import logging
+import marshal
+import multiprocessing
+import select
+import struct
+import time
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:  # python 2
+    def wait(object_list, timeout=None):
+        """ Return the objects of object_list ready to be read. """
+        return select.select(object_list, [], [], timeout)[0]
+
+from acudpclient.packet_base import ACUDPPacket, car_id_of, flat_registry
+from acudpclient.exceptions import NotEnoughBytes
+
+LOG = logging.getLogger("ac_udp_pipeline")
+
+# Frame of a datagram in a batch: receive timestamp (NaN if none) and size
+FRAME = struct.Struct('<dH')
+NAN = float('nan')
+# Packet type and the byte after it, the car_id of most packets
+_TYPE_AND_BYTE = struct.Struct('BB')
+
+
+def _car_id_positions():
+    """ Return list of the position of car_id in the datagrams of each
+    packet type: None if the type has no car_id, -1 if the position
+    depends on the packet (see car_id_of()). """
+    positions = [None] * len(ACUDPPacket._registry)
+    for type_, class_ in enumerate(ACUDPPacket._registry):
+        index = getattr(class_, '_field_index', {}).get('car_id')
+        if index is None:
+            continue
+        if index < len(class_._static_offsets):
+            positions[type_] = 1 + class_._static_offsets[index]
+        else:
+            positions[type_] = -1
+    return positions
+
+
+def _decode_worker(inputs, results, flat_vectors=False):
+    """ Worker process main loop: decode batches of framed datagrams (see
+    FRAME) received from the inputs queue and send the events through the
+    results connection, as a marshalled list of (type, to_tuple(), receive
+    timestamp or None) rows. A None batch stops the worker. """
+    classes = flat_registry() if flat_vectors else None
+    while True:
+        batch = inputs.get()
+        if batch is None:
+            break
+        view = memoryview(batch)
+        rows = []
+        offset = 0
+        while offset < len(batch):
+            timestamp, size = FRAME.unpack_from(batch, offset)
+            offset += FRAME.size
+            # a sliced view: a truncated packet cannot read the next frame
+            datagram = view[offset:offset + size]
+            offset += size
+            try:
+                event = ACUDPPacket.factory_from_buffer(
+                    datagram, classes=classes)[0]
+            except (NotEnoughBytes, NotImplementedError,
+                    UnicodeDecodeError, struct.error) as err:
+                LOG.warning("Skipping bad datagram (%d bytes): %r",
+                            size, err)
+                continue
+            rows.append((event._type, event.to_tuple(),
+                         None if timestamp != timestamp else timestamp))
+        results.send_bytes(marshal.dumps(rows))
+    results.close()
+
+
+def rebuild_events(data, classes=None):
+    """ Rebuild the events of a batch of results sent by a worker.
+
+    Keyword arguments:
+    data -- bytes received from a worker's results connection
+    classes -- see ACUDPPacket.factory()
+
+    Return list of event objects.
+    """
+    classes = classes or ACUDPPacket._registry
+    events = []
+    for type_, row, timestamp in marshal.loads(data):
+        event = classes[type_].from_tuple(row)
+        if timestamp is not None:
+            event.timestamp = timestamp
+        events.append(event)
+    return events
+
+
+class ACUDPPipeline(object):
+    """ Decodes the datagrams received by an ACUDPClient in a pool of worker
+    processes. The receiving process shards raw datagrams by car_id (read
+    without decoding the packet) so every event of a car is decoded, and
+    returned, in order by the same worker. Packets without a car_id (session
+    packets, errors...) all go to the first worker. Receive timestamps (see
+    ACUDPClient.listen(timestamps=True)) and flat vectors are kept.
+
+    Datagrams go to the workers as one framed bytes batch per worker, and
+    events come back as marshalled to_tuple() rows, rebuilt with
+    from_tuple(): both are much cheaper than pickling packet objects, which
+    would cost the receiving process more than decoding itself.
+
+    Workers are forked from the current process, so packet classes
+    registered at runtime are known to them when using the fork start
+    method. A worker that dies is restarted, the events it was decoding are
+    lost. """
+
+    def __init__(self, client, workers=2, context=None):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPClient, listening in datagram mode. Its subscribers
+        are notified of the decoded events
+        workers -- number of worker processes (default: 2)
+        context -- multiprocessing context (default: multiprocessing module)
+        """
+        if client._views is None:
+            raise ValueError('ACUDPPipeline requires datagram mode')
+        self.client = client
+        self.workers = workers
+        self._context = context or multiprocessing
+        self._processes = []
+        self._inputs = []
+        self._results = []
+        self._positions = _car_id_positions()
+
+    def _start_worker(self, index):
+        """ Start (or restart) worker number index. """
+        inputs = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_decode_worker,
+            args=(inputs, writer, self.client._classes is not None))
+        process.daemon = True
+        process.start()
+        writer.close()
+        if index < len(self._processes):
+            self._processes[index] = process
+            self._inputs[index] = inputs
+            self._results[index] = reader
+        else:
+            self._processes.append(process)
+            self._inputs.append(inputs)
+            self._results.append(reader)
+
+    def start(self):
+        """ Start the worker processes. """
+        self._positions = _car_id_positions()
+        for index in range(self.workers):
+            self._start_worker(index)
+
+    def stop(self, timeout=5.0):
+        """ Stop the worker processes, dropping events not consumed yet.
+        Results are drained while waiting, so workers blocked on a full
+        results pipe can exit. Workers still running after timeout seconds
+        are terminated.
+
+        Keyword arguments:
+        timeout -- max seconds to wait for the workers (default: 5.0)
+        """
+        for inputs in self._inputs:
+            inputs.put(None)
+        deadline = time.time() + timeout
+        for process, reader in zip(self._processes, self._results):
+            while process.is_alive() and time.time() < deadline:
+                try:
+                    while reader.poll(0.01):
+                        reader.recv_bytes()
+                except (EOFError, IOError, OSError):
+                    process.join(max(0, deadline - time.time()))
+                    break
+            if process.is_alive():
+                LOG.warning("Terminating decode worker %s", process.pid)
+                process.terminate()
+            process.join()
+        for inputs, reader in zip(self._inputs, self._results):
+            inputs.cancel_join_thread()
+            inputs.close()
+            reader.close()
+        self._processes = []
+        self._inputs = []
+        self._results = []
+
+    def _dispatch_datagrams(self):
+        """ Drain the client socket and hand the datagrams to the workers.
+
+        Return number of datagrams dispatched. """
+        batches = [bytearray() for _ in range(self.workers)]
+        count = 0
+        while True:
+            datagrams = self.client._receive_datagrams()
+            if not datagrams:
+                break
+            self.shard(datagrams, batches)
+            count += len(datagrams)
+        for inputs, batch in zip(self._inputs, batches):
+            if batch:
+                inputs.put(bytes(batch))
+        return count
+
+    def shard(self, datagrams, batches):
+        """ Append datagrams to the batch of the worker decoding their car,
+        framed with FRAME.
+
+        Keyword arguments:
+        datagrams -- iterable of (datagram, receive timestamp or None)
+        batches -- list of one bytearray per worker
+        """
+        workers = self.workers
+        positions = self._positions
+        pack = FRAME.pack
+        unpack_from = _TYPE_AND_BYTE.unpack_from
+        for datagram, timestamp in datagrams:
+            try:
+                type_, car_id = unpack_from(datagram)
+                position = positions[type_]
+                if position is None:
+                    car_id = 0
+                elif position != 1:
+                    car_id = car_id_of(datagram) or 0
+            except struct.error:
+                car_id = 0
+            batch = batches[car_id % workers]
+            batch += pack(NAN if timestamp is None else timestamp,
+                          len(datagram))
+            batch += datagram
+
+    def _receive_results(self, reader, index):
+        """ Return the events ready in reader, restarting worker number
+        index if it died. """
+        events = []
+        try:
+            while reader.poll():
+                events.extend(rebuild_events(reader.recv_bytes(),
+                                             self.client._classes))
+        except (EOFError, IOError, OSError):
+            LOG.error("Decode worker %s died (exit code %s), restarting it",
+                      self._processes[index].pid,
+                      self._processes[index].exitcode)
+            reader.close()
+            self._inputs[index].cancel_join_thread()
+            self._inputs[index].close()
+            self._start_worker(index)
+        return events
+
+    def get_next_events(self, timeout=None, call_subscribers=True):
+        """ Receive and dispatch ready datagrams to the workers and return
+        the events decoded so far, waiting up to timeout for some.
+
+        Keyword arguments:
+        timeout -- max seconds to wait for events. None waits forever, 0
+        never waits (default: None)
+        call_subscribers -- when True, the client's subscribers get notified
+        of every event
+
+        Return list of event objects. Events of the same car are in order.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        events = []
+        while True:
+            self._dispatch_datagrams()
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            ready = wait([self.client.sock] + self._results, remaining)
+            for index, reader in enumerate(list(self._results)):
+                if reader in ready:
+                    events.extend(self._receive_results(reader, index))
+            if events or not ready:
+                break
+        if call_subscribers:
+            handlers = self.client._handlers
+            for event in events:
+                for handler in handlers[event._type]:
+                    handler(event)
+        return events
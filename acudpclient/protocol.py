@@ -38,8 +38,16 @@ class ACUDPConst(object):
 
         Return constant name.
         """
-        for attr in cls.__dict__:
-            if attr.startswith('ACSP_'):
-                if getattr(cls, attr) == id_:
-                    return attr
+        try:
+            if id_ >= 0:
+                return _NAMES[id_]
+        except (IndexError, TypeError):
+            pass
         return None
+
+
+# id -> name lookup table, built once
+_NAMES = [None] * 256
+for _attr in sorted(ACUDPConst.__dict__):
+    if _attr.startswith('ACSP_'):
+        _NAMES[getattr(ACUDPConst, _attr)] = _attr
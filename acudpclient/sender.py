@@ -0,0 +1,98 @@
+"""
+Rate limited, batched sending of commands to the AC server
+"""
+import collections
+import inspect
+import time
+
+from acudpclient import commands
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class ACUDPCommandQueue(object):
+    """ Queue of outgoing commands, sent in batches by flush() at no more
+    than rate datagrams per second (token bucket), so the AC server is not
+    flooded. Message payloads are encoded once per distinct message, even
+    when sent to many drivers. """
+
+    def __init__(self, client, rate=50.0, burst=20, clock=_clock):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- client used to send the datagrams, through its send()
+        method (ACUDPClient or ACUDPAsyncClient)
+        rate -- max datagrams sent per second (default: 50)
+        burst -- max datagrams sent at once after being idle (default: 20)
+        clock -- callable returning the current time in seconds
+        (default: time.monotonic, time.time on python 2)
+        """
+        iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+        if iscoroutinefunction is not None and \
+                iscoroutinefunction(client.send):
+            raise TypeError("%s.send() must send right away, not be a "
+                            "coroutine" % (type(client).__name__,))
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._queue = collections.deque()
+        self._tokens = float(burst)
+        self._last = clock()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, data):
+        """ Queue an encoded command (see acudpclient.commands). """
+        self._queue.append(data)
+
+    def flush(self):
+        """ Send as many queued commands as the rate limit allows.
+
+        Return number of datagrams sent. """
+        now = self.clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        count = min(int(self._tokens), len(self._queue))
+        send = self.client.send
+        for _ in range(count):
+            send(self._queue.popleft())
+        self._tokens -= count
+        return count
+
+    def send_message(self, car_id, message):
+        """ Queue a message to a specific driver. """
+        self.put(commands.send_message(car_id, message))
+
+    def send_messages(self, car_ids, message):
+        """ Queue the same message to several drivers. """
+        for car_id in car_ids:
+            self.put(commands.send_message(car_id, message))
+
+    def broadcast_message(self, message):
+        """ Queue a message broadcast. """
+        self.put(commands.broadcast_message(message))
+
+    def kick_user(self, car_id):
+        """ Queue a kick request. """
+        self.put(commands.kick_user(car_id))
+
+    def admin_command(self, command):
+        """ Queue an admin command. """
+        self.put(commands.admin_command(command))
+
+    def next_session(self):
+        """ Queue a move to the next session. """
+        self.put(commands.next_session())
+
+    def restart_session(self):
+        """ Queue a restart of the current session. """
+        self.put(commands.restart_session())
+
+    def set_session_info(self, session_index, name, session_type, laps,
+                         time_s, wait_time_s):
+        """ Queue a session change, see ACUDPClient.set_session_info(). """
+        self.put(commands.set_session_info(
+            session_index, name, session_type, laps, time_s, wait_time_s))
@@ -0,0 +1,310 @@
+"""
+Replay server: a local stand-in for the AC server, sending recorded or
+synthetic traffic to an ACUDPClient (for load tests and benchmarks)
+"""
+import collections
+import errno
+import logging
+import math
+import select
+import socket
+import struct
+import time
+
+from acudpclient import commands
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.exceptions import NotEnoughBytes
+
+LOG = logging.getLogger("ac_udp_server")
+
+POLL_EVERY = 256
+"""Datagrams sent between two request polls when playing as fast as
+possible."""
+
+
+def _ascii(value):
+    return struct.pack('B', len(value)) + value.encode('ascii')
+
+
+def encode_car_update(car_id, pos, vel, gear, engine_rpm,
+                      normalized_spline_pos):
+    """ Encode a CarUpdate packet. """
+    return struct.pack('<BB3f3fBHf', ACUDPConst.ACSP_CAR_UPDATE, car_id,
+                       pos[0], pos[1], pos[2], vel[0], vel[1], vel[2],
+                       gear, engine_rpm, normalized_spline_pos)
+
+
+def encode_lap_completed(car_id, lap_time, cuts=0, cars=(), grip_level=1.0):
+    """ Encode a LapCompleted packet.
+
+    Keyword arguments:
+    cars -- leaderboard, list of (rcar_id, rtime, rlaps, has_completed_flag)
+    tuples
+    """
+    return (struct.pack('<BBIBB', ACUDPConst.ACSP_LAP_COMPLETED, car_id,
+                        lap_time, cuts, len(cars)) +
+            b''.join(struct.pack('<BIHB', *entry) for entry in cars) +
+            struct.pack('<f', grip_level))
+
+
+def encode_car_info(car_id, is_connected, car_model, car_skin, driver_name,
+                    driver_team, driver_guid):
+    """ Encode a CarInfo packet. """
+    return (struct.pack('BBB', ACUDPConst.ACSP_CAR_INFO, car_id,
+                        is_connected) +
+            commands.encode_string(car_model) +
+            commands.encode_string(car_skin) +
+            commands.encode_string(driver_name) +
+            commands.encode_string(driver_team) +
+            commands.encode_string(driver_guid))
+
+
+def encode_new_connection(car_id, driver_name, driver_guid, car_model='',
+                          car_skin='', type_=ACUDPConst.ACSP_NEW_CONNECTION):
+    """ Encode a NewConnection (or ConnectionClosed) packet. """
+    return (struct.pack('B', type_) +
+            commands.encode_string(driver_name) +
+            commands.encode_string(driver_guid) +
+            struct.pack('B', car_id) +
+            _ascii(car_model) + _ascii(car_skin))
+
+
+def encode_session_info(type_=ACUDPConst.ACSP_SESSION_INFO, proto_version=4,
+                        session_index=0, current_sess_index=0,
+                        session_count=1, server_name=u'ACUDPReplayServer',
+                        track_name='monza', track_config='', name='Race',
+                        session_type=3, time_=0, laps=10, wait_time=60,
+                        ambient_temp=20, track_temp=25, weather_graph='',
+                        elapsed_ms=0):
+    """ Encode a SessionInfo (or NewSession) packet. """
+    return (struct.pack('BBBBB', type_, proto_version, session_index,
+                        current_sess_index, session_count) +
+            commands.encode_string(server_name) +
+            _ascii(track_name) + _ascii(track_config) + _ascii(name) +
+            struct.pack('<BHHHBB', session_type, time_, laps, wait_time,
+                        ambient_temp, track_temp) +
+            _ascii(weather_graph) +
+            struct.pack('<I', elapsed_ms))
+
+
+def dump_records(data):
+    """ Split a raw dump of concatenated packets (e.g. tests/ac_out) into
+    datagrams. Decoding stops at the first packet that cannot be decoded.
+
+    Return generator of (None, datagram bytes) tuples. """
+    offset = 0
+    while offset < len(data):
+        try:
+            _, end = ACUDPPacket.factory_from_buffer(data, offset)
+        except (NotEnoughBytes, NotImplementedError,
+                UnicodeDecodeError, struct.error):
+            LOG.warning("Stopping at undecodable packet (offset %d)", offset)
+            return
+        yield None, data[offset:end]
+        offset = end
+
+
+class ACUDPReplayServer(object):
+    """ Sends datagrams to an ACUDPClient as the AC server would, either
+    replayed from a capture (see acudpclient.capture) or raw dump, or
+    generated for a number of synthetic cars. Playback is real time
+    (speed=1), accelerated (speed>1) or as fast as possible (speed=None).
+
+    ACSP_GET_CAR_INFO, ACSP_GET_SESSION_INFO and ACSP_REALTIMEPOS_INTERVAL
+    requests are answered while playing (or in serve()). Car and session
+    info come from the replayed NewConnection/CarInfo/NewSession packets,
+    or from the synthetic cars. """
+
+    def __init__(self, port=10001, client_host='127.0.0.1',
+                 client_port=10000, speed=1.0):
+        """ Constructor.
+
+        Keyword arguments:
+        port -- bind udp port, receiving the client's requests
+        client_host -- client udp host
+        client_port -- client udp port
+        speed -- playback speed factor, None to send as fast as possible
+        (default: 1.0 - real time)
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', port))
+        self.sock.setblocking(0)
+        self.client_address = (client_host, client_port)
+        self.speed = speed
+        self.interval_ms = 0
+        self.cars = {}
+        self.session = encode_session_info()
+        self.requests = collections.Counter()
+        self.sent = 0
+
+    def close(self):
+        """ Close the socket """
+        self.sock.close()
+
+    def send(self, datagram):
+        """ Send a datagram to the client. """
+        self.sock.sendto(datagram, self.client_address)
+        self.sent += 1
+
+    def _learn(self, datagram):
+        """ Keep the car and session info found in a replayed datagram, to
+        answer requests. """
+        type_ = struct.unpack_from('B', datagram)[0]
+        if type_ in (ACUDPConst.ACSP_NEW_SESSION,
+                     ACUDPConst.ACSP_SESSION_INFO):
+            self.session = struct.pack('B', ACUDPConst.ACSP_SESSION_INFO) + \
+                bytes(datagram[1:])
+        elif type_ in (ACUDPConst.ACSP_NEW_CONNECTION,
+                       ACUDPConst.ACSP_CAR_INFO,
+                       ACUDPConst.ACSP_CONNECTION_CLOSED):
+            try:
+                event, _ = ACUDPPacket.factory_from_buffer(datagram)
+            except (NotEnoughBytes, UnicodeDecodeError, struct.error):
+                return
+            car = self.cars.setdefault(event.car_id, {
+                'car_model': u'', 'car_skin': u'', 'driver_name': u'',
+                'driver_team': u'', 'driver_guid': u''})
+            car['is_connected'] = \
+                type_ != ACUDPConst.ACSP_CONNECTION_CLOSED and \
+                getattr(event, 'is_connected', True)
+            for name in car:
+                if name != 'is_connected' and hasattr(event, name):
+                    car[name] = getattr(event, name)
+
+    def handle_requests(self, timeout=0):
+        """ Answer the pending client requests, waiting up to timeout for
+        one.
+
+        Keyword arguments:
+        timeout -- max seconds to wait for a request (default: 0)
+
+        Return number of requests handled. """
+        count = 0
+        if timeout and not select.select([self.sock], [], [], timeout)[0]:
+            return count
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return count
+                raise
+            if not data:
+                continue
+            count += 1
+            data = bytearray(data)
+            type_ = data[0]
+            self.requests[type_] += 1
+            try:
+                if type_ == ACUDPConst.ACSP_GET_CAR_INFO:
+                    car_id = data[1]
+                    car = self.cars.get(car_id)
+                    if car is None:
+                        self.send(encode_car_info(car_id, False, u'', u'',
+                                                  u'', u'', u''))
+                    else:
+                        self.send(encode_car_info(car_id, **car))
+                elif type_ == ACUDPConst.ACSP_GET_SESSION_INFO:
+                    self.send(self.session)
+                elif type_ == ACUDPConst.ACSP_REALTIMEPOS_INTERVAL:
+                    self.interval_ms = struct.unpack_from('<H', data, 1)[0]
+            except (IndexError, struct.error):
+                LOG.warning("Ignoring bad request %r", bytes(data))
+
+    def _wait(self, until):
+        """ Answer requests until time.time() reaches until. """
+        while True:
+            remaining = until - time.time()
+            if remaining <= 0:
+                return
+            self.handle_requests(remaining)
+
+    def play(self, records):
+        """ Send datagrams, paced by their timestamps (see speed).
+
+        Keyword arguments:
+        records -- iterable of (timestamp or None, datagram) tuples, e.g. an
+        ACUDPCaptureReader or dump_records(). Records without timestamp are
+        sent right away
+
+        Requests are answered while waiting for the next record; when
+        sending right away, pending requests are read without blocking
+        every POLL_EVERY datagrams.
+
+        Return number of datagrams sent. """
+        sent = self.sent
+        start = first = None
+        unpolled = 0
+        for timestamp, datagram in records:
+            if self.speed is not None and timestamp is not None:
+                if first is None:
+                    start, first = time.time(), timestamp
+                self._wait(start + (timestamp - first) / self.speed)
+                unpolled = 0
+            else:
+                unpolled += 1
+                if unpolled >= POLL_EVERY:
+                    self.handle_requests()
+                    unpolled = 0
+            if datagram:
+                self._learn(datagram)
+            self.send(datagram)
+        self.handle_requests()
+        return self.sent - sent
+
+    def add_cars(self, count):
+        """ Add synthetic cars (and drivers), answered to GET_CAR_INFO. """
+        first = max(self.cars) + 1 if self.cars else 0
+        for car_id in range(first, first + count):
+            self.cars[car_id] = {
+                'is_connected': True, 'car_model': u'ks_mazda_mx5_cup',
+                'car_skin': u'00_red', 'driver_name': u'Driver %d' % car_id,
+                'driver_team': u'', 'driver_guid': u'%017d' % car_id}
+
+    def synthetic_records(self, duration, lap_time=90.0, radius=500.0):
+        """ Generate traffic for the known cars driving around a circular
+        track: a CarUpdate per car every interval_ms and a LapCompleted on
+        every lap. As on the AC server, no CarUpdate is sent while real
+        time reports are disabled (interval_ms is 0, cars are then moved
+        every 100ms); the interval is read at each tick, so it follows
+        ACSP_REALTIMEPOS_INTERVAL requests.
+
+        Keyword arguments:
+        duration -- simulated seconds
+        lap_time -- seconds per lap, cars are slightly staggered
+        radius -- track radius in meters
+
+        Return generator of (timestamp, datagram) tuples. """
+        car_ids = sorted(self.cars)
+        laps = dict((car_id, 0) for car_id in car_ids)
+        now = 0.0
+        while now < duration:
+            for car_id in car_ids:
+                car_lap_time = lap_time * (1 + car_id / 100.0)
+                if self.interval_ms:
+                    spline = (now / car_lap_time + car_id / 50.0) % 1.0
+                    angle = 2 * math.pi * spline
+                    speed = 2 * math.pi * radius / car_lap_time
+                    yield now, encode_car_update(
+                        car_id, (radius * math.cos(angle), 0.0,
+                                 radius * math.sin(angle)),
+                        (-speed * math.sin(angle), 0.0,
+                         speed * math.cos(angle)),
+                        4, 6000, spline)
+                lap = int(now / car_lap_time + car_id / 50.0)
+                if lap > laps[car_id]:
+                    laps[car_id] = lap
+                    yield now, encode_lap_completed(
+                        car_id, int(car_lap_time * 1000),
+                        cars=[(id_, int(lap_time * 1000), laps[id_], 0)
+                              for id_ in car_ids])
+            now += (self.interval_ms or 100) / 1000.0
+
+    def serve(self, duration=None):
+        """ Only answer requests, for duration seconds (default: None -
+        forever). """
+        until = None if duration is None else time.time() + duration
+        while until is None or time.time() < until:
+            self.handle_requests(
+                1.0 if until is None else max(0.001, until - time.time()))
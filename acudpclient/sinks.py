@@ -0,0 +1,273 @@
+"""
+Export sinks: subscribers persisting events in bulk (JSON Lines, SQLite,
+columnar CarUpdate files) from a background writer thread
+"""
+import array
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+
+LOG = logging.getLogger("ac_udp_sinks")
+
+
+class ACUDPSink(object):
+    """ Base class of sinks. A sink is a subscriber buffering the events of
+    the given types; a writer thread hands them to write() in batches once
+    batch_size events are buffered or every flush_interval seconds, so
+    storage never delays the client's socket draining.
+
+    Event timestamps (see listen(timestamps=True)) are exported as well. """
+
+    def __init__(self, types=None, batch_size=1000, flush_interval=1.0):
+        """ Constructor.
+
+        Keyword arguments:
+        types -- collection of packet type ids to export (default: None -
+        every registered type)
+        batch_size -- buffered events triggering a write (default: 1000)
+        flush_interval -- max seconds an event stays buffered (default: 1.0)
+        """
+        self.types = frozenset(ACUDPPacket.packets() if types is None
+                               else types)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._events = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        for type_ in self.types:
+            setattr(self, 'on_%s' % (ACUDPConst.id_to_name(type_),), self.put)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, event):
+        """ Buffer an event (subscriber handler of every exported type). """
+        self._events.append(event)
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    def _drain(self):
+        events = self._events
+        batch = []
+        while events:
+            batch.append(events.popleft())
+        if batch:
+            try:
+                self.write(batch)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("%s failed to write %d events",
+                              type(self).__name__, len(batch))
+            else:
+                self.written += len(batch)
+
+    def _run(self):
+        try:
+            while not self._stopped:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._drain()
+            self._drain()
+        finally:
+            self.close_output()
+
+    def flush(self):
+        """ Wake the writer thread up to write the buffered events. """
+        self._wakeup.set()
+
+    def close(self):
+        """ Write the buffered events, stop the writer thread and close the
+        output. Unsubscribe the sink from its client first. """
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def write(self, events):
+        """ Write a batch of events (called from the writer thread). """
+        raise NotImplementedError
+
+    def close_output(self):
+        """ Close the output (called from the writer thread). """
+
+
+class ACUDPJSONLinesSink(ACUDPSink):
+    """ Writes events to a JSON Lines file, one object per event with its
+    packet name, timestamp and fields. """
+
+    def __init__(self, path, types=None, batch_size=1000,
+                 flush_interval=1.0):
+        """ Constructor.
+
+        Keyword arguments:
+        path -- output file path (appended to)
+        """
+        self._file = open(path, 'a')
+        super(ACUDPJSONLinesSink, self).__init__(types, batch_size,
+                                                 flush_interval)
+
+    def write(self, events):
+        lines = []
+        for event in events:
+            values = event.to_dict()
+            values['packet'] = event.packet_name()
+            values['timestamp'] = event.timestamp
+            lines.append(json.dumps(values))
+        lines.append('')
+        self._file.write('\n'.join(lines))
+        self._file.flush()
+
+    def close_output(self):
+        self._file.close()
+
+
+class ACUDPSQLiteSink(ACUDPSink):
+    """ Writes events to a SQLite database, one table per packet type (named
+    after the type, e.g. lap_completed) with a timestamp column and a column
+    per field. Vectors and leaderboards are stored as JSON text. Each batch
+    is inserted with executemany() in a single transaction. """
+
+    def __init__(self, path, types=None, batch_size=1000,
+                 flush_interval=1.0):
+        """ Constructor.
+
+        Keyword arguments:
+        path -- database file path
+        """
+        self.path = path
+        self._db = None
+        self._inserts = {}
+        super(ACUDPSQLiteSink, self).__init__(types, batch_size,
+                                              flush_interval)
+
+    @staticmethod
+    def table_name(type_):
+        """ Return the table name of a packet type. """
+        return ACUDPConst.id_to_name(type_)[len('ACSP_'):].lower()
+
+    def _insert(self, class_):
+        """ Return the insert statement of a packet class, creating its
+        table the first time. """
+        insert = self._inserts.get(class_._type)
+        if insert is None:
+            table = self.table_name(class_._type)
+            columns = ['timestamp'] + [name for name, _ in class_._bytes]
+            self._db.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+                table, ', '.join(columns)))
+            insert = self._inserts[class_._type] = \
+                'INSERT INTO %s VALUES (%s)' % (
+                    table, ', '.join(['?'] * len(columns)))
+        return insert
+
+    def write(self, events):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+        rows = collections.defaultdict(list)
+        for event in events:
+            # columns are read by name, to_dict() order is not guaranteed
+            # (python 2)
+            row = [event.timestamp]
+            for name, _ in event._bytes:
+                value = getattr(event, name)
+                if isinstance(value, list):
+                    value = json.dumps([item.to_dict() for item in value])
+                elif isinstance(value, tuple):
+                    value = json.dumps(value)
+                row.append(value)
+            rows[type(event)].append(row)
+        with self._db:
+            for class_, class_rows in rows.items():
+                self._db.executemany(self._insert(class_), class_rows)
+
+    def close_output(self):
+        if self._db is not None:
+            self._db.close()
+
+
+CAR_UPDATE_COLUMNS = (
+    ('timestamp', 'd'),
+    ('car_id', 'B'),
+    ('pos_x', 'f'), ('pos_y', 'f'), ('pos_z', 'f'),
+    ('vel_x', 'f'), ('vel_y', 'f'), ('vel_z', 'f'),
+    ('gear', 'B'),
+    ('engine_rpm', 'H'),
+    ('normalized_spline_pos', 'f'),
+)
+"""Columns (name, array typecode) written by ACUDPCarUpdateColumnsSink."""
+
+
+class ACUDPCarUpdateColumnsSink(ACUDPSink):
+    """ Writes CarUpdate events column by column: one file per column in
+    directory path (e.g. pos_x.f), holding packed native values, so a
+    column is read back without touching the others (see read_columns(),
+    or numpy.fromfile). Missing timestamps are stored as NaN. """
+
+    def __init__(self, path, batch_size=10000, flush_interval=1.0):
+        """ Constructor.
+
+        Keyword arguments:
+        path -- output directory (created if needed, columns appended to)
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self._files = [
+            open(os.path.join(path, '%s.%s' % (name, typecode)), 'ab')
+            for name, typecode in CAR_UPDATE_COLUMNS]
+        super(ACUDPCarUpdateColumnsSink, self).__init__(
+            [ACUDPConst.ACSP_CAR_UPDATE], batch_size, flush_interval)
+
+    def write(self, events):
+        nan = float('nan')
+        columns = [array.array(typecode) for _, typecode
+                   in CAR_UPDATE_COLUMNS]
+        (timestamp, car_id, pos_x, pos_y, pos_z, vel_x, vel_y, vel_z, gear,
+         engine_rpm, spline) = columns
+        for event in events:
+            timestamp.append(nan if event.timestamp is None
+                             else event.timestamp)
+            car_id.append(event.car_id)
+            pos = event.pos
+            pos_x.append(pos[0])
+            pos_y.append(pos[1])
+            pos_z.append(pos[2])
+            vel = event.vel
+            vel_x.append(vel[0])
+            vel_y.append(vel[1])
+            vel_z.append(vel[2])
+            gear.append(event.gear)
+            engine_rpm.append(event.engine_rpm)
+            spline.append(event.normalized_spline_pos)
+        for column, file_obj in zip(columns, self._files):
+            column.tofile(file_obj)
+            file_obj.flush()
+
+    def close_output(self):
+        for file_obj in self._files:
+            file_obj.close()
+
+
+def read_columns(path):
+    """ Read the columns written by ACUDPCarUpdateColumnsSink.
+
+    Keyword arguments:
+    path -- sink output directory
+
+    Return dict of array.array, indexed by column name. """
+    columns = {}
+    for name, typecode in CAR_UPDATE_COLUMNS:
+        column = array.array(typecode)
+        with open(os.path.join(path, '%s.%s' % (name, typecode)),
+                  'rb') as file_obj:
+            data = file_obj.read()
+            if hasattr(column, 'frombytes'):
+                column.frombytes(data)
+            else:  # python 2
+                column.fromstring(data)
+        columns[name] = column
+    return columns
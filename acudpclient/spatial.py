@@ -0,0 +1,289 @@
+"""
+Spatial index of car positions (uniform grid over the x/z plane) with
+radius queries, proximity callbacks and density heatmaps, plus vectorized
+batch functions for CarUpdate records (see acudpclient.batch)
+"""
+import collections
+import math
+
+from acudpclient.batch import _require_numpy, numpy
+
+
+class ACUDPSpatialIndex(object):
+    """ Subscriber keeping the last position and velocity of every car in a
+    uniform grid of cell_size meters over the horizontal (x, z) plane, so
+    finding the cars around a point only looks at the neighbouring cells
+    instead of comparing every pair of cars.
+
+    Distances are 3D. Every CarUpdate checks the moved car against its
+    neighbours: pairs of cars getting within radius are reported to the
+    proximity watchers (with their closing speed, for near-miss detection)
+    and pairs drifting apart again to the separation watchers. Visited
+    cells and proximity events are counted per cell (heatmaps). """
+
+    def __init__(self, client=None, radius=5.0, cell_size=None):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPClient to subscribe to (default: None - events are
+        fed by the caller)
+        radius -- proximity distance, in meters (default: 5.0)
+        cell_size -- grid cell size, in meters (default: None - radius)
+        """
+        self.radius = radius
+        self.cell_size = cell_size or radius
+        self._rings = int(math.ceil(radius / self.cell_size))
+        self._proximity_watchers = []
+        self._separation_watchers = []
+        self.clear()
+        if client is not None:
+            client.subscribe(self)
+
+    def clear(self):
+        """ Forget every car and reset the heatmaps. """
+        self._cells = collections.defaultdict(set)
+        self._cell_of = {}
+        self.pos = {}
+        self.vel = {}
+        self._near = collections.defaultdict(set)
+        self.density = collections.Counter()
+        self.incidents = collections.Counter()
+
+    def watch(self, on_proximity, on_separation=None):
+        """ Register proximity callbacks.
+
+        Keyword arguments:
+        on_proximity -- called as on_proximity(car_id, other_car_id,
+        distance, closing_speed) when two cars get within radius.
+        closing_speed is in m/s, positive when they get closer
+        on_separation -- optional, called as on_separation(car_id,
+        other_car_id, distance) when they get apart again
+        """
+        self._proximity_watchers.append(on_proximity)
+        if on_separation is not None:
+            self._separation_watchers.append(on_separation)
+
+    def cell(self, pos):
+        """ Return the (x, z) grid cell of a position. """
+        return (int(math.floor(pos[0] / self.cell_size)),
+                int(math.floor(pos[2] / self.cell_size)))
+
+    def _candidates(self, cell, rings):
+        cells = self._cells
+        cell_x, cell_z = cell
+        for x in range(cell_x - rings, cell_x + rings + 1):
+            for z in range(cell_z - rings, cell_z + rings + 1):
+                found = cells.get((x, z))
+                if found:
+                    for car_id in found:
+                        yield car_id
+
+    def query(self, pos, radius=None):
+        """ Find the cars within radius of a position.
+
+        Keyword arguments:
+        pos -- (x, y, z) position
+        radius -- distance in meters (default: None - self.radius)
+
+        Return list of (distance, car_id) tuples, nearest first. """
+        radius = self.radius if radius is None else radius
+        rings = int(math.ceil(radius / self.cell_size))
+        found = []
+        positions = self.pos
+        for car_id in self._candidates(self.cell(pos), rings):
+            other = positions[car_id]
+            distance = math.sqrt((other[0] - pos[0]) ** 2 +
+                                 (other[1] - pos[1]) ** 2 +
+                                 (other[2] - pos[2]) ** 2)
+            if distance <= radius:
+                found.append((distance, car_id))
+        found.sort()
+        return found
+
+    def neighbours(self, car_id, radius=None):
+        """ Return list of (distance, car_id) tuples of the cars within
+        radius of car_id, nearest first. """
+        return [(distance, other) for distance, other
+                in self.query(self.pos[car_id], radius) if other != car_id]
+
+    def update(self, car_id, pos, vel=(0.0, 0.0, 0.0)):
+        """ Move a car, notifying the watchers of proximity changes. """
+        cell = self.cell(pos)
+        old_cell = self._cell_of.get(car_id)
+        if cell != old_cell:
+            if old_cell is not None:
+                self._cells[old_cell].discard(car_id)
+                if not self._cells[old_cell]:
+                    del self._cells[old_cell]
+            self._cells[cell].add(car_id)
+            self._cell_of[car_id] = cell
+        self.pos[car_id] = pos
+        self.vel[car_id] = vel
+        self.density[cell] += 1
+        if not self._proximity_watchers and not self._separation_watchers:
+            return
+        near = self._near[car_id]
+        now_near = set()
+        for other in self._candidates(cell, self._rings):
+            if other == car_id:
+                continue
+            other_pos = self.pos[other]
+            delta = (other_pos[0] - pos[0], other_pos[1] - pos[1],
+                     other_pos[2] - pos[2])
+            distance = math.sqrt(delta[0] ** 2 + delta[1] ** 2 +
+                                 delta[2] ** 2)
+            if distance > self.radius:
+                continue
+            now_near.add(other)
+            if other in near:
+                continue
+            other_vel = self.vel[other]
+            closing = 0.0
+            if distance:
+                closing = -((other_vel[0] - vel[0]) * delta[0] +
+                            (other_vel[1] - vel[1]) * delta[1] +
+                            (other_vel[2] - vel[2]) * delta[2]) / distance
+            self._near[other].add(car_id)
+            self.incidents[cell] += 1
+            for callback in self._proximity_watchers:
+                callback(car_id, other, distance, closing)
+        for other in near - now_near:
+            self._near[other].discard(car_id)
+            if self._separation_watchers:
+                other_pos = self.pos.get(other)
+                distance = None if other_pos is None else math.sqrt(
+                    sum((a - b) ** 2 for a, b in zip(other_pos, pos)))
+                for callback in self._separation_watchers:
+                    callback(car_id, other, distance)
+        self._near[car_id] = now_near
+
+    def remove(self, car_id):
+        """ Remove a car from the index. """
+        cell = self._cell_of.pop(car_id, None)
+        if cell is not None:
+            self._cells[cell].discard(car_id)
+            if not self._cells[cell]:
+                del self._cells[cell]
+        self.pos.pop(car_id, None)
+        self.vel.pop(car_id, None)
+        for other in self._near.pop(car_id, ()):
+            self._near[other].discard(car_id)
+
+    def on_ACSP_CAR_UPDATE(self, event):
+        self.update(event.car_id, event.pos, event.vel)
+
+    def on_ACSP_CONNECTION_CLOSED(self, event):
+        self.remove(event.car_id)
+
+    def on_ACSP_NEW_SESSION(self, _event):
+        self.clear()
+
+
+PAIR_DTYPE = [
+    ('frame', '<i8'),
+    ('car_id', '<u1'),
+    ('other_car_id', '<u1'),
+    ('distance', '<f4'),
+]
+"""Row of proximity_pairs()."""
+
+
+def frames_of(records):
+    """ Number CarUpdate records (see acudpclient.batch.decode_records())
+    by realtime report, assuming the server sends the cars of a report in
+    strictly increasing car_id order: a new report starts whenever car_id
+    doesn't increase. When that order is not guaranteed, number the
+    records with frames_from_timestamps() instead.
+
+    Return numpy array of frame numbers, one per record. """
+    _require_numpy()
+    car_ids = records['car_id'].astype(numpy.int64)
+    frames = numpy.zeros(len(records), dtype=numpy.int64)
+    if len(records) > 1:
+        frames[1:] = numpy.cumsum(car_ids[1:] <= car_ids[:-1])
+    return frames
+
+
+def frames_from_timestamps(timestamps, gap=0.01):
+    """ Number records by realtime report from their receive times (e.g.
+    the timestamps of ACUDPCaptureReader.records()): the datagrams of a
+    report arrive together, so a new report starts after a silence of more
+    than gap seconds, whatever the car_id order.
+
+    Keyword arguments:
+    timestamps -- receive time of each record, in seconds
+    gap -- min silence between two reports, in seconds, below the realtime
+    report interval (default: 0.01)
+
+    Return numpy array of frame numbers, one per record. """
+    _require_numpy()
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    frames = numpy.zeros(len(timestamps), dtype=numpy.int64)
+    if len(timestamps) > 1:
+        frames[1:] = numpy.cumsum(numpy.diff(timestamps) > gap)
+    return frames
+
+
+def proximity_pairs(records, radius=5.0, frames=None, chunk_size=1024):
+    """ Find every pair of cars within radius of each other, per frame,
+    from CarUpdate records (e.g. a whole race capture), in vectorized
+    chunks of frames.
+
+    Keyword arguments:
+    records -- numpy structured array with car_id and pos fields
+    radius -- distance, in meters (default: 5.0)
+    frames -- frame number of each record, e.g. frames_from_timestamps()
+    (default: None - frames_of())
+    chunk_size -- number of frames compared at once (default: 1024)
+
+    Return numpy structured array (see PAIR_DTYPE), car_id < other_car_id.
+    """
+    _require_numpy()
+    if frames is None:
+        frames = frames_of(records)
+    if not len(records):
+        return numpy.zeros(0, dtype=PAIR_DTYPE)
+    car_ids, columns = numpy.unique(records['car_id'], return_inverse=True)
+    frame_count = int(frames.max()) + 1
+    positions = numpy.full((frame_count, len(car_ids), 3), numpy.nan,
+                           dtype=numpy.float32)
+    positions[frames, columns] = records['pos']
+    upper = numpy.triu(numpy.ones((len(car_ids), len(car_ids)), dtype=bool),
+                       1)
+    results = []
+    for start in range(0, frame_count, chunk_size):
+        block = positions[start:start + chunk_size]
+        delta = block[:, :, None, :] - block[:, None, :, :]
+        distances = numpy.sqrt((delta ** 2).sum(axis=-1))
+        with numpy.errstate(invalid='ignore'):
+            close = (distances <= radius) & upper
+        frame, first, second = numpy.nonzero(close)
+        pairs = numpy.zeros(len(frame), dtype=PAIR_DTYPE)
+        pairs['frame'] = frame + start
+        pairs['car_id'] = car_ids[first]
+        pairs['other_car_id'] = car_ids[second]
+        pairs['distance'] = distances[frame, first, second]
+        results.append(pairs)
+    return numpy.concatenate(results)
+
+
+def heatmap(records, cell_size=10.0):
+    """ Count CarUpdate positions per cell of the (x, z) plane.
+
+    Keyword arguments:
+    records -- numpy structured array with a pos field
+    cell_size -- cell size, in meters (default: 10.0)
+
+    Return tuple (2D numpy array of counts indexed by [x cell, z cell],
+    x of the first cell, z of the first cell) - cells are cell_size wide.
+    """
+    _require_numpy()
+    cells = numpy.floor(records['pos'][:, [0, 2]] / cell_size).astype(
+        numpy.int64)
+    if not len(cells):
+        return numpy.zeros((0, 0), dtype=numpy.int64), 0.0, 0.0
+    origin = cells.min(axis=0)
+    cells -= origin
+    counts = numpy.zeros(cells.max(axis=0) + 1, dtype=numpy.int64)
+    numpy.add.at(counts, (cells[:, 0], cells[:, 1]), 1)
+    return counts, origin[0] * cell_size, origin[1] * cell_size
@@ -0,0 +1,177 @@
+"""
+Live per-car state (drivers, positions, laps) kept up to date from
+ACUDPClient events
+"""
+import logging
+import time
+
+LOG = logging.getLogger("ac_udp_state")
+
+
+class ACUDPCar(object):
+    """ State of one car, as last reported by the AC server """
+    __slots__ = (
+        'car_id', 'connected', 'driver_name', 'driver_team', 'driver_guid',
+        'car_model', 'car_skin', 'pos', 'vel', 'gear', 'engine_rpm',
+        'normalized_spline_pos', 'laps', 'last_lap', 'best_lap', 'cuts'
+    )
+
+    def __init__(self, car_id):
+        self.car_id = car_id
+        self.connected = False
+        self.driver_name = None
+        self.driver_team = None
+        self.driver_guid = None
+        self.car_model = None
+        self.car_skin = None
+        self.pos = None
+        self.vel = None
+        self.gear = None
+        self.engine_rpm = None
+        self.normalized_spline_pos = None
+        self.laps = 0
+        self.last_lap = None
+        self.best_lap = None
+        self.cuts = 0
+
+    def __repr__(self):
+        return "<ACUDPCar %s>" % (
+            ' '.join(["%s=%r" % (name, getattr(self, name))
+                      for name in self.__slots__]),)
+
+
+class ACUDPStateStore(object):
+    """ Subscriber keeping an ACUDPCar record per car_id (0-255), updated
+    incrementally from NewConnection, CarInfo, ConnectionClosed, CarUpdate,
+    LapCompleted and NewSession events. Watchers are notified only of values
+    that actually change. When a car_id without driver info shows up, its
+    CarInfo is requested through the client, again every request_timeout
+    seconds until it's known (the reply may be lost). """
+
+    def __init__(self, client=None, request_missing=True,
+                 request_timeout=5.0, clock=time.time):
+        """ Constructor.
+
+        Keyword arguments:
+        client -- ACUDPClient to subscribe to and to request missing car info
+        from (default: None - events are fed by the caller)
+        request_missing -- when True, get_car_info() is called for unknown
+        car_ids (default: True)
+        request_timeout -- seconds to wait for a CarInfo before requesting
+        it again (default: 5.0)
+        clock -- callable returning the current time in seconds
+        """
+        self.client = client
+        self.request_missing = request_missing
+        self.request_timeout = request_timeout
+        self.clock = clock
+        self._cars = [None] * 256
+        # time of the last CarInfo request, by car_id
+        self._requested = {}
+        self._watchers = []
+        if client is not None:
+            client.subscribe(self)
+
+    def __getitem__(self, car_id):
+        """ Return the ACUDPCar of car_id, or None if it's unknown. """
+        return self._cars[car_id]
+
+    def cars(self, connected_only=True):
+        """ Return list of known ACUDPCar records.
+
+        Keyword arguments:
+        connected_only -- only return connected cars (default: True)
+        """
+        return [car for car in self._cars if car is not None and
+                (car.connected or not connected_only)]
+
+    def watch(self, callback, names=None):
+        """ Register a change callback, called as
+        callback(car, name, old_value, new_value) whenever a value changes.
+
+        Keyword arguments:
+        callback -- callable
+        names -- optional collection of ACUDPCar attribute names to watch
+        (default: None - all of them)
+        """
+        self._watchers.append(
+            (callback, None if names is None else frozenset(names)))
+
+    def unwatch(self, callback):
+        """ Remove a change callback. """
+        self._watchers = [(watcher, names) for watcher, names
+                          in self._watchers if watcher != callback]
+
+    def _car(self, car_id):
+        """ Return the ACUDPCar of car_id, creating it when needed, and
+        request its info when no driver is known for it. """
+        car = self._cars[car_id]
+        if car is None:
+            car = self._cars[car_id] = ACUDPCar(car_id)
+        if (car.driver_name is None and self.request_missing and
+                self.client is not None):
+            now = self.clock()
+            requested = self._requested.get(car_id)
+            if requested is None or now - requested >= self.request_timeout:
+                self._requested[car_id] = now
+                self.client.get_car_info(car_id)
+        return car
+
+    def _update(self, car, **values):
+        """ Set values on car, notifying the watchers of the changed ones. """
+        for name, value in values.items():
+            old = getattr(car, name)
+            if old == value:
+                continue
+            setattr(car, name, value)
+            for callback, names in self._watchers:
+                if names is None or name in names:
+                    callback(car, name, old, value)
+
+    def _set_driver(self, event, connected):
+        car = self._cars[event.car_id]
+        if car is None:
+            car = self._cars[event.car_id] = ACUDPCar(event.car_id)
+        self._requested.pop(event.car_id, None)
+        self._update(car, connected=connected,
+                     driver_name=event.driver_name,
+                     driver_guid=event.driver_guid,
+                     car_model=event.car_model,
+                     car_skin=event.car_skin)
+        return car
+
+    def on_ACSP_NEW_CONNECTION(self, event):
+        self._set_driver(event, True)
+
+    def on_ACSP_CAR_INFO(self, event):
+        car = self._set_driver(event, event.is_connected)
+        self._update(car, driver_team=event.driver_team)
+
+    def on_ACSP_CONNECTION_CLOSED(self, event):
+        self._set_driver(event, False)
+
+    def on_ACSP_CAR_UPDATE(self, event):
+        self._update(self._car(event.car_id),
+                     pos=event.pos,
+                     vel=event.vel,
+                     gear=event.gear,
+                     engine_rpm=event.engine_rpm,
+                     normalized_spline_pos=event.normalized_spline_pos)
+
+    def on_ACSP_LAP_COMPLETED(self, event):
+        car = self._car(event.car_id)
+        values = {'last_lap': event.lap_time, 'cuts': event.cuts}
+        if event.cuts == 0 and (car.best_lap is None or
+                                event.lap_time < car.best_lap):
+            values['best_lap'] = event.lap_time
+        self._update(car, **values)
+        for entry in event.cars:
+            if entry.rcar_id == event.car_id or \
+                    self._cars[entry.rcar_id] is not None:
+                self._update(self._car(entry.rcar_id), laps=entry.rlaps)
+
+    def on_ACSP_NEW_SESSION(self, _event):
+        for car in self._cars:
+            if car is not None:
+                self._update(car, laps=0, last_lap=None, best_lap=None,
+                             cuts=0)
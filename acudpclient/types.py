@@ -1,25 +1,53 @@
 """ This module declares core C types used by AC UDP protocol """
+import codecs
+import collections
 import struct
 import sys
+import threading
+
+from acudpclient.exceptions import NotEnoughBytes
+
+# dicts keep their insertion order from python 3.7 on
+_ORDERED_DICTS = sys.version_info >= (3, 7)
+
+
+def _identity(value):
+    """ Default formatter, returns value untouched. """
+    return value
+
+
+def _read(file_obj, size):
+    """ Read size bytes from a file-like object, making sure the result
+    is a bytes object (text streams are encoded as utf8). """
+    bytes_ = file_obj.read(size)
+    if isinstance(bytes_, str):
+        if sys.version_info < (3, 0):
+            bytes_ = bytes(bytes_)
+        else:
+            bytes_ = bytes(bytes_, 'utf8')
+    return bytes_
 
 
 class ACUDPStruct(object):
     """ This class wraps struct module functionality and provides ways to
     read formatted bytes from a file-like object """
-    def __init__(self, fmt, formatter=lambda x: x):
+    def __init__(self, fmt, formatter=_identity):
         """ Constructor.
 
         Keyword arguments:
-        fmt -- struct-like string representing bytes
+        fmt -- struct-like string representing bytes (always read as
+        little-endian)
         formatter -- function called after each file_obj read. It accepts one
         argument - the read bytes
         """
         self.fmt = fmt
         self.formatter = formatter
+        self.struct = struct.Struct('<' + fmt)
+        self.count = len(self.struct.unpack(b'\x00' * self.struct.size))
 
     def size(self):
         """ Return computed size in bytes of self.fmt string """
-        return struct.calcsize(self.fmt)
+        return self.struct.size
 
     def get(self, file_obj, _context=None):
         """ Read self.size() bytes from a file-like object and unpack them
@@ -30,30 +58,115 @@ class ACUDPStruct(object):
 
         Return output of self.formatter (default: string with read bytes).
         """
-        bytes_ = file_obj.read(self.size())
-        if isinstance(bytes_, str):
-            if sys.version_info < (3, 0):
-                bytes_ = bytes(bytes_)
-            else:
-                bytes_ = bytes(bytes_, 'utf8')
-        data = struct.unpack(self.fmt, bytes_)
+        data = self.struct.unpack(_read(file_obj, self.struct.size))
         if len(data) == 1:
             return self.formatter(data[0])
         return self.formatter(data)
 
+    def unpack_from(self, buffer_, offset=0, _context=None):
+        """ Unpack self.fmt from a buffer (bytes, bytearray or memoryview)
+        starting at offset, without copying it.
+
+        Keyword arguments:
+        buffer_ -- buffer object
+        offset -- position in buffer_ to start unpacking from
+
+        Return tuple (output of self.formatter, offset after the read bytes).
+        """
+        data = self.struct.unpack_from(buffer_, offset)
+        offset += self.struct.size
+        if len(data) == 1:
+            return self.formatter(data[0]), offset
+        return self.formatter(data), offset
+
+    def skip(self, _buffer, offset, _context=None):
+        """ Return the offset after this struct, without decoding it. """
+        return offset + self.struct.size
+
+    def pack(self, value, _context=None):
+        """ Return value encoded as bytes (inverse of get()). """
+        if self.count == 1:
+            return self.struct.pack(value)
+        return self.struct.pack(*value)
+
+
+class ACUDPStringCache(object):
+    """ Bounded LRU cache of decoded strings, keyed by their raw bytes.
+    Repeated values (driver names, GUIDs, car models, track names...) are
+    decoded once and every event holding them shares the same str object.
+    The cache is shared by every client, so it is guarded by a lock.
+    """
+    def __init__(self, decoder, maxsize=4096):
+        """ Constructor.
+
+        Keyword arguments:
+        decoder -- function decoding raw bytes into a string
+        maxsize -- max number of cached strings, 0 to disable the cache
+        (default: 4096)
+        """
+        self.decoder = decoder
+        self.maxsize = maxsize
+        self._cache = {} if _ORDERED_DICTS else collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        """ Remove every cached string. """
+        with self._lock:
+            self._cache.clear()
+
+    def decode(self, data):
+        """ Return the string of data (bytes, bytearray or a memoryview),
+        decoding it only if it's not cached.
+
+        A memoryview is copied to bytes to be used as key, even on a hit:
+        the receive buffers are writable (their memoryviews can't be hashed)
+        and reused. The copy (1020 bytes at most) is cheaper than decoding
+        again. """
+        if isinstance(data, memoryview):
+            # bytes(memoryview) is its repr on python 2
+            key = data.tobytes()
+        else:
+            # bytearray slices are not hashable
+            key = data if isinstance(data, bytes) else bytes(data)
+        if not self.maxsize:
+            return self.decoder(key)
+        cache = self._cache
+        with self._lock:
+            # dicts keep insertion order: re-inserting marks key as the most
+            # recently used
+            value = cache.pop(key, None)
+            if value is not None:
+                cache[key] = value
+                return value
+        value = self.decoder(key)
+        with self._lock:
+            if len(cache) >= self.maxsize:
+                del cache[next(iter(cache))]
+            cache[key] = value
+        return value
+
 
 class ACUDPString(object):
     """ This class represents a AC UDP String. """
-    def __init__(self, char_size=1, decoder=lambda x: x.decode('ascii')):
+    def __init__(self, char_size=1,
+                 decoder=lambda x: codecs.decode(x, 'ascii'),
+                 encoder=lambda x: codecs.encode(x, 'ascii')):
         """ Constructor.
 
         Keyword arguments:
         char_size -- size in bytes of a char (ascii = 1)
         decoder -- function used to decode the bytes. It accepts one
-        argument x, the read bytes (default: x.decode('ascii'))
+        argument x, the read bytes or a memoryview over them
+        (default: codecs.decode(x, 'ascii'))
+        encoder -- inverse of decoder, used by pack()
+        (default: codecs.encode(x, 'ascii'))
         """
         self.char_size = char_size
         self.decoder = decoder
+        self.encoder = encoder
 
     def get(self, file_obj, _context=None):
         """ Read a string from a file-like object.
@@ -65,9 +178,34 @@ class ACUDPString(object):
 
         Return output of self.decoder (default: ascii encoded string).
         """
-        size = UINT8.get(file_obj)
-        bytes_ = file_obj.read(self.char_size*size)
-        return self.decoder(bytes_)
+        size = UINT8.struct.unpack(_read(file_obj, 1))[0]
+        return self.decoder(_read(file_obj, self.char_size*size))
+
+    def unpack_from(self, buffer_, offset=0, _context=None):
+        """ Read a string from a buffer starting at offset. The decoder is
+        given a slice of buffer_ (a memoryview slice is not copied).
+
+        Keyword arguments:
+        buffer_ -- buffer object
+        offset -- position in buffer_ to start reading from
+
+        Return tuple (output of self.decoder, offset after the string).
+        """
+        size, offset = UINT8.unpack_from(buffer_, offset)
+        end = offset + self.char_size*size
+        if end > len(buffer_):
+            raise NotEnoughBytes
+        return self.decoder(buffer_[offset:end]), end
+
+    def skip(self, buffer_, offset, _context=None):
+        """ Return the offset after the string starting at offset, reading
+        only its length byte. """
+        size, offset = UINT8.unpack_from(buffer_, offset)
+        return offset + self.char_size*size
+
+    def pack(self, value, _context=None):
+        """ Return value encoded as bytes: length byte and characters. """
+        return UINT8.pack(len(value)) + self.encoder(value)
 
 
 class ACUDPConditionalStruct(object):
@@ -103,6 +241,33 @@ class ACUDPConditionalStruct(object):
             return self.default
         return self.ac_struct.get(file_obj, context)
 
+    def unpack_from(self, buffer_, offset=0, context=None):
+        """
+        Keyword arguments:
+        buffer_ -- buffer object
+        offset -- position in buffer_ to start reading from
+        context -- user defined data.
+
+        Return tuple (ACUDPStruct.unpack_from() value or self.default,
+        offset after the read bytes).
+        """
+        if not self.cond_func(context):
+            return self.default, offset
+        return self.ac_struct.unpack_from(buffer_, offset, context)
+
+    def skip(self, buffer_, offset, context=None):
+        """ Return the offset after this (possibly absent) struct. """
+        if not self.cond_func(context):
+            return offset
+        return self.ac_struct.skip(buffer_, offset, context)
+
+    def pack(self, value, context=None):
+        """ Return value encoded as bytes, or no bytes if self.cond_func
+        returns False. """
+        if not self.cond_func(context):
+            return b''
+        return self.ac_struct.pack(value, context)
+
 
 class ACUDPPacketDataArray(object):
     """ This class represents an array of packet data (ACUDPPacketData). """
@@ -124,6 +289,271 @@ class ACUDPPacketDataArray(object):
             res.append(self.packet_data.from_file(file_obj))
         return res
 
+    def unpack_from(self, buffer_, offset=0, _context=None):
+        """ Same as get() but reading from a buffer, starting at offset.
+
+        Keyword arguments:
+        buffer_ -- buffer object
+        offset -- position in buffer_ to start reading from
+
+        Return tuple (list of ACUDPPacketData blocks, offset after them).
+        """
+        size, offset = UINT8.unpack_from(buffer_, offset)
+        res = []
+        for _ in range(size):
+            data, offset = self.packet_data.from_buffer(buffer_, offset)
+            res.append(data)
+        return res, offset
+
+    def skip(self, buffer_, offset, _context=None):
+        """ Return the offset after the array starting at offset, without
+        decoding its blocks. """
+        size, offset = UINT8.unpack_from(buffer_, offset)
+        for _ in range(size):
+            offset = self.packet_data.skip(buffer_, offset)
+        return offset
+
+    def pack(self, value, _context=None):
+        """ Return the list of blocks encoded as bytes: count byte and
+        blocks. """
+        return UINT8.pack(len(value)) + b''.join(
+            [item.to_bytes() for item in value])
+
+
+class ACUDPField(object):
+    """ A single, variable width, named field of a packet. """
+    def __init__(self, name, data_type):
+        """ Constructor.
+
+        Keyword arguments:
+        name -- attribute name set on the packet instance
+        data_type -- any object providing get(file_obj, context)
+        """
+        self.name = name
+        self.data_type = data_type
+
+    def read(self, file_obj, instance):
+        """ Read the field from a file-like object into instance. """
+        setattr(instance, self.name, self.data_type.get(file_obj, instance))
+
+    def read_from(self, buffer_, offset, instance):
+        """ Read the field from buffer_ at offset into instance.
+
+        Return offset after the field. """
+        val, offset = self.data_type.unpack_from(buffer_, offset, instance)
+        setattr(instance, self.name, val)
+        return offset
+
+
+class ACUDPStructRun(object):
+    """ A run of consecutive fixed width fields (ACUDPStruct) decoded with a
+    single, precompiled, struct.Struct. """
+    def __init__(self, fields):
+        """ Constructor.
+
+        Keyword arguments:
+        fields -- sequence of (name, ACUDPStruct) tuples
+        """
+        self.struct = struct.Struct(
+            '<' + ''.join([data_type.fmt for _, data_type in fields]))
+        self.size = self.struct.size
+        self.fields = []
+        index = 0
+        for name, data_type in fields:
+            formatter = data_type.formatter
+            if formatter is _identity:
+                formatter = None
+            self.fields.append((name, index, data_type.count, formatter))
+            index += data_type.count
+        self.assign = self._compile_assign()
+
+    def _compile_assign(self):
+        """ Generate the assign(instance, data) function, setting the unpacked
+        values (data) as attributes of instance with one plain assignment per
+        field (no setattr loop). """
+        namespace = {}
+        lines = ['def assign(instance, data):']
+        for name, index, count, formatter in self.fields:
+            if count == 1:
+                val = 'data[%d]' % (index,)
+            else:
+                val = 'data[%d:%d]' % (index, index + count)
+            if formatter is not None:
+                namespace['formatter_%d' % (index,)] = formatter
+                val = 'formatter_%d(%s)' % (index, val)
+            lines.append('    instance.%s = %s' % (name, val))
+        exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+        return namespace['assign']
+
+    def read(self, file_obj, instance):
+        """ Read the whole run from a file-like object into instance. """
+        self.assign(instance, self.struct.unpack(_read(file_obj, self.size)))
+
+    def read_from(self, buffer_, offset, instance):
+        """ Read the whole run from buffer_ at offset into instance.
+
+        Return offset after the run. """
+        self.assign(instance, self.struct.unpack_from(buffer_, offset))
+        return offset + self.size
+
+
+def _is_vector(data_type):
+    return (isinstance(data_type, ACUDPStruct) and data_type.count > 1 and
+            data_type.formatter is _identity)
+
+
+def vector_names(name, data_type):
+    """ Return the flat field names of multi value field name: <name>_x,
+    <name>_y, <name>_z for 3 values and <name>_<index> otherwise. """
+    if data_type.count == 3:
+        suffixes = ('x', 'y', 'z')
+    else:
+        suffixes = [str(i) for i in range(data_type.count)]
+    return tuple('%s_%s' % (name, suffix) for suffix in suffixes)
+
+
+def flatten_fields(fields):
+    """ Split multi value fields (e.g. VECTOR3F) into one field per value,
+    named after vector_names(). Fields with a custom formatter are kept as
+    they are.
+
+    Keyword arguments:
+    fields -- sequence of (name, data type) tuples
+
+    Return tuple of (name, data type) tuples.
+    """
+    flat = []
+    for name, data_type in fields:
+        if not _is_vector(data_type):
+            flat.append((name, data_type))
+            continue
+        for fmt, flat_name in zip(data_type.fmt,
+                                  vector_names(name, data_type)):
+            flat.append((flat_name, ACUDPStruct(fmt)))
+    return tuple(flat)
+
+
+def flattened_vectors(fields):
+    """ Return dict of the flat field names of every multi value field that
+    flatten_fields() splits, indexed by field name. """
+    return dict((name, vector_names(name, data_type))
+                for name, data_type in fields if _is_vector(data_type))
+
+
+def static_offsets(fields):
+    """ Compute the offsets of fields that do not depend on the data, i.e.
+    the ones preceded only by fixed width (ACUDPStruct) fields.
+
+    Keyword arguments:
+    fields -- sequence of (name, data type) tuples
+
+    Return list of offsets relative to the first field. When every field has
+    a fixed width, it has one extra item: the total size.
+    """
+    offsets = [0]
+    for _, data_type in fields:
+        if not isinstance(data_type, ACUDPStruct):
+            break
+        offsets.append(offsets[-1] + data_type.size())
+    return offsets
+
+
+def compile_fields(fields):
+    """ Compile a packet _bytes declaration into a tuple of decoding steps.
+    Consecutive ACUDPStruct fields are merged into one ACUDPStructRun, every
+    other type (strings, conditional structs, arrays) becomes an ACUDPField.
+
+    Keyword arguments:
+    fields -- sequence of (name, data type) tuples
+
+    Return tuple of steps, each one providing read(file_obj, instance) and
+    read_from(buffer_, offset, instance).
+    """
+    steps = []
+    run = []
+    for name, data_type in fields:
+        if isinstance(data_type, ACUDPStruct):
+            run.append((name, data_type))
+            continue
+        if run:
+            steps.append(ACUDPStructRun(run))
+            run = []
+        steps.append(ACUDPField(name, data_type))
+    if run:
+        steps.append(ACUDPStructRun(run))
+    return tuple(steps)
+
+
+def compile_serializers(fields, steps, prefix=b''):
+    """ Generate the to_dict(), to_tuple() and to_bytes() methods of a
+    packet class, reading each field with a plain attribute access, and
+    from_tuple(), the inverse of to_tuple(). Arrays of packet data are
+    serialized recursively.
+
+    Keyword arguments:
+    fields -- sequence of (name, data type) tuples
+    steps -- compile_fields(fields) output
+    prefix -- bytes to_bytes() starts with (e.g. the packet type)
+
+    Return tuple of functions (to_dict, to_tuple, to_bytes, from_tuple),
+    from_tuple taking the class as first argument.
+    """
+    namespace = {'prefix': prefix, 'OrderedDict': collections.OrderedDict}
+    items = []
+    values = []
+    arrays = []
+    for index, (name, data_type) in enumerate(fields):
+        if isinstance(data_type, ACUDPPacketDataArray):
+            namespace['data_%d' % (index,)] = data_type.packet_data
+            arrays.append(
+                '    self.%s = [data_%d.from_tuple(item) for item in self.%s]'
+                % (name, index, name))
+            items.append(("'%s'" % (name,),
+                          '[item.to_dict() for item in self.%s]' % (name,)))
+            values.append('tuple([item.to_tuple() for item in self.%s])' % (
+                name,))
+        else:
+            items.append(("'%s'" % (name,), 'self.%s' % (name,)))
+            values.append('self.%s' % (name,))
+    if _ORDERED_DICTS:
+        to_dict = '{%s}' % (', '.join(['%s: %s' % item for item in items]),)
+    else:
+        to_dict = 'OrderedDict([%s])' % (
+            ', '.join(['(%s, %s)' % item for item in items]),)
+    parts = ['prefix']
+    for index, step in enumerate(steps):
+        if isinstance(step, ACUDPStructRun):
+            namespace['struct_%d' % (index,)] = step.struct
+            args = []
+            for name, _, count, _ in step.fields:
+                if count == 1:
+                    args.append('self.%s' % (name,))
+                else:
+                    args.extend(['self.%s[%d]' % (name, i)
+                                 for i in range(count)])
+            parts.append('struct_%d.pack(%s)' % (index, ', '.join(args)))
+        else:
+            namespace['type_%d' % (index,)] = step.data_type
+            parts.append('type_%d.pack(self.%s, self)' % (index, step.name))
+    lines = [
+        'def to_dict(self):',
+        '    return %s' % (to_dict,),
+        'def to_tuple(self):',
+        '    return (%s)' % (''.join([value + ', ' for value in values]),),
+        'def to_bytes(self):',
+        "    return b''.join((%s,))" % (', '.join(parts),),
+        'def from_tuple(cls, row):',
+        '    self = cls()',
+    ]
+    if fields:
+        lines.append('    %s = row' % (''.join(
+            ['self.%s, ' % (name,) for name, _ in fields]),))
+    lines.extend(arrays)
+    lines.append('    return self')
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return (namespace['to_dict'], namespace['to_tuple'],
+            namespace['to_bytes'], namespace['from_tuple'])
+
 
 UINT8 = ACUDPStruct('B')
 BOOL = ACUDPStruct('B', formatter=lambda x: x != 0)
@@ -133,5 +563,8 @@ UINT32 = ACUDPStruct('I')
 INT32 = ACUDPStruct('i')
 FLOAT = ACUDPStruct('f')
 VECTOR3F = ACUDPStruct('fff')
-UTF32 = ACUDPString(4, decoder=lambda x: x.decode('utf32'))
-ASCII = ACUDPString(1, decoder=lambda x: x.decode('ascii'))
+UTF32_STRINGS = ACUDPStringCache(lambda x: codecs.decode(x, 'utf-32-le'))
+ASCII_STRINGS = ACUDPStringCache(lambda x: codecs.decode(x, 'ascii'))
+UTF32 = ACUDPString(4, decoder=UTF32_STRINGS.decode,
+                    encoder=lambda x: codecs.encode(x, 'utf-32-le'))
+ASCII = ACUDPString(1, decoder=ASCII_STRINGS.decode)
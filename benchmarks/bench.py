@@ -0,0 +1,350 @@
+""" acudpclient benchmark suite.
+
+Measures decode cost per packet type, field primitives, subscriber dispatch,
+memory per retained event, loopback throughput/latency and the multi-process
+decoding pipeline, using the tests/ac_out capture and synthetic CarUpdate
+floods.
+
+Usage:
+    python benchmarks/bench.py [--quick] [--output results.json]
+                               [--compare baseline.json] [--threshold 0.2]
+                               [--timeout 30]
+
+With --compare, every metric is compared to the baseline results and the
+script exits with status 1 if any got worse by more than threshold (20%).
+Loopback measurements give up after --timeout seconds; datagrams that
+never made it are reported as lost.
+"""
+import argparse
+import io
+import json
+import marshal
+import multiprocessing
+import os
+import platform
+import socket
+import sys
+import time
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# pylint: disable=wrong-import-position
+from acudpclient import VERSION
+from acudpclient.client import ACUDPClient
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.pipeline import ACUDPPipeline, rebuild_events
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import dump_records, encode_car_update
+from acudpclient.types import UINT8, UINT32, VECTOR3F, UTF32
+
+CAPTURE = os.path.join(os.path.dirname(HERE), 'tests', 'ac_out')
+
+# metrics where a higher value is better, others are costs
+HIGHER_IS_BETTER = ('events_per_s', 'speedup')
+
+
+def _car_update(car_id=1):
+    return encode_car_update(car_id, (1.0, 2.0, 3.0), (4.0, 5.0, 6.0), 3,
+                             6500, 0.5)
+
+
+def _ns_per_op(func, number):
+    """ Return best of 3 runs, in nanoseconds per call. """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(3, number)) / number * 1e9
+
+
+def bench_decode(number):
+    """ Decode cost per packet type, from a buffer and from a file object
+    (stream mode), for the first packet of each type in the capture. """
+    results = {}
+    with open(CAPTURE, 'rb') as file_obj:
+        samples = {}
+        for _, datagram in dump_records(file_obj.read()):
+            samples.setdefault(datagram[0], datagram)
+    samples[ACUDPConst.ACSP_CAR_UPDATE] = _car_update()
+    for type_, datagram in sorted(samples.items()):
+        name = ACUDPConst.id_to_name(type_)
+        results['decode.buffer.%s.ns' % (name,)] = _ns_per_op(
+            lambda: ACUDPPacket.factory_from_buffer(datagram), number)
+        stream = io.BytesIO(datagram)
+
+        def from_file():
+            stream.seek(0)
+            ACUDPPacket.factory(stream)
+        results['decode.file.%s.ns' % (name,)] = _ns_per_op(
+            from_file, number)
+    return results
+
+
+def bench_primitives(number):
+    """ Cost of the field primitives. """
+    data = b'\x07' + b'\x00' * 15
+    string = b'\x05' + u'hello'.encode('utf-32-le')
+    stream = io.BytesIO(data)
+
+    def get_uint8():
+        stream.seek(0)
+        UINT8.get(stream)
+    return {
+        'primitive.UINT8.get.ns': _ns_per_op(get_uint8, number),
+        'primitive.UINT32.unpack_from.ns': _ns_per_op(
+            lambda: UINT32.unpack_from(data, 1), number),
+        'primitive.VECTOR3F.unpack_from.ns': _ns_per_op(
+            lambda: VECTOR3F.unpack_from(data, 1), number),
+        'primitive.UTF32.unpack_from.ns': _ns_per_op(
+            lambda: UTF32.unpack_from(string), number),
+    }
+
+
+class _Subscriber(object):
+    def __init__(self):
+        self.count = 0
+
+    def on_ACSP_CAR_UPDATE(self, _event):
+        self.count += 1
+
+
+def _flood(receive, sender, count, timeout, window=256):
+    """ Send count CarUpdates, as fast as they are received, for up to
+    timeout seconds. Datagrams not received within a second are counted as
+    lost.
+
+    Keyword arguments:
+    receive -- function returning the next received events, waiting up to
+    a second for some
+    sender -- socket connected to the receiving client
+    count -- number of datagrams to send
+    timeout -- max seconds to run
+    window -- max datagrams in flight, to keep the socket buffer from
+    overflowing (default: 256)
+
+    Return (seconds elapsed, events received, datagrams lost) tuple. """
+    datagrams = [_car_update(car_id % 24) for car_id in range(count)]
+    received = lost = sent = 0
+    start = time.perf_counter()
+    deadline = start + timeout
+    while received + lost < count and time.perf_counter() < deadline:
+        while sent < count and sent - received - lost < window:
+            sender.send(datagrams[sent])
+            sent += 1
+        events = receive()
+        if not events:
+            lost = sent - received
+        received += len(events)
+    return time.perf_counter() - start, received, count - received
+
+
+def bench_loopback(count, subscribers=(0, 1, 8), timeout=30.0):
+    """ Events per second through a loopback socket with N subscribers, and
+    send-to-dispatch latency percentiles of single datagrams. Each
+    measurement gives up after timeout seconds; datagrams that were not
+    received are reported as lost. """
+    results = {}
+    for subscriber_count in subscribers:
+        client = ACUDPClient(port=0, rcvbuf=4 * 1024 * 1024)
+        client.listen(datagram=True, pool_size=256)
+        for _ in range(subscriber_count):
+            client.subscribe(_Subscriber())
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+        elapsed, received, lost = _flood(
+            lambda: client.get_next_events(max_events=256, timeout=1),
+            sender, count, timeout)
+        results['loopback.subscribers_%d.events_per_s' % (
+            subscriber_count,)] = received / elapsed
+        results['loopback.subscribers_%d.lost' % (subscriber_count,)] = lost
+
+        latencies = []
+        datagram = _car_update()
+        samples = min(count, 2000)
+        deadline = time.perf_counter() + timeout
+        for _ in range(samples):
+            if time.perf_counter() >= deadline:
+                break
+            start = time.perf_counter()
+            sender.send(datagram)
+            if client.get_next_events(max_events=1, timeout=1):
+                latencies.append(time.perf_counter() - start)
+        results['loopback.subscribers_%d.latency_lost' % (
+            subscriber_count,)] = samples - len(latencies)
+        latencies.sort()
+        for percentile in (50, 90, 99):
+            if not latencies:
+                break
+            index = min(len(latencies) - 1,
+                        len(latencies) * percentile // 100)
+            results['loopback.subscribers_%d.latency_p%d.us' % (
+                subscriber_count, percentile)] = latencies[index] * 1e6
+        sender.close()
+        client.sock.close()
+    return results
+
+
+def bench_pipeline(count, workers=(2, 4), timeout=30.0):
+    """ ACUDPPipeline against decoding in process (ACUDPClient in datagram
+    mode): CPU time left to the receiving process per CarUpdate (sharding
+    the datagrams and rebuilding the events decoded by the workers, against
+    decoding them), and events per second through a loopback socket with N
+    decode workers. The throughput gain needs more free cores than workers
+    (see pipeline.cpus). """
+    results = {'pipeline.cpus': multiprocessing.cpu_count()}
+    client = ACUDPClient(port=0, rcvbuf=4 * 1024 * 1024)
+    client.listen(datagram=True, pool_size=256)
+    datagrams = [(memoryview(_car_update(car_id % 24)), None)
+                 for car_id in range(100)]
+    pipeline = ACUDPPipeline(client, workers=2)
+    rows = marshal.dumps([
+        (event._type, event.to_tuple(), None) for event in
+        (ACUDPPacket.factory_from_buffer(datagram)[0]
+         for datagram, _ in datagrams)])
+    number = max(10, count // 500)
+    results['pipeline.inprocess_decode.ns'] = _ns_per_op(
+        lambda: [ACUDPPacket.factory_from_buffer(datagram)
+                 for datagram, _ in datagrams], number) / len(datagrams)
+    results['pipeline.receiver.ns'] = _ns_per_op(
+        lambda: (pipeline.shard(datagrams, [bytearray(), bytearray()]),
+                 rebuild_events(rows)), number) / len(datagrams)
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    elapsed, received, _ = _flood(
+        lambda: client.get_next_events(max_events=256, timeout=1),
+        sender, count, timeout, window=2048)
+    baseline = received / elapsed
+    results['pipeline.datagram_client.events_per_s'] = baseline
+    for worker_count in workers:
+        pipeline = ACUDPPipeline(client, workers=worker_count)
+        pipeline.start()
+        try:
+            elapsed, received, lost = _flood(
+                lambda: pipeline.get_next_events(timeout=1),
+                sender, count, timeout, window=2048)
+        finally:
+            pipeline.stop()
+        name = 'pipeline.workers_%d' % (worker_count,)
+        results[name + '.events_per_s'] = received / elapsed
+        results[name + '.speedup'] = received / elapsed / baseline
+        results[name + '.lost'] = lost
+    sender.close()
+    client.sock.close()
+    return results
+
+
+def bench_dispatch(count, subscribers=(1, 8)):
+    """ Cost of notifying N subscribers of an event (no socket). """
+    results = {}
+    event, _ = ACUDPPacket.factory_from_buffer(_car_update())
+    for subscriber_count in subscribers:
+        client = ACUDPClient(port=0)
+        for _ in range(subscriber_count):
+            client.subscribe(_Subscriber())
+        handlers = client._handlers
+
+        def dispatch():
+            for handler in handlers[event._type]:
+                handler(event)
+        results['dispatch.subscribers_%d.ns' % (subscriber_count,)] = \
+            _ns_per_op(dispatch, count)
+        client.sock.close()
+    return results
+
+
+def bench_memory(count):
+    """ Bytes allocated per retained CarUpdate event, eager and lazy. """
+    datagram = _car_update()
+    results = {}
+    for lazy in (False, True):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        events = [ACUDPPacket.factory_from_buffer(datagram, lazy=lazy)[0]
+                  for _ in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results['memory.CarUpdate.%s.bytes' % (
+            'lazy' if lazy else 'eager',)] = (after - before) / len(events)
+    return results
+
+
+def run(quick=False, timeout=30.0):
+    """ Run every benchmark.
+
+    Keyword arguments:
+    quick -- fewer iterations
+    timeout -- max seconds per loopback measurement
+
+    Return dict of metric name -> value. """
+    number = 2000 if quick else 20000
+    count = 5000 if quick else 50000
+    results = {}
+    results.update(bench_decode(number))
+    results.update(bench_primitives(number * 5))
+    results.update(bench_dispatch(number * 5))
+    results.update(bench_memory(count))
+    results.update(bench_loopback(count, timeout=timeout))
+    results.update(bench_pipeline(count, timeout=timeout))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Print the change of every metric relative to baseline.
+
+    Return list of regressed metric names. """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        if not baseline[name]:
+            # e.g. datagrams lost where the baseline lost none
+            if name.endswith(HIGHER_IS_BETTER) or not results[name]:
+                continue
+            change = float('inf')
+        else:
+            change = results[name] / baseline[name] - 1
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-55s %12.1f %+7.1f%%%s' % (name, results[name],
+                                          change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer iterations, for smoke runs')
+    parser.add_argument('--output', help='write results to a JSON file')
+    parser.add_argument('--compare', help='baseline JSON results file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='max relative regression (default: 0.2)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='max seconds per loopback measurement '
+                             '(default: 30)')
+    args = parser.parse_args()
+
+    results = run(args.quick, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'version': VERSION,
+                       'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'],
+                                  args.threshold)
+        if regressions:
+            sys.exit(1)
+    else:
+        for name in sorted(results):
+            print('%-55s %12.1f' % (name, results[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import asyncio
+
+from acudpclient.aio import ACUDPAsyncClient
+
+
+class ACEventHandler(object):
+    async def on_ACSP_LAP_COMPLETED(self, event):
+        print(event)
+
+    def on_ACSP_NEW_SESSION(self, event):
+        print(event)
+
+
+async def main():
+    client = ACUDPAsyncClient(port=10000, remote_port=10001)
+    client.subscribe(ACEventHandler())
+    await client.listen()
+    await client.get_session_info()
+    async for event in client:
+        pass
+
+if __name__ == '__main__':
+    asyncio.run(main())
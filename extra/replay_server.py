@@ -0,0 +1,43 @@
+""" Replay a capture, a raw dump or synthetic traffic to an ACUDPClient.
+
+Examples:
+    python extra/replay_server.py --capture /tmp/race.cap --speed 10
+    python extra/replay_server.py --dump tests/ac_out --speed 0
+    python extra/replay_server.py --cars 24 --duration 600 --speed 0
+"""
+import argparse
+
+from acudpclient.capture import ACUDPCaptureReader
+from acudpclient.server import ACUDPReplayServer, dump_records
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', type=int, default=10001)
+parser.add_argument('--client-host', default='127.0.0.1')
+parser.add_argument('--client-port', type=int, default=10000)
+parser.add_argument('--speed', type=float, default=1.0,
+                    help='playback speed factor, 0 for max rate')
+parser.add_argument('--capture', help='capture file (acudpclient.capture)')
+parser.add_argument('--dump', help='raw dump of concatenated packets')
+parser.add_argument('--cars', type=int, default=8,
+                    help='number of synthetic cars')
+parser.add_argument('--duration', type=float, default=60.0,
+                    help='synthetic traffic duration, in seconds')
+parser.add_argument('--interval', type=int, default=100,
+                    help='synthetic CarUpdate interval in ms until the '
+                         'client requests one, 0 to wait for its request')
+args = parser.parse_args()
+
+server = ACUDPReplayServer(args.port, args.client_host, args.client_port,
+                           args.speed or None)
+if args.capture:
+    with ACUDPCaptureReader(args.capture) as reader:
+        sent = server.play(reader)
+elif args.dump:
+    with open(args.dump, 'rb') as dump:
+        sent = server.play(dump_records(dump.read()))
+else:
+    server.add_cars(args.cars)
+    server.interval_ms = args.interval
+    sent = server.play(server.synthetic_records(args.duration))
+print('%d datagrams sent' % (sent,))
+server.close()
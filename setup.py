@@ -31,6 +31,9 @@ setup(name='acudpclient',
     include_package_data=True,
     zip_safe=False,
     install_requires=requires,
+    extras_require={
+        'numpy': ['numpy'],
+    },
     tests_require=requires,
     test_suite="tests"
 )
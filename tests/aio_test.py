@@ -0,0 +1,151 @@
+import asyncio
+import socket
+import struct
+
+from acudpclient.aio import ACUDPAsyncClient
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_info
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class _AsyncHandler(object):
+    def __init__(self):
+        self.events = []
+
+    async def on_ACSP_VERSION(self, event):
+        await asyncio.sleep(0)
+        self.events.append(event)
+
+    def on_ACSP_CLIENT_LOADED(self, event):
+        self.events.append(event)
+
+
+async def _events():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    client = ACUDPAsyncClient(port=0, remote_port=server.getsockname()[1])
+    handler = _AsyncHandler()
+    client.subscribe(handler)
+    await client.listen()
+    try:
+        address = ('127.0.0.1', client.sock.getsockname()[1])
+        server.sendto(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 4), address)
+        server.sendto(struct.pack('<B', 250), address)
+        server.sendto(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 3),
+                      address)
+
+        events = []
+        async for event in client:
+            events.append(event)
+            if len(events) == 2:
+                break
+        await client.get_car_info(3)
+        request = server.recv(16)
+    finally:
+        client.close()
+        server.close()
+    return events, handler.events, request
+
+
+def test_pass_async_client():
+    events, handled, request = _run(_events())
+    assert [e.packet_name() for e in events] == [
+        'ACSP_VERSION', 'ACSP_CLIENT_LOADED']
+    assert handled == events
+    assert request == struct.pack('BB', ACUDPConst.ACSP_GET_CAR_INFO, 3)
+
+
+async def _request():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    client = ACUDPAsyncClient(port=0, remote_port=server.getsockname()[1])
+    await client.listen()
+    loop = asyncio.get_event_loop()
+
+    async def answer():
+        data, _ = await loop.run_in_executor(None, server.recvfrom, 16)
+        assert data == struct.pack('BB', ACUDPConst.ACSP_GET_CAR_INFO, 5)
+        server.sendto(encode_car_info(5, 1, u'model', u'skin', u'driver',
+                                      u'team', u'guid'),
+                      ('127.0.0.1', client.sock.getsockname()[1]))
+
+    try:
+        results = await asyncio.gather(client.request_car_info(5),
+                                       client.request_car_info(5),
+                                       answer())
+    finally:
+        client.close()
+        server.close()
+    return results
+
+
+def test_pass_async_request_car_info():
+    first, second, _ = _run(_request())
+    assert first is second
+    assert first.driver_name == u'driver'
+
+
+async def _selective():
+    client = ACUDPAsyncClient(port=0)
+    received = []
+
+    class _Handler(object):
+        def on_ACSP_CAR_UPDATE(self, event):
+            received.append(event)
+
+    client.subscribe(_Handler(), fields={
+        ACUDPConst.ACSP_CAR_UPDATE: ['car_id']})
+    await client.listen()
+    try:
+        client.datagram_received(struct.pack(
+            '<BB3f3fBHf', ACUDPConst.ACSP_CAR_UPDATE, 4,
+            1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 6500, 0.5))
+        event = await client.get_next_event()
+    finally:
+        client.close()
+    return event, received
+
+
+def test_pass_async_selective_fields():
+    event, received = _run(_selective())
+    assert received == [event]
+    assert event.car_id == 4
+    assert not hasattr(event, 'pos')
+
+
+async def _timed():
+    client = ACUDPAsyncClient(port=0)
+    handler = _AsyncHandler()
+
+    async def slow(event):
+        await asyncio.sleep(0.02)
+        handler.events.append(event)
+    handler.on_ACSP_VERSION = slow
+    client.subscribe(handler, name='slow')
+    metrics = client.enable_metrics()
+    await client.listen()
+    try:
+        client.datagram_received(struct.pack('<BB', ACUDPConst.ACSP_VERSION,
+                                             4))
+        await client.get_next_event()
+    finally:
+        client.close()
+    return metrics.snapshot(), handler.events
+
+
+def test_pass_async_handler_metrics():
+    snapshot, events = _run(_timed())
+    assert len(events) == 1
+    timing = snapshot['handlers_ns']['slow.on_ACSP_VERSION']
+    assert timing['count'] == 1
+    assert timing['max'] >= 0.015 * 1e9
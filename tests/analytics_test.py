@@ -0,0 +1,121 @@
+import struct
+
+import pytest
+
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_update, encode_lap_completed
+
+numpy = pytest.importorskip('numpy')
+from acudpclient.analytics import ACUDPLapAnalytics
+
+
+def _lap(car_id, lap_time, cuts=0, cars=()):
+    return ACUDPPacket.factory_from_buffer(
+        encode_lap_completed(car_id, lap_time, cuts, cars))[0]
+
+
+def _update(car_id, spline):
+    return ACUDPPacket.factory_from_buffer(encode_car_update(
+        car_id, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 3, 6000, spline))[0]
+
+
+def test_pass_lap_stats():
+    analytics = ACUDPLapAnalytics(capacity=2)
+    for car_id, lap_time, cuts in ((1, 90000, 0), (2, 91000, 0),
+                                   (1, 89000, 0), (2, 85000, 2),
+                                   (1, 91000, 0), (2, 92000, 0)):
+        analytics.on_ACSP_LAP_COMPLETED(_lap(car_id, lap_time, cuts))
+
+    stats = analytics.car_stats(1)
+    assert stats['laps'] == 3
+    assert stats['best'] == 89000
+    assert stats['last'] == 91000
+    assert stats['mean'] == 90000
+    assert stats['std'] == pytest.approx(1000)
+    stats = analytics.car_stats(2)
+    assert (stats['laps'], stats['valid_laps'], stats['best']) == \
+        (3, 2, 91000)
+
+    laps = analytics.laps(2)
+    assert laps['lap'].tolist() == [1, 2, 3]
+    assert laps['cuts'].tolist() == [0, 2, 0]
+    session = analytics.session_stats()
+    assert session['car_id'].tolist() == [1, 2]
+    assert session['best'].tolist() == [89000, 91000]
+    assert session['mean'].tolist() == [90000, 91500]
+    assert session['last'].tolist() == [91000, 92000]
+    assert session['std'][0] == pytest.approx(1000)
+    for car_id, row in zip((1, 2), session):
+        assert row['std'] == pytest.approx(analytics.car_stats(car_id)['std'])
+
+    analytics.on_ACSP_NEW_SESSION(None)
+    assert len(analytics.session_stats()) == 0
+
+
+def test_pass_positions_and_gaps():
+    analytics = ACUDPLapAnalytics()
+    changes = []
+    analytics.watch_positions(lambda *change: changes.append(change))
+    analytics.on_ACSP_CAR_UPDATE(_update(1, 0.50))
+    analytics.on_ACSP_CAR_UPDATE(_update(2, 0.40))
+    assert analytics.standings() == [1, 2]
+    assert changes == [(1, None, 1), (2, None, 2)]
+    del changes[:]
+
+    analytics.on_ACSP_CAR_UPDATE(_update(1, 0.95))
+    analytics.on_ACSP_CAR_UPDATE(_update(2, 0.90))
+    assert changes == []
+    # car 2 crosses the line after car 1 wrapped (1 lap + 0.05)
+    analytics.on_ACSP_CAR_UPDATE(_update(1, 0.05))
+    analytics.on_ACSP_LAP_COMPLETED(_lap(1, 90000, cars=[(1, 0, 1, 0),
+                                                         (2, 0, 0, 0)]))
+    analytics.on_ACSP_CAR_UPDATE(_update(2, 0.99))
+    assert changes == []
+    analytics.on_ACSP_CAR_UPDATE(_update(2, 0.10))
+    assert analytics.standings() == [2, 1]
+    assert sorted(changes) == [(1, 1, 2), (2, 2, 1)]
+    assert analytics.position(1) == 2
+
+    gaps = analytics.gaps_to_leader()
+    assert gaps[2] == 0
+    # leader has no valid lap yet, car 1's mean is used
+    assert gaps[1] == pytest.approx(0.05 * 90000)
+
+
+def test_pass_lap_numbers_from_leaderboard():
+    analytics = ACUDPLapAnalytics()
+    # subscribed in the middle of the session
+    analytics.on_ACSP_LAP_COMPLETED(_lap(1, 90000, cars=[(1, 0, 7, 0)]))
+    analytics.on_ACSP_LAP_COMPLETED(_lap(1, 90000))
+    analytics.on_ACSP_LAP_COMPLETED(_lap(1, 90000, cars=[(1, 0, 9, 0)]))
+    assert analytics.laps(1)['lap'].tolist() == [7, 8, 9]
+    assert analytics.car_stats(1)['laps'] == 3
+
+
+def test_pass_connection_closed():
+    analytics = ACUDPLapAnalytics()
+    changes = []
+    analytics.watch_positions(lambda *change: changes.append(change))
+    for car_id, spline in ((1, 0.9), (2, 0.5), (3, 0.1)):
+        analytics.on_ACSP_CAR_UPDATE(_update(car_id, spline))
+    analytics.on_ACSP_LAP_COMPLETED(_lap(2, 90000, cars=[(2, 0, 1, 0)]))
+    del changes[:]
+
+    closed = ACUDPPacket.factory_from_buffer(
+        struct.pack('B', ACUDPConst.ACSP_CONNECTION_CLOSED) +
+        b'\x00\x00' + struct.pack('B', 2) + b'\x00\x00')[0]
+    assert closed.car_id == 2
+    analytics.on_ACSP_CONNECTION_CLOSED(closed)
+    assert analytics.standings() == [1, 3]
+    assert analytics.position(2) is None
+    assert analytics.position(3) == 2
+    assert changes == [(2, 2, None), (3, 3, 2)]
+    assert analytics.car_stats(2)['laps'] == 0
+    assert numpy.isnan(analytics.car_stats(2)['best'])
+    assert len(analytics.laps(2)) == 1
+
+    # a new driver in the slot starts from scratch
+    analytics.on_ACSP_CAR_UPDATE(_update(2, 0.05))
+    assert analytics.standings() == [1, 3, 2]
+    assert analytics.progress[2] == pytest.approx(0.05)
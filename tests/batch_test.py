@@ -0,0 +1,75 @@
+import os
+import struct
+
+import pytest
+
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_update
+
+numpy = pytest.importorskip('numpy')
+from acudpclient import batch
+
+
+def _car_update(car_id, spline):
+    return encode_car_update(car_id, (1.0, 2.0, 3.0), (4.0, 5.0, 6.0), 3,
+                             6500, spline)
+
+
+def test_pass_decode_records():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    with open(raw_file, 'rb') as file_obj:
+        capture = file_obj.read()
+    buffer_ = (_car_update(1, 0.1) + capture + _car_update(2, 0.2) +
+               _car_update(1, 0.3) + capture[:10])
+    records, others, offset, skipped = batch.decode_records(buffer_)
+
+    assert offset == len(buffer_) - 10
+    assert skipped == 0
+    assert len(others) == 395
+    assert list(records['car_id']) == [1, 2, 1]
+    assert records['normalized_spline_pos'][2] == numpy.float32(0.3)
+    assert tuple(records['pos'][0]) == (1.0, 2.0, 3.0)
+    assert records['engine_rpm'][1] == 6500
+
+    event, _ = ACUDPPacket.factory_from_buffer(_car_update(1, 0.1))
+    assert records['vel'][0].tolist() == list(event.vel)
+
+    groups = batch.group_by_car(records)
+    assert sorted(groups) == [1, 2]
+    assert list(groups[1]['normalized_spline_pos']) == [
+        numpy.float32(0.1), numpy.float32(0.3)]
+
+
+def test_fail_variable_size_packet():
+    from acudpclient.packet_base import LapCompleted
+    with pytest.raises(ValueError):
+        batch.record_dtype(LapCompleted)
+
+
+def test_pass_decode_records_skips_bad_packets():
+    bad_chat = struct.pack('<BBB4s', ACUDPConst.ACSP_CHAT, 1, 1,
+                           b'\xff\xff\xff\xff')
+    chat = struct.pack('<BBB4s', ACUDPConst.ACSP_CHAT, 1, 1,
+                       u'a'.encode('utf-32-le'))
+    buffer_ = bad_chat + chat + _car_update(3, 0.5) + b'\xfa' + chat
+    records, others, offset, skipped = batch.decode_records(buffer_)
+    assert skipped == 1
+    assert [event.message for event in others] == [u'a']
+    assert list(records['car_id']) == [3]
+    # unknown packet type: its size is unknown, decoding stops there
+    assert offset == len(bad_chat + chat + _car_update(3, 0.5))
+
+
+def test_pass_decode_records_without_records():
+    chat = struct.pack('<BBB4s', ACUDPConst.ACSP_CHAT, 1, 1,
+                       u'a'.encode('utf-32-le'))
+    records, others, offset, skipped = batch.decode_records(chat * 2)
+    assert len(records) == 0
+    assert records.dtype == batch.record_dtype()
+    assert len(others) == 2
+    assert (offset, skipped) == (len(chat) * 2, 0)
+
+    records, others, offset, _ = batch.decode_records(b'')
+    assert (len(records), others, offset) == (0, [], 0)
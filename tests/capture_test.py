@@ -0,0 +1,158 @@
+import os
+import socket
+import struct
+
+from acudpclient.capture import (ACUDPCaptureReader, ACUDPCaptureWriter,
+                                 index_path, sorted_index_path)
+from acudpclient.client import ACUDPClient
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_lap_completed
+
+
+def _write(path):
+    with ACUDPCaptureWriter(path) as writer:
+        writer.write(encode_lap_completed(5, 1000), 1.0)
+        writer.write(encode_lap_completed(6, 1100), 2.0)
+        writer.write(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 4), 3.0)
+        writer.write(struct.pack('B', ACUDPConst.ACSP_NEW_SESSION), 4.0)
+        writer.write(encode_lap_completed(5, 900), 5.0)
+        writer.write(b'\xfa', 6.0)
+    return writer
+
+
+def test_pass_capture_queries(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    assert _write(path).count == 6
+    with ACUDPCaptureReader(path) as reader:
+        assert len(reader) == 6
+        assert [t for t, _ in reader] == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+        laps = list(reader.events(types=[ACUDPConst.ACSP_LAP_COMPLETED],
+                                  car_id=5))
+        assert [(e.lap_time, e.timestamp) for e in laps] == \
+            [(1000, 1.0), (900, 5.0)]
+        laps = list(reader.events(types=[ACUDPConst.ACSP_LAP_COMPLETED],
+                                  car_id=5, session=1))
+        assert [e.lap_time for e in laps] == [900]
+        # undecodable records (the truncated NewSession, 0xfa) are skipped
+        assert len(list(reader.events())) == 4
+        for _ in reader.records():
+            break
+
+
+def test_pass_capture_rebuilds_index(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    _write(path)
+    with open(index_path(path), 'rb') as index:
+        expected = index.read()
+    os.remove(index_path(path))
+    with ACUDPCaptureReader(path) as reader:
+        assert len(reader) == 6
+    with open(index_path(path), 'rb') as index:
+        assert index.read() == expected
+    # stale index
+    with open(index_path(path), 'wb') as index:
+        index.write(expected[:8] + b'\0' * 20)
+    with ACUDPCaptureReader(path) as reader:
+        assert len(reader) == 6
+    with open(index_path(path), 'rb') as index:
+        assert index.read() == expected
+
+
+def test_pass_capture_sorted_index(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    with ACUDPCaptureWriter(path) as writer:
+        for number in range(300):
+            if number % 100 == 99:
+                writer.write(struct.pack('B', ACUDPConst.ACSP_NEW_SESSION))
+            else:
+                writer.write(encode_lap_completed(number % 7, number))
+    with ACUDPCaptureReader(path) as reader:
+        entries = [reader._entry(number) for number in range(len(reader))]
+        for types, car_id, session in [
+                (None, 3, None), ([ACUDPConst.ACSP_NEW_SESSION], None, None),
+                ([ACUDPConst.ACSP_LAP_COMPLETED], 2, 1), (None, None, 2),
+                ([ACUDPConst.ACSP_NEW_SESSION, ACUDPConst.ACSP_LAP_COMPLETED],
+                 -1, None), (None, 300, None), ([300], None, 5)]:
+            assert list(reader.find(types, car_id, session)) == [
+                offset for offset, session_, type_, car_id_ in entries
+                if (types is None or type_ in types) and
+                (car_id is None or car_id_ == car_id) and
+                (session is None or session_ == session)]
+    # reused while it covers the index, rebuilt when it doesn't
+    with open(sorted_index_path(path), 'rb') as sorted_index:
+        expected = sorted_index.read()
+    os.utime(sorted_index_path(path), (0, 0))
+    with ACUDPCaptureReader(path) as reader:
+        assert list(reader.find(car_id=3)) == [
+            entry[0] for entry in entries if entry[3] == 3]
+    assert os.stat(sorted_index_path(path)).st_mtime == 0
+    with open(index_path(path), 'rb') as index:
+        data = index.read()
+    with open(index_path(path), 'wb') as index:
+        index.write(data[:-13])
+    with ACUDPCaptureReader(path) as reader:
+        # the last record is indexed in memory
+        assert reader._tail == [entries[-1]]
+        assert list(reader.find(types=[ACUDPConst.ACSP_NEW_SESSION])) == [
+            entry[0] for entry in entries if entry[3] == -1]
+        assert list(reader.find(session=3)) == [entries[-1][0]]
+    with open(sorted_index_path(path), 'rb') as sorted_index:
+        assert sorted_index.read() != expected
+
+
+def test_pass_capture_being_written(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    writer = ACUDPCaptureWriter(path)
+    writer.write(encode_lap_completed(5, 1000), 1.0)
+    writer.write(struct.pack('B', ACUDPConst.ACSP_NEW_SESSION), 2.0)
+    writer.flush()
+    # the index lags behind (partly written entry) and the capture ends
+    # with a partly written record
+    writer._file.write(struct.pack('<dH', 3.0, 12) + encode_lap_completed(5, 900))
+    writer._file.flush()
+    writer._index.write(b'\1\2\3')
+    writer._index.flush()
+    with open(index_path(path), 'rb') as index:
+        expected = index.read()
+    with ACUDPCaptureReader(path) as reader:
+        assert len(reader) == 3
+        assert [e.lap_time for e in reader.events(
+            types=[ACUDPConst.ACSP_LAP_COMPLETED], session=1)] == [900]
+        assert list(reader.find(types=[], car_id=5)) == []
+        assert len(list(reader.find(types=[ACUDPConst.ACSP_LAP_COMPLETED,
+                                           ACUDPConst.ACSP_NEW_SESSION]))) == 3
+    with open(index_path(path), 'rb') as index:
+        assert index.read() == expected
+    writer._file.close()
+    writer._index.close()
+
+
+class _Handler(object):
+    def __init__(self):
+        self.events = []
+
+    def on_ACSP_LAP_COMPLETED(self, event):
+        self.events.append(event)
+
+
+def test_pass_client_records_and_replays(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True, timestamps=True)
+    client.recorder = ACUDPCaptureWriter(path)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    for car_id in range(3):
+        sender.send(encode_lap_completed(car_id, 1000 + car_id))
+    received = []
+    while len(received) < 3:
+        received.extend(client.get_next_events(timeout=1))
+    client.recorder.close()
+
+    handler = _Handler()
+    client.subscribe(handler)
+    with ACUDPCaptureReader(path) as reader:
+        assert reader.replay(client) == 3
+    assert [e.lap_time for e in handler.events] == [1000, 1001, 1002]
+    assert [e.timestamp for e in handler.events] == \
+        [e.timestamp for e in received]
@@ -0,0 +1,175 @@
+import socket
+import struct
+import sys
+import time
+
+import pytest
+
+from acudpclient.client import ACUDPClient
+from acudpclient.protocol import ACUDPConst
+
+
+def _client():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    return client, sender
+
+
+def _wait_event(client):
+    for _ in range(10000):
+        event = client.get_next_event()
+        if event is not None:
+            return event
+    return None
+
+
+def test_pass_datagram_mode_skips_bad_datagrams():
+    client, sender = _client()
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 7))
+    sender.send(struct.pack('<B', ACUDPConst.ACSP_LAP_COMPLETED))
+    sender.send(struct.pack('<B', 250))
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 4))
+
+    event = _wait_event(client)
+    assert event.packet_name() == 'ACSP_CLIENT_LOADED'
+    assert event.car_id == 7
+    event = _wait_event(client)
+    assert event.packet_name() == 'ACSP_VERSION'
+    assert event.proto_version == 4
+    assert client.get_next_event() is None
+
+
+class _Handler(object):
+    def __init__(self):
+        self.events = []
+
+    def on_ACSP_CLIENT_LOADED(self, event):
+        self.events.append(event)
+
+    def on_ACSP_VERSION(self, event):
+        self.events.append(event)
+
+
+def test_pass_subscribers_dispatch_table():
+    client, sender = _client()
+    handler = _Handler()
+    filtered = _Handler()
+    assert client.subscribe(handler)
+    assert not client.subscribe(handler)
+    assert client.subscribe(filtered, types=[ACUDPConst.ACSP_VERSION])
+
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 7))
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 4))
+    assert _wait_event(client).car_id == 7
+    assert _wait_event(client).proto_version == 4
+    assert [e.packet_name() for e in handler.events] == [
+        'ACSP_CLIENT_LOADED', 'ACSP_VERSION']
+    assert [e.packet_name() for e in filtered.events] == ['ACSP_VERSION']
+
+    assert client.unsubscribe(handler)
+    assert not client.unsubscribe(handler)
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 8))
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 5))
+    event = None
+    for _ in range(10000):
+        event = client.get_next_event(handled_only=True)
+        if event is not None:
+            break
+    assert event.packet_name() == 'ACSP_VERSION'
+    assert len(handler.events) == 2
+    assert len(filtered.events) == 2
+
+
+def test_pass_subscriber_fields():
+    client, sender = _client()
+    handler = _Handler()
+    client.subscribe(handler, fields={ACUDPConst.ACSP_VERSION: ['proto_version']})
+    assert client._fields == {ACUDPConst.ACSP_VERSION: frozenset(['proto_version'])}
+
+    other = _Handler()
+    client.subscribe(other, types=[ACUDPConst.ACSP_VERSION])
+    assert client._fields == {}
+    client.unsubscribe(other)
+
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_VERSION, 4))
+    assert _wait_event(client).proto_version == 4
+
+
+def test_pass_flat_vectors_client():
+    from acudpclient.spatial import ACUDPSpatialIndex
+    from acudpclient.state import ACUDPStateStore
+
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True, flat_vectors=True)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    store = ACUDPStateStore(client)
+    index = ACUDPSpatialIndex(client)
+    sender.send(struct.pack('<BB3f3fBHf', ACUDPConst.ACSP_CAR_UPDATE, 4,
+                            1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 6500, 0.5))
+    event = _wait_event(client)
+    assert (event.pos_x, event.vel_z) == (1.0, 6.0)
+    assert store[4].pos == (1.0, 2.0, 3.0)
+    assert index.pos[4] == (1.0, 2.0, 3.0)
+
+    # other clients keep decoding vectors as tuples
+    other, other_sender = _client()
+    other_sender.send(struct.pack('<BB3f3fBHf', ACUDPConst.ACSP_CAR_UPDATE,
+                                  4, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 6500,
+                                  0.5))
+    event = _wait_event(other)
+    assert event.pos == (1.0, 2.0, 3.0)
+    assert not hasattr(event, 'pos_x')
+
+
+def test_fail_subscriber_unknown_fields():
+    client = ACUDPClient(port=0)
+    handler = _Handler()
+    with pytest.raises(ValueError):
+        client.subscribe(handler, fields={ACUDPConst.ACSP_VERSION: ['version']})
+    with pytest.raises(ValueError):
+        client.subscribe(handler, fields={200: ['car_id']})
+    assert client.subscribe(handler)
+
+
+def test_pass_get_next_events():
+    client, sender = _client()
+    handler = _Handler()
+    client.subscribe(handler)
+    assert client.get_next_events(timeout=0.01) == []
+
+    for car_id in range(5):
+        sender.send(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, car_id))
+    events = client.get_next_events(max_events=3, timeout=1)
+    while len(events) < 5:
+        events.extend(client.get_next_events(max_events=3, timeout=1))
+    assert [e.car_id for e in events] == list(range(5))
+    assert handler.events == events
+
+
+def test_fail_get_next_events_stream_mode():
+    client = ACUDPClient(port=0)
+    client.listen()
+    with pytest.raises(ValueError):
+        client.get_next_events()
+
+
+def test_pass_receive_timestamps_and_drops():
+    client = ACUDPClient(port=0, rcvbuf=4096)
+    client.listen(datagram=True, timestamps=True, count_drops=True)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    before = time.time()
+    sender.send(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 7))
+    event = _wait_event(client)
+    assert before - 1 <= event.timestamp <= time.time() + 1
+    if sys.platform.startswith('linux') and \
+            hasattr(socket.socket, 'recvmsg_into'):
+        assert client.kernel_drops() == 0
+    else:
+        assert client.kernel_drops() is None
+
+    event.timestamp = None
+    assert event.timestamp is None
@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+from acudpclient.correlation import ACUDPRequestTracker
+from acudpclient.exceptions import RequestTimeout
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import (encode_car_info, encode_new_connection,
+                                encode_session_info)
+
+
+def _car_info(car_id):
+    return encode_car_info(car_id, 1, u'model', u'skin', u'driver', u'team',
+                           u'guid')
+
+
+class _Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pass_coalesce_cache_and_timeout():
+    sent = []
+    clock = _Clock()
+    tracker = ACUDPRequestTracker(sent.append, timeout=1.0, retries=1,
+                                  ttl=5.0, clock=clock)
+    first = tracker.car_info(3)
+    second = tracker.car_info(3)
+    assert first is second
+    assert sent == [struct.pack('BB', ACUDPConst.ACSP_GET_CAR_INFO, 3)]
+
+    event = ACUDPPacket.factory_from_buffer(_car_info(3))[0]
+    tracker.resolve(event)
+    assert first.result(0) is event
+    assert tracker.car_info(3).result(0) is event
+    assert len(sent) == 1
+
+    clock.now = 10.0
+    expired = tracker.car_info(3)
+    assert len(sent) == 2
+    clock.now = 11.0
+    tracker.expire()
+    assert len(sent) == 3
+    clock.now = 12.0
+    tracker.expire()
+    with pytest.raises(RequestTimeout):
+        expired.result(0)
+    assert tracker.pending() == 0
+
+
+def test_pass_cache_dropped_on_connections_and_sessions():
+
+    sent = []
+    tracker = ACUDPRequestTracker(sent.append, ttl=60.0, clock=_Clock())
+    tracker.car_info(3)
+    tracker.car_info(4)
+    tracker.session_info()
+    tracker.resolve(ACUDPPacket.factory_from_buffer(_car_info(3))[0])
+    tracker.resolve(ACUDPPacket.factory_from_buffer(_car_info(4))[0])
+    tracker.resolve(ACUDPPacket.factory_from_buffer(
+        encode_session_info())[0])
+    assert tracker.car_info(3).done() and tracker.session_info().done()
+
+    for type_ in (ACUDPConst.ACSP_NEW_CONNECTION,
+                  ACUDPConst.ACSP_CONNECTION_CLOSED):
+        tracker.resolve(ACUDPPacket.factory_from_buffer(
+            encode_new_connection(3, u'new', u'guid', type_=type_))[0])
+        assert not tracker.car_info(3).done()
+        tracker.resolve(ACUDPPacket.factory_from_buffer(_car_info(3))[0])
+    assert tracker.car_info(4).done()
+
+    tracker.resolve(ACUDPPacket.factory_from_buffer(encode_session_info(
+        type_=ACUDPConst.ACSP_NEW_SESSION))[0])
+    assert not tracker.session_info().done()
+    assert tracker.car_info(4).done()
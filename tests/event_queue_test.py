@@ -0,0 +1,101 @@
+import struct
+import threading
+import time
+
+from acudpclient.event_queue import (ACUDPEventQueue, DROP_NEWEST,
+                                     NEVER_DROP)
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_update
+
+
+def _car_update(car_id):
+    return ACUDPPacket.factory_from_buffer(encode_car_update(
+        car_id, (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 1, 1000, 0.5))[0]
+
+
+def _client_loaded(car_id):
+    data = struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, car_id)
+    return ACUDPPacket.factory_from_buffer(data)[0]
+
+
+def test_pass_drop_oldest_car_update():
+    queue = ACUDPEventQueue(capacity=3)
+    assert queue.put(_car_update(1))
+    assert queue.put(_client_loaded(2))
+    assert queue.put(_car_update(3))
+    assert queue.put(_car_update(4))
+    assert queue.put(_client_loaded(5))
+    assert [queue.get(0).car_id for _ in range(3)] == [2, 4, 5]
+    assert queue.get(0) is None
+
+    stats = queue.stats()
+    assert stats['dropped'] == 2
+    assert stats['dropped_by_type'] == {'ACSP_CAR_UPDATE': 2}
+    assert stats['enqueued'] == 5
+    assert stats['high_water_mark'] == 3
+    assert stats['queued'] == 0
+
+
+def test_pass_drop_newest_and_never_drop():
+    queue = ACUDPEventQueue(capacity=1, policies={
+        ACUDPConst.ACSP_CAR_UPDATE: DROP_NEWEST}, default=NEVER_DROP)
+    assert queue.put(_client_loaded(1))
+    assert not queue.put(_car_update(2))
+    assert not queue.put(_client_loaded(3), timeout=0.01)
+
+    def consume():
+        queue.get()
+    thread = threading.Thread(target=consume)
+    thread.start()
+    assert queue.put(_client_loaded(4), timeout=5)
+    thread.join()
+    assert queue.get(0).car_id == 4
+    assert queue.stats()['dropped'] == 2
+
+
+def test_pass_overload_keeps_order():
+    queue = ACUDPEventQueue(capacity=1000)
+    for car_id in range(500):
+        queue.put(_client_loaded(car_id % 256))
+    for car_id in range(500, 5000):
+        assert queue.put(_car_update(car_id % 256))
+    assert len(queue) == 1000
+    assert queue.stats()['dropped'] == 4000
+    events = [queue.get(0) for _ in range(1000)]
+    assert [e.car_id for e in events[:500]] == [
+        car_id % 256 for car_id in range(500)]
+    assert [e.car_id for e in events[500:]] == [
+        car_id % 256 for car_id in range(4500, 5000)]
+
+    started = time.time()
+    assert queue.get(timeout=0.05) is None
+    assert time.time() - started >= 0.04
+
+
+def test_pass_queue_dispatcher():
+    import socket
+    from acudpclient.client import ACUDPClient
+    from acudpclient.event_queue import ACUDPQueueDispatcher
+
+    received = threading.Event()
+
+    class Handler(object):
+        def on_ACSP_CLIENT_LOADED(self, event):
+            received.set()
+
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True)
+    client.subscribe(Handler())
+    dispatcher = ACUDPQueueDispatcher(client, ACUDPEventQueue())
+    dispatcher.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sender.sendto(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 1),
+                      ('127.0.0.1', client.sock.getsockname()[1]))
+        assert dispatcher.receive(timeout=5) == 1
+        assert received.wait(5)
+    finally:
+        dispatcher.stop()
+        sender.close()
+        client.sock.close()
@@ -0,0 +1,127 @@
+import socket
+import struct
+
+from acudpclient.client import ACUDPClient
+from acudpclient.metrics import (ACUDPHistogram, ACUDPStatsdExporter,
+                                 perf_counter_ns)
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_lap_completed
+
+
+def test_pass_histogram():
+    histogram = ACUDPHistogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.count == 1000
+    assert histogram.max == 1000
+    assert histogram.total == 500500
+    for quantile, expected in ((0.5, 500), (0.9, 900), (0.99, 990)):
+        assert abs(histogram.percentile(quantile) - expected) <= \
+            expected * 0.07
+    assert histogram.percentile(1.0) == 1000
+    assert ACUDPHistogram().percentile(0.5) == 0
+    for value in (0, 15, 16, 17, 31, 32, 1 << 40):
+        index = ACUDPHistogram._index(value)
+        assert ACUDPHistogram._value(index) <= value < \
+            ACUDPHistogram._value(index + 1)
+
+
+class _Handler(object):
+    def __init__(self):
+        self.laps = 0
+
+    def on_ACSP_LAP_COMPLETED(self, event):
+        self.laps += 1
+
+
+def test_pass_client_metrics():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True)
+    handler = _Handler()
+    client.subscribe(handler)
+    assert client._decode == ACUDPPacket.factory_from_buffer
+    metrics = client.enable_metrics()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(('127.0.0.1', client.sock.getsockname()[1]))
+    sender.send(encode_lap_completed(1, 1000))
+    sender.send(encode_lap_completed(2, 1000))
+    sender.send(struct.pack('B', 250))
+    sender.send(struct.pack('B', ACUDPConst.ACSP_LAP_COMPLETED))
+    events = []
+    while len(events) < 2:
+        events.extend(client.get_next_events(timeout=1))
+    while client.get_next_events(timeout=0.05):
+        pass
+    assert handler.laps == 2
+
+    snapshot = metrics.snapshot()
+    assert snapshot['packets'] == {'ACSP_LAP_COMPLETED': 2}
+    assert snapshot['unknown'] == {250: 1}
+    assert snapshot['truncated'] == 1
+    assert snapshot['decode_ns']['ACSP_LAP_COMPLETED']['count'] == 2
+    assert snapshot['handlers_ns'][
+        '_Handler.on_ACSP_LAP_COMPLETED']['count'] == 2
+    text = metrics.to_prometheus()
+    assert 'acudp_packets_total{type="ACSP_LAP_COMPLETED"} 2\n' in text
+    assert 'acudp_unknown_packets_total{type="250"} 1\n' in text
+    assert 'acudp_truncated_packets_total 1\n' in text
+    assert 'acudp_handler_seconds_count{handler=' \
+        '"_Handler.on_ACSP_LAP_COMPLETED"} 2\n' in text
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.settimeout(1)
+    exporter = ACUDPStatsdExporter(
+        metrics, port=listener.getsockname()[1], max_datagram_size=200)
+    datagrams = exporter.flush()
+    assert datagrams > 1
+    lines = []
+    for _ in range(datagrams):
+        payload = listener.recv(4096)
+        assert len(payload) <= 200
+        lines.extend(payload.decode('ascii').split('\n'))
+    assert 'acudp.packets.ACSP_LAP_COMPLETED:2|c' in lines
+    assert 'acudp.truncated:1|c' in lines
+    assert any(line.startswith('acudp.decode.ACSP_LAP_COMPLETED.p99_9:')
+               for line in lines)
+    # counters are sent as deltas
+    exporter.flush()
+    payload = listener.recv(4096).decode('ascii')
+    assert '|c' not in payload
+
+    client.disable_metrics()
+    assert client._decode == ACUDPPacket.factory_from_buffer
+    assert client._handlers[ACUDPConst.ACSP_LAP_COMPLETED] == \
+        (handler.on_ACSP_LAP_COMPLETED,)
+    exporter.close()
+    listener.close()
+    sender.close()
+
+
+def test_pass_perf_counter_ns():
+    first = perf_counter_ns()
+    second = perf_counter_ns()
+    assert isinstance(first, int) or type(first).__name__ == 'long'
+    assert 0 <= second - first < 10 ** 9
+
+
+def test_pass_handler_names():
+    client = ACUDPClient(port=0)
+    first, second, named = _Handler(), _Handler(), _Handler()
+    client.subscribe(first)
+    client.subscribe(second)
+    client.subscribe(named, name='laps')
+    metrics = client.enable_metrics()
+    event, _ = ACUDPPacket.factory_from_buffer(encode_lap_completed(1, 1000))
+    for handler in client._handlers[ACUDPConst.ACSP_LAP_COMPLETED]:
+        handler(event)
+    assert sorted(metrics.snapshot()['handlers_ns']) == [
+        '_Handler#2.on_ACSP_LAP_COMPLETED', '_Handler.on_ACSP_LAP_COMPLETED',
+        'laps.on_ACSP_LAP_COMPLETED']
+    assert (first.laps, second.laps, named.laps) == (1, 1, 1)
+    client.unsubscribe(first)
+    client.subscribe(_Handler())
+    assert sorted(client._subscriber_names.values()) == [
+        '_Handler', '_Handler#2', 'laps']
+    client.sock.close()
@@ -0,0 +1,44 @@
+import socket
+import struct
+
+from acudpclient.multiplexer import ACUDPMultiplexer
+from acudpclient.protocol import ACUDPConst
+
+
+class _Handler(object):
+    def __init__(self):
+        self.events = []
+
+    def on_ACSP_CLIENT_LOADED(self, event):
+        self.events.append(event)
+
+
+def test_pass_multiplexer_round_robin():
+    mux = ACUDPMultiplexer(quantum=2)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        handlers = {}
+        for name in ('a', 'b'):
+            client = mux.add_server(name, port=0)
+            handlers[name] = _Handler()
+            client.subscribe(handlers[name])
+        address_a = ('127.0.0.1', mux.clients['a'].sock.getsockname()[1])
+        address_b = ('127.0.0.1', mux.clients['b'].sock.getsockname()[1])
+        for car_id in range(6):
+            sender.sendto(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED,
+                                      car_id), address_a)
+        sender.sendto(struct.pack('<BB', ACUDPConst.ACSP_CLIENT_LOADED, 100),
+                      address_b)
+
+        events = []
+        while len(events) < 7:
+            events.extend(mux.poll(timeout=1, max_events=3))
+        assert mux.poll(timeout=0) == []
+
+        names = [name for name, _ in events]
+        assert names.index('b') < 3
+        assert [e.car_id for e in handlers['a'].events] == list(range(6))
+        assert [e.car_id for e in handlers['b'].events] == [100]
+    finally:
+        sender.close()
+        mux.close()
@@ -1,7 +1,12 @@
+import json
 import os
+import struct
 
-from acudpclient.packet_base import ACUDPPacket
+import pytest
+
+from acudpclient.packet_base import ACUDPPacket, CarUpdate, flat_vectors
 from acudpclient.exceptions import NotEnoughBytes
+from acudpclient.protocol import ACUDPConst
 
 
 def test_pass_read_events():
@@ -17,3 +22,108 @@ def test_pass_read_events():
         else:
             count += 1
     assert count == 395
+
+
+def test_pass_read_events_from_buffer():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    with open(raw_file, 'rb') as file_obj:
+        buffer_ = memoryview(file_obj.read())
+        file_obj.seek(0)
+        offset = 0
+        count = 0
+        while offset < len(buffer_):
+            event, offset = ACUDPPacket.factory_from_buffer(buffer_, offset)
+            expected = ACUDPPacket.factory(file_obj)
+            assert offset == file_obj.tell()
+            for name, _ in event._bytes:
+                if name != 'cars':
+                    assert getattr(event, name) == getattr(expected, name)
+            count += 1
+    assert count == 395
+
+
+def test_pass_lazy_events_from_buffer():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    with open(raw_file, 'rb') as file_obj:
+        buffer_ = file_obj.read()
+    offset = 0
+    while offset < len(buffer_):
+        event, end = ACUDPPacket.factory_from_buffer(buffer_, offset)
+        lazy, lazy_end = ACUDPPacket.factory_from_buffer(buffer_, offset,
+                                                         lazy=True)
+        assert end == lazy_end
+        with pytest.raises(AttributeError):
+            object.__getattribute__(lazy, event._bytes[-1][0])
+        for name, _ in reversed(event._bytes):
+            if name != 'cars':
+                assert getattr(lazy, name) == getattr(event, name)
+        offset = end
+
+
+def test_pass_selected_fields_from_buffer():
+    data = struct.pack('<BBIBBBIHBBIHBf', ACUDPConst.ACSP_LAP_COMPLETED,
+                       5, 90000, 0, 2, 5, 90000, 3, 1, 2, 91000, 3, 0, 0.5)
+    fields = {ACUDPConst.ACSP_LAP_COMPLETED: ('car_id', 'grip_level')}
+    event, offset = ACUDPPacket.factory_from_buffer(data, fields=fields)
+    assert offset == len(data)
+    assert event.car_id == 5
+    assert event.grip_level == 0.5
+    with pytest.raises(AttributeError):
+        event.cars
+
+    data = struct.pack('<BBBBf', ACUDPConst.ACSP_CLIENT_EVENT,
+                       ACUDPConst.ACSP_CE_COLLISION_WITH_CAR, 1, 2, 9.0)
+    data += struct.pack('<ffffff', 1, 2, 3, 4, 5, 6)
+    fields = {ACUDPConst.ACSP_CLIENT_EVENT: ('impact_speed',)}
+    event, offset = ACUDPPacket.factory_from_buffer(data, fields=fields)
+    assert offset == len(data)
+    assert event.impact_speed == 9.0
+
+    with pytest.raises(NotEnoughBytes):
+        ACUDPPacket.factory_from_buffer(data[:-1], lazy=True)
+
+
+def test_pass_serialize_events():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    with open(raw_file, 'rb') as file_obj:
+        buffer_ = file_obj.read()
+    offset = 0
+    laps = []
+    while offset < len(buffer_):
+        event, end = ACUDPPacket.factory_from_buffer(buffer_, offset)
+        assert event.to_bytes() == buffer_[offset:end]
+        assert type(event).from_tuple(event.to_tuple()).to_bytes() == \
+            event.to_bytes()
+        if event._type == ACUDPConst.ACSP_LAP_COMPLETED:
+            laps.append(event)
+        else:
+            assert event.to_tuple() == tuple(event.to_dict().values())
+        offset = end
+
+    lap = laps[-1]
+    values = lap.to_dict()
+    assert values['lap_time'] == lap.lap_time
+    assert values['cars'][0] == {
+        'rcar_id': lap.cars[0].rcar_id, 'rtime': lap.cars[0].rtime,
+        'rlaps': lap.cars[0].rlaps,
+        'has_completed_flag': lap.cars[0].has_completed_flag}
+    assert lap.to_tuple()[3][0] == lap.cars[0].to_tuple()
+    assert json.loads(lap.to_json()) == values
+
+
+def test_pass_serialize_flat_and_lazy_events():
+    FlatCarUpdate = flat_vectors(CarUpdate)
+
+    data = struct.pack('<BB3f3fBHf', ACUDPConst.ACSP_CAR_UPDATE, 4,
+                       1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 6500, 0.5)
+    event, _ = FlatCarUpdate.from_buffer(data, 1)
+    assert event.to_dict()['pos_y'] == 2.0
+    assert event.to_bytes() == data
+    assert FlatCarUpdate.from_tuple(event.to_tuple()).to_bytes() == data
+    event, _ = CarUpdate.from_buffer(data, 1, lazy=True)
+    assert event.to_tuple() == (4, (1.0, 2.0, 3.0), (4.0, 5.0, 6.0), 3,
+                                6500, 0.5)
+    assert event.to_bytes() == data
@@ -0,0 +1,130 @@
+import socket
+import struct
+import time
+
+from acudpclient.client import ACUDPClient
+from acudpclient.pipeline import ACUDPPipeline, car_id_of
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import (encode_car_update, encode_lap_completed,
+                                encode_new_connection)
+
+
+def test_pass_car_id_of():
+    assert car_id_of(encode_lap_completed(7, 1000)) == 7
+    assert car_id_of(encode_new_connection(9, u'driver', u'guid')) == 9
+    assert car_id_of(struct.pack('B', ACUDPConst.ACSP_VERSION)) is None
+    assert car_id_of(b'') is None
+
+
+class _Handler(object):
+    def __init__(self):
+        self.events = []
+
+    def on_ACSP_LAP_COMPLETED(self, event):
+        self.events.append(event)
+
+
+def test_pass_pipeline_keeps_car_order():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True)
+    handler = _Handler()
+    client.subscribe(handler)
+    pipeline = ACUDPPipeline(client, workers=3)
+    pipeline.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        address = ('127.0.0.1', client.sock.getsockname()[1])
+        for lap in range(20):
+            for car_id in range(4):
+                sender.sendto(encode_lap_completed(car_id, lap), address)
+        sender.sendto(b'\xfa', address)
+        events = []
+        while len(events) < 80:
+            new_events = pipeline.get_next_events(timeout=5)
+            assert new_events
+            events.extend(new_events)
+    finally:
+        pipeline.stop()
+        sender.close()
+        client.sock.close()
+    assert handler.events == events
+    for car_id in range(4):
+        assert [e.lap_time for e in events if e.car_id == car_id] == \
+            list(range(20))
+
+
+def test_pass_pipeline_timestamps_and_stop_with_unread_results():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True, timestamps=True)
+    pipeline = ACUDPPipeline(client, workers=2)
+    pipeline.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        address = ('127.0.0.1', client.sock.getsockname()[1])
+        sender.sendto(encode_lap_completed(1, 1000), address)
+        events = pipeline.get_next_events(timeout=5)
+        assert events[0].timestamp is not None
+        # fill the result pipes without reading them
+        for _ in range(200):
+            for lap in range(30):
+                sender.sendto(encode_lap_completed(lap % 2, lap), address)
+            pipeline._dispatch_datagrams()
+    finally:
+        started = time.time()
+        pipeline.stop(timeout=5)
+        sender.close()
+        client.sock.close()
+    assert time.time() - started < 10
+    assert pipeline._processes == []
+
+
+def test_pass_pipeline_restarts_dead_worker():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True)
+    pipeline = ACUDPPipeline(client, workers=2)
+    pipeline.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        dead = pipeline._processes[1]
+        dead.terminate()
+        dead.join()
+        address = ('127.0.0.1', client.sock.getsockname()[1])
+        events = pipeline.get_next_events(timeout=0.5)
+        assert events == []
+        assert pipeline._processes[1] is not dead
+        sender.sendto(encode_lap_completed(1, 1000), address)
+        events = []
+        while not events:
+            events = pipeline.get_next_events(timeout=5)
+        assert events[0].car_id == 1
+    finally:
+        pipeline.stop()
+        sender.close()
+        client.sock.close()
+
+
+def test_pass_pipeline_flat_vectors_and_strings():
+    client = ACUDPClient(port=0)
+    client.listen(datagram=True, flat_vectors=True)
+    pipeline = ACUDPPipeline(client, workers=2)
+    pipeline.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        address = ('127.0.0.1', client.sock.getsockname()[1])
+        sender.sendto(encode_car_update(3, (1.0, 2.0, 3.0), (4.0, 5.0, 6.0),
+                                        2, 6000, 0.5), address)
+        sender.sendto(encode_new_connection(4, u'driver', u'guid'), address)
+        events = []
+        while len(events) < 2:
+            new_events = pipeline.get_next_events(timeout=5)
+            assert new_events
+            events.extend(new_events)
+    finally:
+        pipeline.stop()
+        sender.close()
+        client.sock.close()
+    events.sort(key=lambda event: event.car_id)
+    assert (events[0].pos_x, events[0].pos_y, events[0].pos_z) == \
+        (1.0, 2.0, 3.0)
+    assert events[0].engine_rpm == 6000
+    assert events[1].driver_name == u'driver'
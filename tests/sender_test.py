@@ -0,0 +1,91 @@
+import struct
+
+import pytest
+
+from acudpclient import commands
+from acudpclient.protocol import ACUDPConst
+from acudpclient.sender import ACUDPCommandQueue
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pass_encode_string_utf32_le_without_bom():
+    data = commands.encode_string(u'hi')
+    assert data == b'\x02h\x00\x00\x00i\x00\x00\x00'
+    assert commands.encode_string(u'hi') is data
+    assert commands.broadcast_message(u'hi') == \
+        struct.pack('B', ACUDPConst.ACSP_BROADCAST_CHAT) + data
+    assert commands.send_message(3, u'hi') == \
+        struct.pack('BB', ACUDPConst.ACSP_SEND_CHAT, 3) + data
+
+
+def test_pass_new_commands():
+    assert commands.kick_user(4) == struct.pack(
+        'BB', ACUDPConst.ACSP_KICK_USER, 4)
+    assert commands.next_session() == struct.pack(
+        'B', ACUDPConst.ACSP_NEXT_SESSION)
+    assert commands.restart_session() == struct.pack(
+        'B', ACUDPConst.ACSP_RESTART_SESSION)
+    assert commands.admin_command(u'/x') == struct.pack(
+        'B', ACUDPConst.ACSP_ADMIN_COMMAND) + commands.encode_string(u'/x')
+    data = commands.set_session_info(1, u'Race', 3, 10, 0, 60)
+    assert data[:2] == struct.pack('BB', ACUDPConst.ACSP_SET_SESSION_INFO, 1)
+    assert data[2:-13] == commands.encode_string(u'Race')
+    assert struct.unpack('<BIII', data[-13:]) == (3, 10, 0, 60)
+
+
+def test_pass_command_queue_rate_limit():
+    client, clock = FakeClient(), FakeClock()
+    queue = ACUDPCommandQueue(client, rate=10.0, burst=5, clock=clock)
+    queue.send_messages(range(8), u'Welcome')
+    queue.kick_user(9)
+    assert len(queue) == 9
+
+    assert queue.flush() == 5
+    assert queue.flush() == 0
+    clock.now = 0.25
+    assert queue.flush() == 2
+    clock.now = 10.0
+    assert queue.flush() == 2
+    assert len(queue) == 0
+    assert client.sent[0] == commands.send_message(0, u'Welcome')
+    assert client.sent[-1] == commands.kick_user(9)
+
+
+def test_pass_command_queue_session_commands():
+    client, clock = FakeClient(), FakeClock()
+    queue = ACUDPCommandQueue(client, clock=clock)
+    queue.next_session()
+    queue.restart_session()
+    queue.set_session_info(1, u'Race', 3, 10, 0, 60)
+    assert queue.flush() == 3
+    assert client.sent == [commands.next_session(),
+                           commands.restart_session(),
+                           commands.set_session_info(1, u'Race', 3, 10, 0,
+                                                     60)]
+
+
+def test_fail_command_queue_coroutine_send():
+    import inspect
+    if not hasattr(inspect, 'iscoroutinefunction'):
+        pytest.skip('python 3.5+')
+    namespace = {}
+    exec('async def send(data):\n    pass\n', namespace)
+    client = FakeClient()
+    client.send = namespace['send']
+    with pytest.raises(TypeError):
+        ACUDPCommandQueue(client)
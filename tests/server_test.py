@@ -0,0 +1,127 @@
+import os
+import time
+
+from acudpclient.capture import ACUDPCaptureWriter, ACUDPCaptureReader
+from acudpclient.client import ACUDPClient
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import (POLL_EVERY, ACUDPReplayServer, dump_records,
+                                encode_car_info, encode_lap_completed,
+                                encode_session_info)
+
+
+def _setup(speed=None):
+    client = ACUDPClient(port=0, remote_port=0)
+    client.listen(datagram=True)
+    server = ACUDPReplayServer(
+        port=0, client_port=client.sock.getsockname()[1], speed=speed)
+    client.remote_port = server.sock.getsockname()[1]
+    return client, server
+
+
+def _receive(client, count):
+    events = []
+    deadline = time.time() + 2
+    while len(events) < count and time.time() < deadline:
+        events.extend(client.get_next_events(timeout=0.1))
+    return events
+
+
+def test_pass_encoders_round_trip():
+    event, _ = ACUDPPacket.factory_from_buffer(
+        encode_lap_completed(3, 90000, 1, [(3, 90000, 2, 0), (4, 0, 1, 1)]))
+    assert (event.car_id, event.lap_time, event.cuts) == (3, 90000, 1)
+    assert [(e.rcar_id, e.rlaps, e.has_completed_flag)
+            for e in event.cars] == [(3, 2, False), (4, 1, True)]
+    event, _ = ACUDPPacket.factory_from_buffer(
+        encode_car_info(2, True, u'model', u'skin', u'name', u'team', u'g'))
+    assert (event.car_id, event.driver_name, event.car_model) == \
+        (2, u'name', u'model')
+    event, _ = ACUDPPacket.factory_from_buffer(encode_session_info(laps=5))
+    assert event.packet_name() == 'ACSP_SESSION_INFO'
+    assert (event.track_name, event.laps) == ('monza', 5)
+
+
+def test_pass_dump_records():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    with open(raw_file, 'rb') as file_obj:
+        records = list(dump_records(file_obj.read()))
+    assert len(records) == 395
+    assert bytearray(records[0][1])[0] == ACUDPConst.ACSP_NEW_SESSION
+
+
+def test_pass_synthetic_traffic_and_requests():
+    client, server = _setup()
+    server.add_cars(3)
+    client.enable_realtime_report(500)
+    client.get_car_info(1)
+    client.get_session_info()
+    time.sleep(0.05)
+    server.handle_requests(0.5)
+    assert server.interval_ms == 500
+    events = _receive(client, 2)
+    assert events[0].packet_name() == 'ACSP_CAR_INFO'
+    assert events[0].driver_name == u'Driver 1'
+    assert events[1].packet_name() == 'ACSP_SESSION_INFO'
+
+    sent = server.play(server.synthetic_records(duration=2.0))
+    # 4 ticks of 3 cars
+    assert sent == 12
+    events = _receive(client, 12)
+    assert [e.car_id for e in events[:3]] == [0, 1, 2]
+    client.sock.close()
+    server.close()
+
+
+def test_pass_synthetic_traffic_without_realtime_reports():
+    server = ACUDPReplayServer(port=0, client_port=0)
+    server.add_cars(2)
+    records = list(server.synthetic_records(duration=2.0, lap_time=1.0))
+    assert [ACUDPPacket.factory_from_buffer(datagram)[0].packet_name()
+            for _, datagram in records] == ['ACSP_LAP_COMPLETED'] * 2
+    server.close()
+
+
+def test_pass_play_polls_requests_in_batches(monkeypatch):
+    client, server = _setup()
+    polls = []
+    handle_requests = server.handle_requests
+    monkeypatch.setattr(server, 'handle_requests',
+                        lambda timeout=0: polls.append(timeout) or
+                        handle_requests(timeout))
+    client.get_session_info()
+    time.sleep(0.05)
+    records = [(None, encode_lap_completed(1, lap_time))
+               for lap_time in range(POLL_EVERY * 2 + 10)]
+    # play() also counts the SessionInfo response
+    assert server.play(records) == len(records) + 1
+    assert polls == [0, 0, 0]
+    assert server.requests[ACUDPConst.ACSP_GET_SESSION_INFO] == 1
+    client.sock.close()
+    server.close()
+
+
+def test_pass_replay_capture_paced(tmpdir):
+    path = str(tmpdir.join('race.cap'))
+    with ACUDPCaptureWriter(path) as writer:
+        writer.write(encode_session_info(ACUDPConst.ACSP_NEW_SESSION,
+                                         name='Qualify'), 100.0)
+        writer.write(encode_lap_completed(1, 1000), 100.1)
+        writer.write(encode_lap_completed(1, 1001), 100.2)
+    client, server = _setup(speed=2.0)
+    start = time.time()
+    with ACUDPCaptureReader(path) as reader:
+        assert server.play(reader) == 3
+    assert time.time() - start >= 0.09
+    events = _receive(client, 3)
+    assert [e.packet_name() for e in events] == [
+        'ACSP_NEW_SESSION', 'ACSP_LAP_COMPLETED', 'ACSP_LAP_COMPLETED']
+
+    client.get_session_info()
+    server.handle_requests(0.5)
+    event = _receive(client, 1)[0]
+    assert event.packet_name() == 'ACSP_SESSION_INFO'
+    assert event.name == 'Qualify'
+    client.sock.close()
+    server.close()
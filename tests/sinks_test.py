@@ -0,0 +1,95 @@
+import json
+import sqlite3
+import time
+
+from acudpclient.packet_base import ACUDPPacket, CarUpdate, flat_vectors
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_update, encode_lap_completed
+from acudpclient.sinks import (ACUDPCarUpdateColumnsSink, ACUDPJSONLinesSink,
+                               ACUDPSQLiteSink, read_columns)
+
+
+def _events():
+    events = []
+    for index in range(5):
+        event, _ = ACUDPPacket.factory_from_buffer(encode_car_update(
+            index, (1.0, 2.0, index), (0.0, 0.0, 0.0), 3, 6000, 0.5))
+        event.timestamp = 10.0 + index
+        events.append(event)
+    event, _ = ACUDPPacket.factory_from_buffer(
+        encode_lap_completed(2, 90000, 0, [(2, 90000, 1, 0)]))
+    events.append(event)
+    return events
+
+
+def _feed(sink, events):
+    for event in events:
+        getattr(sink, 'on_%s' % (event.packet_name(),))(event)
+
+
+def test_pass_repr_is_str():
+    event = _events()[-1]
+    assert isinstance(repr(event), str)
+    assert "lap_time='90000'" in repr(event)
+
+
+def test_pass_jsonl_sink(tmpdir):
+    path = str(tmpdir.join('events.jsonl'))
+    sink = ACUDPJSONLinesSink(path, batch_size=2, flush_interval=10)
+    _feed(sink, _events())
+    deadline = time.time() + 2
+    while sink.written < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sink.written >= 4
+    sink.close()
+    with open(path) as file_obj:
+        lines = [json.loads(line) for line in file_obj]
+    assert len(lines) == 6
+    assert lines[0]['packet'] == 'ACSP_CAR_UPDATE'
+    assert lines[0]['pos'] == [1.0, 2.0, 0.0]
+    assert lines[0]['timestamp'] == 10.0
+    assert lines[-1]['cars'] == [{'rcar_id': 2, 'rtime': 90000, 'rlaps': 1,
+                                  'has_completed_flag': False}]
+
+
+def test_pass_sqlite_sink(tmpdir):
+    path = str(tmpdir.join('events.db'))
+    sink = ACUDPSQLiteSink(path, types=[ACUDPConst.ACSP_LAP_COMPLETED,
+                                        ACUDPConst.ACSP_CAR_UPDATE])
+    _feed(sink, _events())
+    sink.close()
+    assert sink.written == 6
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT COUNT(*) FROM car_update').fetchone() == (5,)
+    assert db.execute('SELECT car_id, lap_time, cuts FROM lap_completed'
+                      ).fetchall() == [(2, 90000, 0)]
+    assert json.loads(db.execute('SELECT cars FROM lap_completed'
+                                 ).fetchone()[0]) == [
+        {'rcar_id': 2, 'rtime': 90000, 'rlaps': 1,
+         'has_completed_flag': False}]
+    db.close()
+
+
+def test_pass_sqlite_sink_flat_vectors(tmpdir):
+    path = str(tmpdir.join('events.db'))
+    sink = ACUDPSQLiteSink(path)
+    event, _ = flat_vectors(CarUpdate).from_buffer(encode_car_update(
+        4, (1.0, 2.0, 3.0), (0.0, 0.0, 0.0), 3, 6000, 0.5), 1)
+    _feed(sink, [event])
+    sink.close()
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT car_id, pos_x, pos_z, gear FROM car_update'
+                      ).fetchall() == [(4, 1.0, 3.0, 3)]
+    db.close()
+
+
+def test_pass_car_update_columns_sink(tmpdir):
+    path = str(tmpdir.join('columns'))
+    sink = ACUDPCarUpdateColumnsSink(path)
+    assert not hasattr(sink, 'on_ACSP_LAP_COMPLETED')
+    _feed(sink, _events()[:5])
+    sink.close()
+    columns = read_columns(path)
+    assert list(columns['car_id']) == [0, 1, 2, 3, 4]
+    assert list(columns['pos_z']) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert list(columns['timestamp']) == [10.0, 11.0, 12.0, 13.0, 14.0]
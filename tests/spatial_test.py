@@ -0,0 +1,110 @@
+import pytest
+
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.server import encode_car_update
+from acudpclient.spatial import ACUDPSpatialIndex
+
+
+def _update(car_id, pos, vel=(0.0, 0.0, 0.0)):
+    return ACUDPPacket.factory_from_buffer(
+        encode_car_update(car_id, pos, vel, 3, 6000, 0.5))[0]
+
+
+def test_pass_query_and_neighbours():
+    index = ACUDPSpatialIndex(radius=5.0)
+    for car_id, pos in ((0, (0.0, 0.0, 0.0)), (1, (3.0, 0.0, 4.0)),
+                        (2, (12.0, 0.0, 0.0)), (3, (-1.0, 0.0, -1.0))):
+        index.on_ACSP_CAR_UPDATE(_update(car_id, pos))
+
+    assert [car_id for _, car_id in index.query((0.0, 0.0, 0.0))] == \
+        [0, 3, 1]
+    assert [car_id for _, car_id in index.query((0.0, 0.0, 0.0), 20.0)] == \
+        [0, 3, 1, 2]
+    assert [car_id for _, car_id in index.neighbours(1)] == [0]
+
+    index.on_ACSP_CAR_UPDATE(_update(1, (100.0, 0.0, 100.0)))
+    assert [car_id for _, car_id in index.neighbours(0)] == [3]
+    index.remove(3)
+    assert index.neighbours(0) == []
+
+
+def test_pass_proximity_callbacks():
+    index = ACUDPSpatialIndex(radius=5.0, cell_size=2.0)
+    near, apart = [], []
+    index.watch(lambda *args: near.append(args),
+                lambda *args: apart.append(args))
+    index.update(0, (0.0, 0.0, 0.0), (0.0, 0.0, 50.0))
+    index.update(1, (0.0, 0.0, 10.0), (0.0, 0.0, 40.0))
+    assert near == []
+
+    index.update(1, (0.0, 0.0, 4.0), (0.0, 0.0, 40.0))
+    assert near == [(1, 0, 4.0, pytest.approx(10.0))]
+    index.update(0, (0.0, 0.0, 1.0), (0.0, 0.0, 50.0))
+    index.update(1, (0.0, 0.0, 4.5), (0.0, 0.0, 40.0))
+    assert len(near) == 1
+    assert sum(index.incidents.values()) == 1
+
+    index.update(0, (0.0, 0.0, 20.0), (0.0, 0.0, 50.0))
+    assert apart == [(0, 1, 15.5)]
+    index.update(1, (0.0, 0.0, 18.0), (0.0, 0.0, 40.0))
+    assert len(near) == 2
+    assert sum(index.density.values()) == 7
+
+
+def test_pass_new_session_clears():
+    index = ACUDPSpatialIndex()
+    index.update(0, (0.0, 0.0, 0.0))
+    index.on_ACSP_NEW_SESSION(None)
+    assert index.query((0.0, 0.0, 0.0)) == []
+    assert not index.density
+
+
+def test_pass_batch_pairs_and_heatmap():
+    numpy = pytest.importorskip('numpy')
+    from acudpclient.batch import decode_records
+    from acudpclient.spatial import frames_of, heatmap, proximity_pairs
+
+    data = b''
+    for frame in range(3):
+        for car_id, x in ((0, 0.0), (1, 3.0 + 2 * frame), (4, 50.0)):
+            data += encode_car_update(car_id, (x, 0.0, 0.0),
+                                      (0.0, 0.0, 0.0), 3, 6000, 0.5)
+    records = decode_records(data)[0]
+    assert frames_of(records).tolist() == [0, 0, 0, 1, 1, 1, 2, 2, 2]
+
+    pairs = proximity_pairs(records, radius=5.0, chunk_size=2)
+    assert pairs['frame'].tolist() == [0, 1]
+    assert pairs['car_id'].tolist() == [0, 0]
+    assert pairs['other_car_id'].tolist() == [1, 1]
+    assert pairs['distance'].tolist() == [3.0, 5.0]
+
+    counts, x, z = heatmap(records, cell_size=10.0)
+    assert (x, z) == (0.0, 0.0)
+    assert counts.shape == (6, 1)
+    assert counts[:, 0].tolist() == [6, 0, 0, 0, 0, 3]
+    assert numpy.sum(counts) == len(records)
+
+
+def test_pass_frames_from_timestamps():
+    pytest.importorskip('numpy')
+    from acudpclient.batch import decode_records
+    from acudpclient.spatial import (frames_from_timestamps, frames_of,
+                                     proximity_pairs)
+
+    data = b''
+    timestamps = []
+    # the cars of a report are not sent in car_id order
+    for frame in range(2):
+        for index, (car_id, x) in enumerate(((3, 0.0), (1, 2.0), (2, 9.0))):
+            data += encode_car_update(car_id, (x, 0.0, 0.0),
+                                      (0.0, 0.0, 0.0), 3, 6000, 0.5)
+            timestamps.append(100.0 + frame * 0.1 + index * 0.0001)
+    records = decode_records(data)[0]
+    assert frames_of(records).tolist() == [0, 1, 1, 1, 2, 2]
+    frames = frames_from_timestamps(timestamps)
+    assert frames.tolist() == [0, 0, 0, 1, 1, 1]
+    pairs = proximity_pairs(records, radius=5.0, frames=frames)
+    assert pairs['frame'].tolist() == [0, 1]
+    assert pairs['car_id'].tolist() == [1, 1]
+    assert pairs['other_car_id'].tolist() == [3, 3]
+    assert frames_from_timestamps([]).tolist() == []
@@ -0,0 +1,93 @@
+import os
+import struct
+
+from acudpclient.exceptions import NotEnoughBytes
+from acudpclient.packet_base import ACUDPPacket
+from acudpclient.protocol import ACUDPConst
+from acudpclient.server import encode_car_info
+from acudpclient.state import ACUDPStateStore
+
+
+class _Client(object):
+    def __init__(self):
+        self.requests = []
+        self.subscribers = []
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def get_car_info(self, car_id):
+        self.requests.append(car_id)
+
+
+def _event(fmt, *values):
+    return ACUDPPacket.factory_from_buffer(struct.pack(fmt, *values))[0]
+
+
+def test_pass_state_store_updates():
+    client = _Client()
+    store = ACUDPStateStore(client)
+    assert client.subscribers == [store]
+    changes = []
+    store.watch(lambda car, name, old, new: changes.append((name, old, new)),
+                names=['gear', 'best_lap', 'laps'])
+
+    update = ('<BBffffffBHf', ACUDPConst.ACSP_CAR_UPDATE, 3,
+              1, 2, 3, 0, 0, 0, 2, 5000, 0.5)
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    assert client.requests == [3]
+    assert store[3].pos == (1.0, 2.0, 3.0)
+    assert changes == [('gear', None, 2)]
+
+    lap = ('<BBIBBBIHBf', ACUDPConst.ACSP_LAP_COMPLETED, 3, 90000, 0,
+           1, 3, 90000, 1, 1, 1.0)
+    store.on_ACSP_LAP_COMPLETED(_event(*lap))
+    assert store[3].best_lap == 90000
+    assert store[3].laps == 1
+    assert changes[1:] == [('best_lap', None, 90000), ('laps', 0, 1)]
+    assert store.cars() == []
+    assert store.cars(connected_only=False) == [store[3]]
+    assert store[4] is None
+
+
+def test_pass_state_store_requests_lost_car_info_again():
+    client = _Client()
+    now = [100.0]
+    store = ACUDPStateStore(client, request_timeout=2.0,
+                            clock=lambda: now[0])
+    update = ('<BBffffffBHf', ACUDPConst.ACSP_CAR_UPDATE, 5,
+              1, 2, 3, 0, 0, 0, 2, 5000, 0.5)
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    now[0] += 1.0
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    assert client.requests == [5]
+    # no CarInfo within request_timeout: asked again
+    now[0] += 1.5
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    assert client.requests == [5, 5]
+    store.on_ACSP_CAR_INFO(ACUDPPacket.factory_from_buffer(encode_car_info(
+        5, True, u'model', u'skin', u'driver', u'team', u'guid'))[0])
+    now[0] += 10.0
+    store.on_ACSP_CAR_UPDATE(_event(*update))
+    assert client.requests == [5, 5]
+
+
+def test_pass_state_store_from_capture():
+    raw_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'ac_out')
+    client = _Client()
+    store = ACUDPStateStore(client)
+    with open(raw_file, 'rb') as file_obj:
+        while True:
+            try:
+                event = ACUDPPacket.factory(file_obj)
+            except NotEnoughBytes:
+                break
+            handler = getattr(store, 'on_%s' % (event.packet_name(),), None)
+            if handler:
+                handler(event)
+    for car in store.cars(connected_only=False):
+        assert car.driver_name is not None
+        if car.best_lap is not None:
+            assert car.best_lap <= car.last_lap or car.cuts
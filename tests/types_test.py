@@ -1,4 +1,6 @@
-from io import StringIO
+# -*- coding: utf-8 -*-
+from io import BytesIO, StringIO
+import struct
 
 import pytest 
 
@@ -33,3 +35,150 @@ def test_pass_with_valid_types():
         class_ = getattr(packet_base, fields[-1])
         assert const in packet_base.ACUDPPacket.packets()
         assert class_ == packet_base.ACUDPPacket.packets().get(const)
+
+
+def test_pass_compile_fixed_width_runs():
+    steps = packet_base.CarUpdate._steps
+    assert len(steps) == 1
+    assert steps[0].struct.format in ('<BffffffBHf', b'<BffffffBHf')
+
+    steps = packet_base.LapCompleted._steps
+    assert [type(step).__name__ for step in steps] == [
+        'ACUDPStructRun', 'ACUDPField', 'ACUDPStructRun']
+
+
+def test_pass_decode_car_update():
+    data = struct.pack('<BBffffffBHf', ACUDPConst.ACSP_CAR_UPDATE, 3,
+                       1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 4, 7000, 0.5)
+    event = packet_base.ACUDPPacket.factory(BytesIO(data))
+    assert event.car_id == 3
+    assert event.pos == (1.0, 2.0, 3.0)
+    assert event.vel == (4.0, 5.0, 6.0)
+    assert event.gear == 4
+    assert event.engine_rpm == 7000
+    assert event.normalized_spline_pos == 0.5
+
+
+def test_pass_id_to_name():
+    assert ACUDPConst.id_to_name(ACUDPConst.ACSP_CAR_UPDATE) == 'ACSP_CAR_UPDATE'
+    assert ACUDPConst.id_to_name(255) is None
+    assert ACUDPConst.id_to_name(-1) is None
+    assert ACUDPConst.id_to_name(1000) is None
+
+
+def test_pass_register_custom_packet():
+    class Custom(packet_base.ACUDPPacket):
+        _type = 250
+        _bytes = (
+            ('value', packet_base.UINT16),
+        )
+
+    try:
+        assert packet_base.ACUDPPacket.packets()[250] is Custom
+        event = packet_base.ACUDPPacket.factory(BytesIO(b'\xfa\x01\x02'))
+        assert isinstance(event, Custom)
+        assert event.value == 0x0201
+        assert event.packet_name() is None
+
+        packet_base.ACUDPPacket.register(Custom, name='CUSTOM')
+        assert event.packet_name() == 'CUSTOM'
+    finally:
+        packet_base.ACUDPPacket._registry[250] = None
+
+
+def test_pass_slots_and_flat_vectors():
+    event = packet_base.CarUpdate()
+    with pytest.raises(AttributeError):
+        event.unknown = 1
+
+    FlatCarUpdate = packet_base.flat_vectors(packet_base.CarUpdate)
+    assert packet_base.flat_vectors(packet_base.CarUpdate) is FlatCarUpdate
+    assert packet_base.ACUDPPacket._registry[FlatCarUpdate._type] is \
+        packet_base.CarUpdate
+    assert packet_base.flat_vectors(packet_base.Chat) is packet_base.Chat
+
+    data = struct.pack('<BffffffBHf', 3, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0,
+                       4, 7000, 0.5)
+    event, offset = FlatCarUpdate.from_buffer(data)
+    assert offset == len(data)
+    assert not hasattr(event, '__dict__')
+    assert (event.pos_x, event.pos_y, event.pos_z) == (1.0, 2.0, 3.0)
+    assert (event.vel_x, event.vel_y, event.vel_z) == (4.0, 5.0, 6.0)
+    assert event.normalized_spline_pos == 0.5
+    # vectors stay readable, without a slot of their own
+    assert event.pos == (1.0, 2.0, 3.0)
+    assert 'pos' not in FlatCarUpdate.__slots__
+    assert not any('pos' in getattr(class_, '__slots__', ())
+                   for class_ in FlatCarUpdate.__mro__)
+
+    lazy, _ = FlatCarUpdate.from_buffer(data, lazy=True)
+    assert lazy.vel == (4.0, 5.0, 6.0)
+    selective, _ = FlatCarUpdate.from_buffer(data, fields=['pos'])
+    assert selective.pos == (1.0, 2.0, 3.0)
+
+
+def test_pass_interned_strings():
+    from acudpclient.types import UTF32, ACUDPStringCache
+
+    data = bytearray(b'\x03' + u'abc'.encode('utf-32-le'))
+    first, end = UTF32.unpack_from(memoryview(data))
+    second, _ = UTF32.unpack_from(bytes(data))
+    assert first == u'abc' and end == 13
+    assert first is second
+    assert UTF32.get(BytesIO(bytes(data))) is first
+    assert UTF32.unpack_from(data)[0] is first
+    chat = bytearray(struct.pack('BB', ACUDPConst.ACSP_CHAT, 2) +
+                     b'\x02' + u'hi'.encode('utf-32-le'))
+    event, _ = packet_base.ACUDPPacket.factory_from_buffer(chat)
+    assert (event.car_id, event.message) == (2, u'hi')
+    # no BOM sniffing: a leading BOM is kept as a character
+    bom = b'\x02' + u'﻿a'.encode('utf-32-le')
+    assert UTF32.unpack_from(bom)[0] == u'﻿a'
+
+    calls = []
+    cache = ACUDPStringCache(lambda x: calls.append(x) or x.decode('ascii'),
+                             maxsize=2)
+    cache.decode(b'a')
+    cache.decode(b'b')
+    cache.decode(b'a')
+    cache.decode(b'c')  # evicts b, the least recently used
+    assert len(cache) == 2
+    cache.decode(b'a')
+    cache.decode(b'b')
+    assert calls == [b'a', b'b', b'c', b'b']
+
+
+def test_pass_disabled_string_cache():
+    from acudpclient.types import ACUDPStringCache
+
+    calls = []
+    cache = ACUDPStringCache(lambda x: calls.append(x) or x.decode('ascii'),
+                             maxsize=0)
+    assert cache.decode(memoryview(bytearray(b'ab'))) == u'ab'
+    assert cache.decode(b'ab') == u'ab'
+    assert calls == [b'ab', b'ab']
+    assert len(cache) == 0
+
+
+def test_pass_string_cache_threads():
+    import threading
+    from acudpclient.types import ACUDPStringCache
+
+    cache = ACUDPStringCache(lambda x: x.decode('ascii'), maxsize=8)
+    errors = []
+
+    def decode(first):
+        try:
+            for index in range(2000):
+                value = (u'%d' % ((first + index) % 32,))
+                assert cache.decode(value.encode('ascii')) == value
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+    threads = [threading.Thread(target=decode, args=(first,))
+               for first in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(cache) <= 8